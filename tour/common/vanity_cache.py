@@ -0,0 +1,173 @@
+#Titanium Tank Vanity URL Cache
+#Shared by the website server and the contest medal distributor. Both scripts import it from this folder.
+
+"""
+=============================================================================
+Titanium Tank Vanity URL Cache
+Copyright (C) 2018 Potato's MvM Servers.  All rights reserved.
+=============================================================================
+
+This program is free software; you can redistribute it and/or modify it under
+the terms of the GNU General Public License, version 3.0, as published by the
+Free Software Foundation.
+
+This program is distributed in the hope that it will be useful, but WITHOUT
+ANY WARRANTY; without even the implied warranty of MERCHANTABILITY or FITNESS
+FOR A PARTICULAR PURPOSE.  See the GNU General Public License for more details.
+
+You should have received a copy of the GNU General Public License along with
+this program.  If not, see <http://www.gnu.org/licenses/>.
+"""
+
+#Imports
+from collections import OrderedDict
+from sqlite3 import Connection
+from threading import Event, Lock
+from time import time
+
+
+
+
+
+#Cache of resolved steam vanity URLs (custom profile URLs), stored on disk so it survives restarts.
+#
+#Names that resolve are kept for a week, and names that don't resolve to anyone are kept for an hour, so nobody can burn
+#through the steam web API quota by looking up the same made up name over and over. Failed API calls aren't cached at all.
+#When several threads look up the same name at once, only the first one calls the API, and the others wait for its answer.
+#
+#The website server and the contest medal distributor both import this module, and share the same database file.
+
+class VanityCache(object):
+
+#Init.
+#
+#db_path is the path of the cache database, and resolve_function the function that calls the steam web API. It's given a
+#vanity URL and returns its steam64 ID, or None if the vanity URL doesn't belong to anyone. ttl and negative_ttl are how long
+#(in seconds) resolved and unknown names are kept, and max_entries the most names kept in memory.
+
+    def __init__(self, db_path, resolve_function, ttl, negative_ttl, max_entries):
+
+        self.resolve_function = resolve_function
+        self.ttl = ttl
+        self.negative_ttl = negative_ttl
+        self.max_entries = max_entries
+        self.lock = Lock()
+        self.db_lock = Lock()
+
+        #Open the database, create the table if it's not there, and drop the names that expired while we were offline.
+        #Every pre-fork website worker and the contest medal distributor write to this file, so wait a while for it to be free:
+        self.db = Connection(db_path, check_same_thread=False, timeout=10.0)
+        self.db.execute("CREATE TABLE IF NOT EXISTS VanityURLs (VanityURL TEXT PRIMARY KEY, Steam64 INTEGER, Expires INTEGER)")
+        self.db.execute("DELETE FROM VanityURLs WHERE Expires <= ?", (int(time()),))
+        self.db.commit()
+
+        #Lowercase vanity URL -> (steam64 ID or None, unix time it expires), least recently used first:
+        self.entries = OrderedDict()
+        for (x, y, z) in self.db.execute("SELECT VanityURL, Steam64, Expires FROM VanityURLs ORDER BY Expires DESC LIMIT ?", (max_entries,)):
+            self.entries[x] = (y, z)
+
+        #Lookups in progress: lowercase vanity URL -> [Event set when it's done, steam64 ID, exception]
+        self.in_flight = dict()
+
+        #Expired names are also cleared out of the database once an hour:
+        self.pruned = time()
+
+        #Counters:
+        self.hits = 0
+        self.misses = 0
+        self.coalesced = 0
+        self.failures = 0
+
+
+
+
+
+#Returns the steam64 ID of a vanity URL, or None if it doesn't belong to anyone.
+#Raises an exception if the steam web API call fails.
+
+    def resolve(self, vanity_url):
+
+        #Steam vanity URLs aren't case sensitive:
+        key = vanity_url.strip().lower()
+
+        with self.lock:
+
+            #Cached and not expired?
+            entry = self.entries.get(key)
+            if entry is not None and entry[1] > time():
+                self.entries.move_to_end(key)
+                self.hits += 1
+                return entry[0]
+
+            #Someone else looking it up already? Wait for their answer:
+            flight = self.in_flight.get(key)
+            if flight is None:
+                flight = self.in_flight[key] = [Event(), None, None]
+                self.misses += 1
+                leader = True
+            else:
+                self.coalesced += 1
+                leader = False
+
+        if not leader:
+            if not flight[0].wait(30):
+                raise TimeoutError("Timed out waiting on the vanity URL lookup of " + key)
+            if flight[2] is not None:
+                raise flight[2]
+            return flight[1]
+
+        #Otherwise, it's on us to call the steam web API:
+        try:
+            steam64 = self.resolve_function(key)
+        except Exception as e:
+            with self.lock:
+                self.failures += 1
+                del self.in_flight[key]
+            flight[2] = e
+            flight[0].set()
+            raise
+
+        #Remember the answer, and hand it to everyone who waited on it.
+        #The lookup is always finished, even if something goes wrong, so later lookups of the name don't wait on it forever:
+        expires = int(time() + (self.ttl if steam64 is not None else self.negative_ttl))
+        try:
+            with self.lock:
+                self.entries[key] = (steam64, expires)
+                self.entries.move_to_end(key)
+                while len(self.entries) > self.max_entries:
+                    self.entries.popitem(last=False)
+                prune = time() - self.pruned >= 3600
+                if prune:
+                    self.pruned = time()
+        finally:
+            with self.lock:
+                del self.in_flight[key]
+            flight[1] = steam64
+            flight[0].set()
+
+        #Then save it to disk. That's only best effort: if the database is busy, the name is just looked up again after a restart.
+        with self.db_lock:
+            try:
+                self.db.execute("INSERT OR REPLACE INTO VanityURLs (VanityURL, Steam64, Expires) VALUES (?,?,?)", (key, steam64, expires))
+                if prune:
+                    self.db.execute("DELETE FROM VanityURLs WHERE Expires <= ?", (int(time()),))
+                self.db.commit()
+            except Exception as e:
+                if self.db.in_transaction:
+                    self.db.rollback()
+                print("Vanity cache error:", e)
+
+        return steam64
+
+
+
+
+
+#Returns the cache counters as a tuple of (name, value) pairs:
+
+    def get_statistics(self):
+
+        with self.lock:
+            return (("vanity_entries", len(self.entries)), ("vanity_hits", self.hits), ("vanity_misses", self.misses),
+                    ("vanity_coalesced", self.coalesced), ("vanity_failures", self.failures))
+
@@ -53,8 +53,13 @@ class DummyMedalServerFake(SimpleHTTPRequestHandler):
 
         #To avoid crashing the whole thread, wrap the entire thing around a try/except.
         #Nothing should crash, but just to be safe...
+        #
+        #Tour servers send a whole wave's worth of wave credits at once to /credits, and single wave credits to /.
         try:
-            self.handle_post_data()
+            if self.path.rstrip("/") == "/credits":
+                self.handle_bulk_post_data()
+            else:
+                self.handle_post_data()
         except Exception as e:
             print("Dummy medal server POST error:", e)
 
@@ -100,6 +105,41 @@ class DummyMedalServerFake(SimpleHTTPRequestHandler):
         #Join it into a single string delimiated by commas, like as if it's a CSV file:
         raw_data = ",".join(data_list)
 
+        #Send it off:
+        self.send_to_receiver(raw_data, False)
+
+
+
+
+
+#Called every time a bulk POST request is sent to this server.
+#The body is the TT API key on the first line, then one "steam64,timestamp,mission,wave" wave credit per line.
+
+    def handle_bulk_post_data(self):
+
+        #Determine how much data we need to read in. Cap it at 64 KB as a sanity limit:
+        content_len = int(self.headers['content-length'])
+        if content_len > 65536:
+            content_len = 65536
+
+        #Read in this data:
+        raw_data = self.rfile.read(content_len).decode()
+
+        #Check the key on the first line. The whole body (key included) is relayed as-is, so the receiving server can validate it too:
+        if raw_data.split("\n", 1)[0].strip() != tt_api_key:
+            return None
+
+        #Send it off, as a single request:
+        self.send_to_receiver(raw_data, True)
+
+
+
+
+
+#Encrypts the given wave credit data and sends it to the receiving server:
+
+    def send_to_receiver(self, raw_data, bulk):
+
         #Sending plaintext data over the internet is retarded, it's so best to encrypt the whole string first before transmission.
         #Use AES encryption to encrypt the string. The key is known to both the client and the server, so we can easily decode it.
         encrypted_data = self.encrypt_string(raw_data)
@@ -116,6 +156,8 @@ class DummyMedalServerFake(SimpleHTTPRequestHandler):
         
         #Pack the given parameters into a dictionary.
         post_fields = {"data":b16_encrypted, "hash":hash_value}
+        if bulk:
+            post_fields["bulk"] = 1
         encoded_post_fields = urlencode(post_fields).encode()
 
         #Create the POST request to send to the dummy medal server and send it:
@@ -230,10 +272,10 @@ class DummyMedalServerReceive(SimpleHTTPRequestHandler):
         self.send_response(200)
         self.end_headers()
 
-        #Determine how much data we need to read in. Cap it at 4096 bytes as a sanity limit:
+        #Determine how much data we need to read in. Cap it at 256 KB as a sanity limit (bulk requests are that big, once encoded):
         content_len = int(self.headers['content-length'])
-        if content_len > 4096:
-            content_len = 4096
+        if content_len > 262144:
+            content_len = 262144
 
         #Read in this data:
         post_body = self.rfile.read(content_len)
@@ -255,6 +297,14 @@ class DummyMedalServerReceive(SimpleHTTPRequestHandler):
         #Then decrypt the AES-encrypted data:
         string_data = self.decrypt_string(encrypted_data)
 
+        #Bulk wave credits: check the key on the first line, then relay the whole thing to the real medal server in one request.
+        if "bulk" in params_dict:
+            if string_data.split("\n", 1)[0].strip() != tt_api_key:
+                return None
+            request = Request("http://localhost:65432/credits", string_data.encode(), {"Content-Type": "text/plain"})
+            urlopen(request)
+            return None
+
         #Split it along the commas to grab the individual pieces:
         (steamid, timestamp, mission_index, wave_number, tt_key) = string_data.split(",")
 
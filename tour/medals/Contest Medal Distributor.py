@@ -23,9 +23,15 @@ this program.  If not, see <http://www.gnu.org/licenses/>.
 #Imports
 from csv import reader
 from json import JSONDecoder
+from os.path import abspath, dirname, join
+from sys import path as sys_path
 from urllib.parse import urlencode
 from urllib.request import Request, urlopen
 
+#The vanity URL cache is shared with the website server, in the common folder:
+sys_path.append(join(dirname(abspath(__file__)), "..", "common"))
+from vanity_cache import VanityCache
+
 
 
 
@@ -38,9 +44,10 @@ class potato(object):
 
     def __init__(self):
 
-        #Grab the steam web API key and medal promoid:
+        #Grab the steam web API key and medal promoid, and the steam API's base URL (optional, for testing against a stand-in server):
         self.web_api_key = None
         self.promoid = None
+        self.steam_api_url = "https://api.steampowered.com"
         with open("../data/Steam API.csv", mode="r", encoding="UTF-8") as f:
             for x in reader(f):
                 cell = x[0].strip().lower()
@@ -48,6 +55,8 @@ class potato(object):
                     self.web_api_key = x[1]
                 elif cell == "promoid":
                     self.promoid = x[1]
+                elif cell == "baseurl":
+                    self.steam_api_url = x[1].strip().rstrip("/")
 
         #These cannot remain as None:
         if self.web_api_key is None:
@@ -55,6 +64,9 @@ class potato(object):
         if self.promoid is None:
             raise RuntimeError("Missing medal promoID")
 
+        #Resolved steam vanity URLs, shared with the website server:
+        self.vanity_cache = VanityCache("../data/mvm_titanium_tank_vanity_cache.sq3", self.fetch_vanity_url, 7*86400, 3600, 100000)
+
 
 
 
@@ -146,18 +158,31 @@ class potato(object):
         if split_url[-2] == "profiles":
             return param
 
-        #Otherwise, treat it as a custom URL. We need to resolve it via the steam API.
+        #Otherwise, treat it as a custom URL. We need to resolve it via the steam API (or the vanity URL cache):
+        try:
+            steam64 = self.vanity_cache.resolve(param)
+        except:
+            return None
+
+        #Return None to denote failure:
+        return str(steam64) if steam64 is not None else None
+
+
+
+
+
+#Asks the steam web API for the steam64 ID of a vanity URL. Returns None if the vanity URL doesn't belong to anyone.
+#The vanity URL cache calls this when a name isn't cached, so don't call it directly.
+
+    def fetch_vanity_url(self, vanity_url):
 
         #Create the GET parameters and build the full API call to resolve the vanity URL:
-        params = urlencode({'key':self.web_api_key, 'vanityurl': param})
-        url = "https://api.steampowered.com/ISteamUser/ResolveVanityURL/v1/?" + params
+        params = urlencode({'key':self.web_api_key, 'vanityurl': vanity_url})
+        url = self.steam_api_url + "/ISteamUser/ResolveVanityURL/v1/?" + params
 
         #Open the response and read it in:
-        try:
-            with urlopen(url) as f:
-                data = f.read().decode()
-        except:
-            return None
+        with urlopen(url, timeout=10) as f:
+            data = f.read().decode()
 
         #Parse the resulting json:
         json_parser = JSONDecoder()
@@ -166,11 +191,9 @@ class potato(object):
         #Grab the response node:
         response_node = root["response"]
 
-        #If the API call was a success, return the steam ID:
+        #If the API call was a success, return the steam ID. Otherwise, nobody has this vanity URL:
         if response_node["success"] == 1:
-            return response_node["steamid"]
-
-        #Otherwise, return None to denote failure:
+            return int(response_node["steamid"])
         return None
 
 
@@ -210,7 +233,7 @@ class potato(object):
         encoded_post_fields = urlencode(post_fields).encode()
 
         #Create the POST request to send to the steam API / item server.
-        request = Request("https://api.steampowered.com/ITFPromos_440/GrantItem/v1/", encoded_post_fields)
+        request = Request(self.steam_api_url + "/ITFPromos_440/GrantItem/v1/", encoded_post_fields)
 
         #Send the request and read the response:
         response = urlopen(request)
@@ -23,19 +23,112 @@ this program.  If not, see <http://www.gnu.org/licenses/>.
 """
 
 #Imports
+from array import array
+from collections import deque, OrderedDict
 from csv import reader
+from heapq import heappush, heappop
 from http.server import SimpleHTTPRequestHandler, HTTPServer
 from json import JSONDecoder
+from os import fsync, replace
+from os.path import isfile
+from random import uniform
+from socket import socket, AF_INET, SOCK_DGRAM
 from socketserver import ThreadingMixIn, TCPServer
 from sqlite3 import Connection
-from threading import Thread
-from time import time, sleep
+from struct import Struct
+from threading import Thread, Condition, Event, Lock
+from time import time, monotonic
 from urllib.parse import urlencode, parse_qs
 from urllib.request import Request, urlopen
 
 
 
 
+#####################################################
+#####################################################
+#####################################################
+
+
+#Schema migrations for the tour progress database, applied in order.
+#
+#The database's user_version pragma holds how many of these have been applied so far. To change the
+#schema, add a new migration at the end of this tuple - never edit one that has already shipped.
+
+DATABASE_MIGRATIONS = (
+
+    #1: The original tables.
+    #The first table stores all the individual wave credits.
+    #The second table stores the recepients of the participant medal.
+    (
+        "CREATE TABLE IF NOT EXISTS WaveCredits (Steam64 Text, TimeStamp Int, MissionIndex Int, WaveNumber Int)",
+        "CREATE TABLE IF NOT EXISTS MedalOwners (Steam64 Text, TimeStamp Int)",
+    ),
+
+    #2: Rebuild both tables with INTEGER steam IDs, and give WaveCredits a primary key and a player index.
+    #
+    #CreditID is an alias of the rowid, so existing rowids are kept as-is (the website tracks them) and the
+    #website's "rowid > ?" reads become a range seek on the primary key. The player index turns per-player
+    #lookups into an index search instead of a full table scan. (Sourcepawn still sends the steam ID as a
+    #string, but the medal server converts it to an integer before it gets here.)
+    (
+        "CREATE TABLE WaveCredits_New (CreditID INTEGER PRIMARY KEY, Steam64 INTEGER NOT NULL, TimeStamp INTEGER NOT NULL, MissionIndex INTEGER NOT NULL, WaveNumber INTEGER NOT NULL)",
+        "INSERT INTO WaveCredits_New (CreditID, Steam64, TimeStamp, MissionIndex, WaveNumber) SELECT rowid, CAST(Steam64 AS INTEGER), TimeStamp, MissionIndex, WaveNumber FROM WaveCredits",
+        "DROP TABLE WaveCredits",
+        "ALTER TABLE WaveCredits_New RENAME TO WaveCredits",
+        "CREATE INDEX WaveCredits_Player ON WaveCredits (Steam64, MissionIndex, WaveNumber)",
+        "CREATE TABLE MedalOwners_New (Steam64 INTEGER PRIMARY KEY, TimeStamp INTEGER NOT NULL)",
+        "INSERT OR IGNORE INTO MedalOwners_New (Steam64, TimeStamp) SELECT CAST(Steam64 AS INTEGER), TimeStamp FROM MedalOwners ORDER BY TimeStamp",
+        "DROP TABLE MedalOwners",
+        "ALTER TABLE MedalOwners_New RENAME TO MedalOwners",
+    ),
+
+    #3: Deduplicated first wave credits, idempotency keys, and a small table for server bookkeeping.
+    #
+    #FirstWaveCredits holds one row per (player, mission, wave) with the earliest timestamp, next to the raw
+    #WaveCredits audit log. It stays tiny no matter how many times players grind the same waves.
+    #IngestKeys remembers recently recorded request IDs so that retried POST requests aren't counted twice.
+    #ServerState holds "FirstCreditsRowID", the WaveCredits rowid FirstWaveCredits is up to date with.
+    (
+        "CREATE TABLE FirstWaveCredits (Steam64 INTEGER NOT NULL, MissionIndex INTEGER NOT NULL, WaveNumber INTEGER NOT NULL, TimeStamp INTEGER NOT NULL, PRIMARY KEY (Steam64, MissionIndex, WaveNumber)) WITHOUT ROWID",
+        "INSERT INTO FirstWaveCredits (Steam64, MissionIndex, WaveNumber, TimeStamp) SELECT Steam64, MissionIndex, WaveNumber, MIN(TimeStamp) FROM WaveCredits GROUP BY Steam64, MissionIndex, WaveNumber",
+        "CREATE TABLE IngestKeys (RequestID TEXT PRIMARY KEY, TimeStamp INTEGER NOT NULL) WITHOUT ROWID",
+        "CREATE INDEX IngestKeys_TimeStamp ON IngestKeys (TimeStamp)",
+        "CREATE TABLE ServerState (Name TEXT PRIMARY KEY, Value INTEGER NOT NULL) WITHOUT ROWID",
+        "INSERT INTO ServerState (Name, Value) SELECT 'FirstCreditsRowID', IFNULL(MAX(CreditID), 0) FROM WaveCredits",
+    ),
+
+    #4: Medal grants that haven't gone through yet, so failed medal drops keep being retried across restarts.
+    #NextAttempt is the unix time of the next try, Attempts is how many tries have failed so far.
+    (
+        "CREATE TABLE PendingGrants (Steam64 INTEGER PRIMARY KEY, Attempts INTEGER NOT NULL, NextAttempt INTEGER NOT NULL, TimeStamp INTEGER NOT NULL)",
+    ),
+
+    #5: Pending grants that Steam has taken already, but that haven't been recorded in MedalOwners yet.
+    #Those only need the database write retried, not the medal drop.
+    (
+        "ALTER TABLE PendingGrants ADD COLUMN Granted INTEGER NOT NULL DEFAULT 0",
+    ),
+)
+
+
+
+
+
+#Header of the progress snapshot file. The snapshot is the progress store's two hash table arrays, followed by
+#the steam IDs of the medal recepients, all dumped straight from memory (see potato.save_progress_snapshot).
+#
+#Fields: magic, format version, last WaveCredits rowid applied, time it was taken, then the tour signature
+#(completed tour bitflags, bits per mission, number of missions), hash table slots and number of medal recepients.
+#Everything is in native byte order, so a snapshot is only meant to be loaded on the machine that wrote it.
+
+SNAPSHOT_HEADER = Struct("=4sIQQQIIQQ")
+SNAPSHOT_MAGIC = b"TTPS"
+SNAPSHOT_VERSION = 1
+
+
+
+
+
 #####################################################
 #####################################################
 #####################################################
@@ -59,23 +152,46 @@ class TourProgressHandler(SimpleHTTPRequestHandler):
 
         #To avoid crashing the whole thread, wrap the entire thing around a try/except.
         #Nothing should crash, but just to be safe...
+        #Wave credits come in one per request, or in bulk (a whole wave's worth at once) on /credits.
+        http_code = 200
         try:
-            self.handle_post_data()
+            if self.path.rstrip("/") == "/credits":
+                http_code = self.handle_bulk_post_data()
+            else:
+                http_code = self.handle_post_data()
         except Exception as e:
             print("Medal server POST error:", e)
 
+        #Send the HTTP code back to the request.
+        #This is always 200, unless the wave credits queue is full and we had to turn the request away (or a bulk request was malformed).
+        self.send_response(http_code)
+        self.end_headers()
+
+
+
+
+
+#Called every time a GET request is sent to this server.
+#
+#The only thing served here is the ingest statistics, so we can keep an eye on the queue during a tour.
+
+    def do_GET(self):
+
+        #Wrap it around a try/except, just like the POST requests:
+        try:
+            self.serve_statistics()
+        except Exception as e:
+            print("Medal server GET error:", e)
+
 
 
 
 
 #Called every time a POST request is sent to this server.
+#Returns the HTTP code to send back to SRCDS.
 
     def handle_post_data(self):
 
-        #No matter what, send HTTP code 200 to the request.
-        self.send_response(200)
-        self.end_headers()
-
         #Determine how much data we need to read in. Cap it at 1024 bytes as a sanity limit:
         content_len = int(self.headers['content-length'])
         if content_len > 1024:
@@ -92,20 +208,117 @@ class TourProgressHandler(SimpleHTTPRequestHandler):
         #The server is sitting behind a firewall with no open ports, so only LAN (localhost)
         #connections can be made to it, but just to be safe, check for an auth key anyway.
         if not self.is_valid_request(params_dict):
-            return None
+            return 200
 
         #Build a data tuple out of the POST parameters data:
         data_tuple = self.load_post_parameters(params_dict)
 
         #If it failed, don't do anything:
         if data_tuple is None:
-            return None
+            return 200
+
+        #Grab the idempotency key of this request. If a retried request shows up with the same key, it isn't counted twice.
+        #
+        #If the tour server didn't send one, build it from the wave credit itself. The same player can't
+        #complete the same wave twice within the same second, so an identical wave credit can only be a retry.
+        request_id = params_dict.get("requestid")
+        request_id = request_id[0] if request_id else "{}:{}:{}:{}".format(*data_tuple)
+
+        #In durable mode, hand the database thread a ticket along with the wave credit.
+        #The database thread punches the ticket once the wave credit has been committed to the database.
+        ticket = AckTicket() if master.settings["ackmode"] == "durable" else None
 
         #Push the tuple to the database thread and let it process that data.
         #That way, we can handle more POST requests from the tour servers, and avoid race conditions.
-        master.post_requests_queue.append(data_tuple)
+        #
+        #If the queue is full and it refuses the wave credit, tell the tour server with a 503 (Service Unavailable).
+        if not master.post_requests_queue.put((data_tuple, ticket, request_id)):
+            return 503
+
+        #Only acknowledge the wave credit once it's safe on disk. If it didn't make it in time, send a 503 as well.
+        if ticket is not None and not ticket.wait_durable(master.settings["acktimeout"]):
+            return 503
 
         #SRCDS doesn't expect any data back, so don't return any data back.
+        return 200
+
+
+
+
+
+#Called every time a bulk POST request is sent to this server.
+#Returns the HTTP code to send back to SRCDS.
+#
+#The body is plain text. The first line is the TT API key, then there's one wave credit per line:
+#
+#   steam64,timestamp,mission,wave[,requestid]
+#
+#The key is checked once for the whole request, and the wave credits are all queued up or all turned away.
+#If a single line is malformed or out of range, the whole request is refused with a 400, so nothing is ever half-recorded.
+
+    def handle_bulk_post_data(self):
+
+        #Read in the data, with a sanity limit:
+        content_len = int(self.headers['content-length'])
+        if content_len > master.settings["bulkmaxbytes"]:
+            return 413
+        lines = self.rfile.read(content_len).decode().splitlines()
+
+        #Check the key:
+        if not lines or lines[0].strip() != master.tt_api_key:
+            return 403
+
+        #Parse every wave credit. Request IDs are optional, just like in single requests:
+        durable = master.settings["ackmode"] == "durable"
+        items = list()
+        for x in lines[1:]:
+            if not x.strip():
+                continue
+            cells = x.split(",")
+            if len(cells) not in (4, 5):
+                return 400
+            try:
+                data_tuple = (int(cells[0]), int(cells[1]), int(cells[2]), int(cells[3]))
+            except ValueError:
+                return 400
+            if not self.is_valid_wave_credit(data_tuple):
+                return 400
+            request_id = cells[4].strip() if len(cells) == 5 and cells[4].strip() else "{}:{}:{}:{}".format(*data_tuple)
+            items.append((data_tuple, AckTicket() if durable else None, request_id))
+
+        if not items:
+            return 200
+
+        #Queue them up in one go:
+        if not master.post_requests_queue.put_many(items):
+            return 503
+
+        #In durable mode, only acknowledge once every one of them is safe on disk:
+        if durable:
+            deadline = monotonic() + master.settings["acktimeout"]
+            for (x, ticket, request_id) in items:
+                if not ticket.wait_durable(max(0, deadline - monotonic())):
+                    return 503
+
+        return 200
+
+
+
+
+
+#Sends the ingest queue statistics to the client as a CSV file:
+
+    def serve_statistics(self):
+
+        #Grab the statistics and turn each of them into a "name,value" row:
+        stats = master.get_statistics()
+        csv_raw = "\n".join("{},{}".format(x, y) for (x, y) in stats).encode()
+
+        #Serve it:
+        self.send_response(200)
+        self.send_header("Content-Type", "text/csv")
+        self.end_headers()
+        self.wfile.write(csv_raw)
 
 
 
@@ -154,11 +367,23 @@ class TourProgressHandler(SimpleHTTPRequestHandler):
         if wave_number is None:
             return None
 
-        #Construct everything and return the tuple:
+        #Construct everything, and make sure it's a wave credit we can record:
         try:
-            return (int(steamid[0]), int(timestamp[0]), int(mission_index[0]), int(wave_number[0]))
+            data_tuple = (int(steamid[0]), int(timestamp[0]), int(mission_index[0]), int(wave_number[0]))
         except:
             return None
+        return data_tuple if self.is_valid_wave_credit(data_tuple) else None
+
+
+
+
+
+#Returns true if the numbers of a wave credit tuple are in range, false otherwise.
+#Steam IDs are unsigned 64 bit numbers, and 0 isn't anyone. Timestamps are unsigned 32 bit unix times (the website
+#keeps them in 32 bits), and 0 means the wave wasn't earned.
+
+    def is_valid_wave_credit(self, data_tuple):
+        return 0 < data_tuple[0] < 0x10000000000000000 and 0 < data_tuple[1] < 0x100000000
 
 
 
@@ -173,7 +398,653 @@ class TourProgressHandler(SimpleHTTPRequestHandler):
 
 class ThreadedHTTPServer(ThreadingMixIn, TCPServer):
     """Handle requests in a separate thread."""
-    pass
+
+    #Every tour server reports at the end of the same wave, and durable acknowledgements hold each
+    #connection open until the batch commits. Use a deeper listen backlog so bursts aren't reset.
+    request_queue_size = 128
+
+    #Restarts are quick now (see the progress snapshot), so don't make them wait for the old socket to time out:
+    allow_reuse_address = True
+
+
+
+
+
+#####################################################
+#####################################################
+#####################################################
+
+
+#Bounded FIFO queue of wave credits, shared between the HTTP server threads and the database thread.
+#Each entry is a (wave credit tuple, AckTicket or None, request ID) tuple.
+#
+#The database thread blocks on this queue and wakes up the moment a wave credit lands in it.
+#When the queue is full, the backpressure policy decides what happens to the new wave credit:
+#
+#- "block":      Wait (up to a timeout) for the database thread to free up a slot, then reject.
+#- "dropoldest": Throw away the oldest queued wave credit to make room for the new one.
+#- "reject":     Refuse the new wave credit right away.
+
+class WaveCreditQueue(object):
+
+#Init the queue:
+
+    def __init__(self, max_size, policy, block_timeout):
+
+        #The queue itself, and its settings:
+        self.items = deque()
+        self.max_size = max_size
+        self.policy = policy
+        self.block_timeout = block_timeout
+
+        #Both conditions share the same lock.
+        #The database thread waits on the first one, blocked HTTP threads wait on the second one.
+        lock = Lock()
+        self.not_empty = Condition(lock)
+        self.not_full = Condition(lock)
+
+        #Metrics:
+        self.enqueued = 0           #Wave credits accepted into the queue
+        self.processed = 0          #Wave credits handed off to the database thread
+        self.dropped = 0            #Wave credits thrown away by the "dropoldest" policy
+        self.rejected = 0           #Wave credits refused because the queue was full
+        self.peak_depth = 0         #Deepest the queue has ever been
+
+
+
+
+
+#Puts a wave credit at the end of the queue.
+#Returns True if the wave credit was accepted, False if the queue refused it.
+
+    def put(self, item):
+        return self.put_many((item,))
+
+
+
+
+
+#Puts a bunch of wave credits at the end of the queue, all or nothing.
+#Returns True if the wave credits were accepted, False if the queue refused them.
+
+    def put_many(self, items):
+
+        count = len(items)
+        with self.not_full:
+
+            #Apply the backpressure policy if the wave credits don't fit.
+            #(If there are more of them than the whole queue can hold, they never will.)
+            if len(self.items) + count > self.max_size:
+
+                if count > self.max_size:
+                    self.rejected += count
+                    return False
+
+                #Make room by throwing away the oldest wave credits.
+                #Punch their tickets without marking them durable, so their HTTP threads send back a 503 right away:
+                if self.policy == "dropoldest":
+                    while len(self.items) + count > self.max_size:
+                        dropped_ticket = self.items.popleft()[1]
+                        self.dropped += 1
+                        if dropped_ticket is not None:
+                            dropped_ticket.set()
+
+                #Wait for the database thread to make room. If it doesn't in time, give up:
+                elif self.policy == "block":
+                    if not self.not_full.wait_for(lambda: len(self.items) + count <= self.max_size, self.block_timeout):
+                        self.rejected += count
+                        return False
+
+                #Otherwise, refuse them:
+                else:
+                    self.rejected += count
+                    return False
+
+            #Put the wave credits in and update the metrics:
+            self.items.extend(items)
+            self.enqueued += count
+            depth = len(self.items)
+            if depth > self.peak_depth:
+                self.peak_depth = depth
+
+            #Wake up the database thread:
+            self.not_empty.notify()
+            return True
+
+
+
+
+
+#Takes the oldest wave credit out of the queue.
+#Blocks until there is one, or until the timeout (in seconds) runs out, in which case None is returned.
+
+    def get(self, timeout=None):
+
+        with self.not_empty:
+
+            #Wait for something to show up:
+            if not self.not_empty.wait_for(lambda: len(self.items), timeout):
+                return None
+
+            #Yank it out, and wake up one HTTP thread that might be waiting for a free slot:
+            item = self.items.popleft()
+            self.processed += 1
+            self.not_full.notify()
+            return item
+
+
+
+
+
+#Takes a batch of wave credits out of the queue, for group commits.
+#
+#Blocks until there is at least one wave credit (or until the timeout runs out). From then on, keep collecting wave credits until
+#either the batch is full or the flush window (in seconds) runs out, whichever comes first.
+
+    def get_batch(self, max_items, window, timeout=None):
+
+        with self.not_empty:
+
+            #Wait for the first wave credit to show up. If the timeout (in seconds) runs out first, return an empty batch:
+            if not self.not_empty.wait_for(lambda: len(self.items), timeout):
+                return []
+
+            #Give the rest of the batch some time to trickle in:
+            deadline = monotonic() + window
+            while len(self.items) < max_items:
+                remaining = deadline - monotonic()
+                if remaining <= 0:
+                    break
+                self.not_empty.wait(remaining)
+
+            #Yank the batch out, and wake up every waiting HTTP thread.
+            #(Bulk requests wait for several free slots at once, so there's no telling how many of them fit now.)
+            batch = [self.items.popleft() for x in range(min(max_items, len(self.items)))]
+            self.processed += len(batch)
+            self.not_full.notify_all()
+            return batch
+
+
+
+
+
+#Returns the number of wave credits currently sitting in the queue:
+
+    def __len__(self):
+        return len(self.items)
+
+
+
+
+
+#Returns the queue metrics as a tuple of (name, value) pairs:
+
+    def get_statistics(self):
+
+        with self.not_empty:
+            return (("depth", len(self.items)), ("peak_depth", self.peak_depth), ("max_size", self.max_size),
+                    ("policy", self.policy), ("enqueued", self.enqueued), ("processed", self.processed),
+                    ("dropped", self.dropped), ("rejected", self.rejected))
+
+
+
+
+
+#A ticket handed to the database thread along with a wave credit.
+#The database thread sets it once the wave credit is committed (durable = True), or once it is lost (durable = False).
+
+class AckTicket(Event):
+
+#Init:
+
+    def __init__(self):
+        super().__init__()
+        self.durable = False
+
+
+
+
+
+#Waits for the wave credit to be committed. Returns True if it made it to the database in time:
+
+    def wait_durable(self, timeout):
+        return self.wait(timeout) and self.durable
+
+
+
+
+
+#Compact tour progress store: steam64 ID -> wave completion bitflags of every mission, packed into one 64-bit number.
+#
+#This replaces a dictionary of tuples. Every mission gets its own group of bits in the packed number, and
+#each mission's group holds the same wave completion bitflags as before (bit N set = wave N completed).
+#
+#The steam IDs live in an open addressing hash table (linear probing) made of two parallel arrays:
+#one array('Q') of steam IDs (0 = empty slot) and one array('Q') of packed bitflags. Both are mutated in place.
+#
+#Memory cost: 16 bytes per slot. The table doubles once it's 70% full, so that's 23 to 46 bytes per player
+#(about 32 on average), versus roughly 170 bytes per player for a dictionary of tuples (dict slot, boxed
+#int key and a 6-tuple). No per-player Python objects are created, so the garbage collector never sees them.
+
+class ProgressStore(object):
+
+#Init the store. completed_tour_tuple is the tuple of per-mission bitflags of a fully completed tour.
+
+    def __init__(self, completed_tour_tuple, capacity=1024):
+
+        #Figure out how many bits each mission needs: bit 0 is unused, and bits 1 to N are the waves.
+        #Every mission gets the same number of bits so a mission's offset is just a multiplication.
+        self.total_missions = len(completed_tour_tuple)
+        self.mission_bits = max(completed_tour_tuple).bit_length()
+        if self.mission_bits * self.total_missions > 64:
+            raise ValueError("Tour has too many missions or waves to pack into 64 bits!")
+
+        #The packed bitflags of a completed tour, and a mask of all the valid wave bits:
+        self.completed_flags = self.pack(completed_tour_tuple)
+
+        #Build the hash table. The capacity must be a power of 2:
+        self.allocate(max(8, 1 << (capacity - 1).bit_length()))
+
+
+
+
+
+#Allocates an empty hash table with the given number of slots:
+
+    def allocate(self, capacity):
+        self.set_tables(array("Q", bytes(8*capacity)), array("Q", bytes(8*capacity)))
+
+
+
+
+
+#Uses the given key and flag arrays as the hash table. (Used to load a snapshot of the table back in.)
+#Both arrays must be the same power of 2 size, and laid out exactly like this store would lay them out.
+
+    def set_tables(self, keys, flags):
+        capacity = len(keys)
+        self.keys = keys
+        self.flags = flags
+        self.mask = capacity - 1
+        self.shift = 64 - (capacity.bit_length() - 1)
+        self.count = capacity - keys.count(0)
+        self.grow_at = capacity*7 // 10
+
+
+
+
+
+#Returns the slot a steam ID is stored in, or the empty slot where it would go.
+#
+#Steam IDs share their upper 32 bits, so they're scrambled with Fibonacci hashing (multiply by 2^64/phi
+#and keep the top bits) to spread them evenly across the table.
+
+    def find_slot(self, steam64):
+        keys = self.keys
+        mask = self.mask
+        i = ((steam64 * 11400714819323198485) & 0xFFFFFFFFFFFFFFFF) >> self.shift
+        while True:
+            key = keys[i]
+            if key == steam64 or key == 0:
+                return i
+            i = (i + 1) & mask
+
+
+
+
+
+#Doubles the size of the hash table, and moves every player into it:
+
+    def grow(self):
+        old_keys = self.keys
+        old_flags = self.flags
+        self.allocate(2*len(old_keys))
+        for (x, y) in zip(old_keys, old_flags):
+            if x:
+                i = self.find_slot(x)
+                self.keys[i] = x
+                self.flags[i] = y
+        self.count = len(old_keys) - old_keys.count(0)
+
+
+
+
+
+#Sets a wave's completion bit for a player. Returns the player's new packed bitflags.
+#Mission indexes and wave numbers that aren't part of the tour are ignored.
+#Steam IDs must fit in the table (0 marks empty slots), so anything else raises a ValueError.
+
+    def add_wave_credit(self, steam64, mission_index, wave_number):
+
+        #Ignore anything that doesn't fit in this mission's group of bits:
+        if not (0 <= mission_index < self.total_missions and 0 < wave_number < self.mission_bits):
+            return self.get(steam64)
+
+        #Find the player's slot. (This is find_slot, inlined since this is the hot path.)
+        keys = self.keys
+        mask = self.mask
+        i = ((steam64 * 11400714819323198485) & 0xFFFFFFFFFFFFFFFF) >> self.shift
+        key = keys[i]
+        while key != steam64 and key != 0:
+            i = (i + 1) & mask
+            key = keys[i]
+
+        #If they're new, claim the empty slot (growing the table first if needed):
+        if key == 0:
+            if not 0 < steam64 < 0x10000000000000000:
+                raise ValueError("Steam ID {} can't go in the progress store!".format(steam64))
+            if self.count >= self.grow_at:
+                self.grow()
+                i = self.find_slot(steam64)
+            self.keys[i] = steam64
+            self.count += 1
+
+        #Set the wave's bit in place:
+        flags = self.flags
+        flags[i] |= 1 << (mission_index*self.mission_bits + wave_number)
+        return flags[i]
+
+
+
+
+
+#Returns a player's packed bitflags (0 if they have no progress):
+
+    def get(self, steam64):
+        i = self.find_slot(steam64)
+        return self.flags[i] if self.keys[i] else 0
+
+
+
+
+
+#Packs a tuple of per-mission bitflags into one number:
+
+    def pack(self, tour_tuple):
+        packed = 0
+        for (x, y) in enumerate(tour_tuple):
+            packed |= y << (x*self.mission_bits)
+        return packed
+
+
+
+
+
+#Unpacks a player's packed bitflags back into a tuple of per-mission bitflags:
+
+    def get_tour_tuple(self, steam64):
+        flags = self.get(steam64)
+        mask = (1 << self.mission_bits) - 1
+        return tuple((flags >> (x*self.mission_bits)) & mask for x in range(self.total_missions))
+
+
+
+
+
+#Returns True if the player has completed every wave of every mission:
+
+    def has_completed_tour(self, steam64):
+        return self.get(steam64) == self.completed_flags
+
+
+
+
+
+#Number of players in the store:
+
+    def __len__(self):
+        return self.count
+
+
+
+
+
+#Iterates over (steam64, packed bitflags) of every player in the store:
+
+    def __iter__(self):
+        return ((x, y) for (x, y) in zip(self.keys, self.flags) if x)
+
+
+
+
+
+#####################################################
+#####################################################
+#####################################################
+
+
+#Pool of worker threads that give the medal to players who completed the tour.
+#
+#Granting a medal is an HTTPS request to the steam API, which can take seconds (or time out) when Valve is
+#having a bad day. It's done on these threads so the database thread never waits on Steam: wave credits keep
+#flowing in no matter how slow medal drops are. The number of threads caps how many requests hit Steam at once.
+#
+#Every pending grant is persisted to the PendingGrants table. A grant that fails is retried with exponential
+#backoff (plus some jitter, so a batch of failures doesn't retry in lockstep) until it goes through.
+#If Steam takes the medal drop but recording it in the database fails, the grant is marked as granted upstream,
+#and only the database write is retried: the medal is never sent to Steam twice.
+
+class MedalGrantPool(object):
+
+#Init the pool. grant_function(steam64) tries to give one medal and returns True on success,
+#and on_granted(steam64) is called after a medal drop has been recorded in the database.
+
+    def __init__(self, db_path, grant_function, on_granted, workers, retry_delay, max_retry_delay):
+
+        #The pool gets its own database connection, shared between its threads:
+        self.db = Connection(db_path, check_same_thread=False)
+        self.db_lock = Lock()
+
+        #Settings:
+        self.grant_function = grant_function
+        self.on_granted = on_granted
+        self.workers = workers
+        self.retry_delay = retry_delay
+        self.max_retry_delay = max_retry_delay
+
+        #Heap of (unix time of the next attempt, steam64) for every grant waiting on a thread,
+        #and the number of failed attempts of every pending grant (including the ones being tried right now):
+        self.retries = list()
+        self.attempts = dict()
+        self.condition = Condition()
+
+        #Pending grants Steam has taken already, which only need to be recorded in the database:
+        self.granted_upstream = set()
+
+        #Metrics:
+        self.in_flight = 0          #Grants being sent to Steam right now
+        self.granted = 0            #Medals given out
+        self.failures = 0           #Failed attempts
+
+
+
+
+
+#Loads the pending grants left over from the last run, and starts the worker threads:
+
+    def start(self):
+
+        with self.condition:
+            for (x, y, z, w) in self.db.execute("SELECT Steam64, Attempts, NextAttempt, Granted FROM PendingGrants"):
+                self.attempts[x] = y
+                heappush(self.retries, (z, x))
+                if w:
+                    self.granted_upstream.add(x)
+
+        for x in range(self.workers):
+            Thread(target=self.mainloop, name="Medal Grant Worker {}".format(x+1)).start()
+
+
+
+
+
+#Queues up a medal grant for a player. Does nothing if one is pending for them already.
+#Returns True if the grant was queued.
+
+    def submit(self, steam64):
+
+        #Claim the player first, so they can't be queued twice:
+        with self.condition:
+            if steam64 in self.attempts:
+                return False
+            self.attempts[steam64] = 0
+
+        #Persist the grant, then hand it to the threads:
+        now = int(time())
+        try:
+            with self.db_lock:
+                self.db.execute("INSERT OR IGNORE INTO PendingGrants (Steam64, Attempts, NextAttempt, TimeStamp) VALUES (?,0,?,?)", (steam64, now, now))
+                self.db.commit()
+
+        #The grant is still handed to the threads if the database is busy. A failed medal drop persists it again,
+        #and if the server restarts before that, the startup sweep finds the player again:
+        except Exception as e:
+            print("Medal Grant Thread Error:", e)
+
+        with self.condition:
+            heappush(self.retries, (now, steam64))
+            self.condition.notify()
+        return True
+
+
+
+
+
+#Runs forever to give out medals.
+#This is ran on every worker thread.
+
+    def mainloop(self):
+
+        #For forever:
+        while True:
+
+            #Wait for the next grant to be due:
+            with self.condition:
+                while not self.retries or self.retries[0][0] > time():
+                    self.condition.wait(self.retries[0][0] - time() if self.retries else None)
+                steam64 = heappop(self.retries)[1]
+                self.in_flight += 1
+
+            #Don't let this thread ever crash - wrap everything around a try/except:
+            try:
+                granted = self.grant(steam64)
+            except Exception as e:
+                print("Medal Grant Thread Error:", e)
+                granted = False
+
+            #If it didn't go through, schedule the next attempt:
+            if not granted:
+                self.schedule_retry(steam64)
+
+            with self.condition:
+                self.in_flight -= 1
+
+
+
+
+
+#Tries to give the medal to a player, and records it in the database if it went through.
+#Returns True if the player has their medal now.
+
+    def grant(self, steam64):
+
+        #Only send the medal drop to Steam if Steam hasn't taken it already:
+        if steam64 not in self.granted_upstream:
+            if not self.grant_function(steam64):
+                return False
+            self.mark_granted_upstream(steam64)
+
+        #Record the medal drop, and take the player off the pending grants:
+        with self.db_lock:
+            try:
+                self.db.execute("BEGIN IMMEDIATE")
+                self.db.execute("INSERT OR IGNORE INTO MedalOwners (Steam64, TimeStamp) VALUES (?,?)", (steam64, int(time())))
+                self.db.execute("DELETE FROM PendingGrants WHERE Steam64 = ?", (steam64,))
+                self.db.commit()
+            except:
+                if self.db.in_transaction:
+                    self.db.rollback()
+                raise
+
+        #Let the main class know before the player is released, so they can't be queued again in between:
+        self.on_granted(steam64)
+        with self.condition:
+            del self.attempts[steam64]
+            self.granted_upstream.discard(steam64)
+            self.granted += 1
+        return True
+
+
+
+
+
+#Remembers that Steam has taken a player's medal drop, so retries only redo the database write.
+#It's saved to the pending grant too, so it holds across restarts. (If the database is too busy for that,
+#it's only remembered until the next restart.)
+
+    def mark_granted_upstream(self, steam64):
+
+        with self.condition:
+            self.granted_upstream.add(steam64)
+
+        with self.db_lock:
+            try:
+                self.db.execute("INSERT INTO PendingGrants (Steam64, Attempts, NextAttempt, TimeStamp, Granted) VALUES (?,0,?,?,1) ON CONFLICT (Steam64) DO UPDATE SET Granted = 1", (steam64, int(time()), int(time())))
+                self.db.commit()
+            except Exception as e:
+                if self.db.in_transaction:
+                    self.db.rollback()
+                print("Medal Grant Thread Error:", e)
+
+
+
+
+
+#Schedules the next attempt of a failed grant, backing off exponentially:
+
+    def schedule_retry(self, steam64):
+
+        with self.condition:
+            self.failures += 1
+            self.attempts[steam64] += 1
+            attempts = self.attempts[steam64]
+
+        delay = min(self.retry_delay * 2**(attempts-1), self.max_retry_delay) * uniform(0.5, 1.0)
+        next_attempt = int(time() + delay)
+        try:
+            with self.db_lock:
+                self.db.execute("INSERT INTO PendingGrants (Steam64, Attempts, NextAttempt, TimeStamp) VALUES (?,?,?,?) ON CONFLICT (Steam64) DO UPDATE SET Attempts = excluded.Attempts, NextAttempt = excluded.NextAttempt", (steam64, attempts, next_attempt, int(time())))
+                self.db.commit()
+
+        #The grant is still retried even if the database is busy. It just resumes from its older row after a restart.
+        #(The row is created here if it couldn't be written when the grant was submitted.)
+        except Exception as e:
+            print("Medal Grant Thread Error:", e)
+
+        with self.condition:
+            heappush(self.retries, (next_attempt, steam64))
+            self.condition.notify()
+
+
+
+
+
+#Returns True if a grant is pending for the player:
+
+    def __contains__(self, steam64):
+        return steam64 in self.attempts
+
+
+
+
+
+#Returns the pool metrics as a tuple of (name, value) pairs:
+
+    def get_statistics(self):
+
+        with self.condition:
+            return (("grants_pending", len(self.attempts)), ("grants_in_flight", self.in_flight),
+                    ("medals_granted", self.granted), ("grant_failures", self.failures))
 
 
 
@@ -194,60 +1065,287 @@ class potato(object):
 
     def __init__(self):
 
-        #Create the database:
-        self.db = Connection("../data/mvm_titanium_tank_tour_progress.sq3", check_same_thread=False)
+        #From the config CSV files, load important tour and medal information:
+        (self.promoid, self.steam_api_key, self.steam_api_url, self.tt_api_key, self.completed_tour_tuple) = self.load_tour_information()
 
-        #Create the tour progress table and the medal recepients tables.
-        #The first table stores all the individual wave credits.
-        #The second table stores the recepients of the participant medal.
-        self.db.execute("CREATE TABLE IF NOT EXISTS WaveCredits (Steam64 Text, TimeStamp Int, MissionIndex Int, WaveNumber Int)")    #Steam64 needs to be text since Sourcepawn can't hold 64-bit numbers as ints - only as strings
-        self.db.execute("CREATE TABLE IF NOT EXISTS MedalOwners (Steam64 Text, TimeStamp Int)")
+        #Load the medal server settings as well: (these are all optional)
+        self.settings = self.load_server_settings()
 
-        #Commit the query:
-        self.db.commit()
+        #Open the database and bring its schema up to date:
+        self.db = self.open_database("../data/mvm_titanium_tank_tour_progress.sq3")
 
         #Open a text file *in APPEND mode* and hold onto its handle forever.
         #We'll write steam IDs of medal recepients to it as a backup, in addition to the database records.
         self.f = open("../data/_Medal Recepients.txt", mode="a", encoding="UTF-8")
 
-        #From the config CSV files, load important tour and medal information:
-        (self.promoid, self.steam_api_key, self.tt_api_key, self.completed_tour_tuple) = self.load_tour_information()
-
-        #For optimal performance (and also as extra security), cache the tour data into a big dictionary.
+        #For optimal performance (and also as extra security), cache the tour data into a compact in-memory store.
         #This allows us to check if a player has completed the tour or not, without having to query the database every time.
         #
-        #Test suite: Ran this with 5 million players simulation, the RAM usage didn't make a dent on the
-        #server, so we should be good even though this is not scalable to infinity. (Can easily revert to
-        #a scalable but slower approach if it ends up being an issue.)
-        self.progress_dictionary = dict()       #To win a medal, your steam ID must be fully packed with all the required completion flags.
+        #Each player costs about 32 bytes in there (see ProgressStore), so even tens of millions of players fit in RAM.
+        self.progress_dictionary = ProgressStore(self.completed_tour_tuple)     #To win a medal, your steam ID must be fully packed with all the required completion flags.
 
         #In this set, store the steam IDs of players who have received the medal.
         #This acts as a sanity check to prevent the medal distributor from giving people multiple medals.
+        #(The medal grant threads add to it, so changes and copies of it go through the lock.)
         self.medal_recepients = set()
-
-        #Blank tuple to use when initializing a player's tour progress in the progress dictionary:
-        #Each index in the tuple represents a mission's progress, and each number is a bitflag of the completed waves.
-        self.blank_tour_tuple = (0, 0, 0, 0, 0, 0)
+        self.medal_lock = Lock()
 
         #Since the HTTP server is threaded (1 thread per request), we cannot directly insert
         #the wave credits into the database and the dictionary in here, or else that's asking
         #for a huge headache of race conditions and bugs. For a server that determines if
         #someone gets an in-game item drop, that's something we want to completely avoid.
         #
-        #The HTTP server will shove POST requests in this list, and then the worker thread that
-        #runs on this class will grind the queue down if there's any pending request data.
+        #The HTTP server will shove POST requests in this queue, and then the worker thread that
+        #runs on this class wakes up and grinds the queue down in the order the wave credits came in.
         #
         #This solves the thread safety issue while also allowing the HTTP server to still
-        #accept POST requests without any speed or throttling limitations.
-        self.post_requests_queue = list()
-
-        #Init the medal recepients set with steam IDs of people who received the medal:
+        #accept POST requests without any speed or throttling limitations. The queue is bounded
+        #so that a flood of requests can't eat up all the RAM on the server.
+        self.post_requests_queue = WaveCreditQueue(self.settings["queuesize"], self.settings["queuepolicy"], self.settings["queuetimeout"])
+
+        #Database writer metrics:
+        self.batches_committed = 0
+        self.credits_committed = 0
+        self.last_batch_size = 0
+        self.commit_seconds = 0.0
+        self.duplicate_requests = 0
+
+        #Request IDs of recently recorded wave credits, paired with the time they were recorded at (oldest first).
+        #Only the database thread touches this, so there are no race conditions between retried requests.
+        self.request_ids = OrderedDict()
+        self.request_ids_pruned = time()
+        for x in self.db.execute("SELECT RequestID, TimeStamp FROM IngestKeys WHERE TimeStamp >= ? ORDER BY TimeStamp", (int(time()) - self.settings["requestidttl"],)):
+            self.request_ids[x[0]] = x[1]
+
+        #Progress snapshot bookkeeping: the last WaveCredits rowid in the progress dictionary, and when the last snapshot was taken.
+        self.snapshot_path = "../data/mvm_titanium_tank_progress_snapshot.bin"
+        self.last_row_id = 0
+        self.snapshot_row_id = None
+        self.snapshot_time = monotonic()
+        self.snapshot_thread = None
+
+        #Socket for telling the website about new wave credits the moment they're committed, so it doesn't have to poll:
+        self.notify_socket = socket(AF_INET, SOCK_DGRAM)
+
+        #Catch the deduplicated first wave credits table up, if we keep it:
+        if self.settings["firstcredits"]:
+            self.sync_first_wave_credits()
+
+        #Init the progress dictionary and the medal recepients set.
+        #
+        #If there's a usable snapshot, start from it and only replay the wave credits recorded after it was taken.
+        #Otherwise, replay the whole database. If we keep the deduplicated first wave credits table, load from it
+        #instead of the raw wave credits table: every repeated wave is only in there once, so that's a lot faster.
+        start = monotonic()
+        database_row_id = self.db.execute("SELECT IFNULL(MAX(CreditID), 0) FROM WaveCredits").fetchone()[0]
+        snapshot_time = self.load_progress_snapshot(database_row_id)
+        if snapshot_time is not None:
+            credits_query = ("SELECT Steam64, TimeStamp, MissionIndex, WaveNumber FROM WaveCredits WHERE CreditID > ? AND CreditID <= ?", (self.last_row_id, database_row_id))
+        elif self.settings["firstcredits"]:
+            credits_query = ("SELECT Steam64, TimeStamp, MissionIndex, WaveNumber FROM FirstWaveCredits", ())
+        else:
+            credits_query = ("SELECT Steam64, TimeStamp, MissionIndex, WaveNumber FROM WaveCredits WHERE CreditID <= ?", (database_row_id,))
+
+        #The medal owners are always loaded in full, even on top of a snapshot. A player is written to MedalOwners before
+        #they're added to the medal recepients set, so a snapshot taken in between is missing them:
         for x in self.db.execute("SELECT Steam64 FROM MedalOwners"):
             self.medal_recepients.add(int(x[0]))
 
-        #Init the progress dictionary with the database's contents:
-        for x in self.db.execute("SELECT Steam64, TimeStamp, MissionIndex, WaveNumber FROM WaveCredits"):
-            self.insert_client_wave_credit(*x)
+        #Only set the completion bits while replaying. Checking for tour completion after every historical row
+        #is wasted work, so every player is checked just once after the replay instead.
+        #Rows with a bad steam ID (from before they were checked on the way in) are skipped.
+        replayed = 0
+        skipped = 0
+        add_wave_credit = self.progress_dictionary.add_wave_credit
+        for x in self.db.execute(*credits_query):
+            try:
+                add_wave_credit(int(x[0]), x[2], x[3])
+                replayed += 1
+            except ValueError:
+                skipped += 1
+        self.last_row_id = database_row_id
+
+        print("Loaded {} players in {:.2f} seconds ({} wave credits replayed, {} skipped)".format(len(self.progress_dictionary), monotonic() - start, replayed, skipped))
+
+        #Medal drops are sent to Steam by a pool of worker threads, so the database thread never waits on Steam.
+        #Start it up: this also picks up the failed medal drops from last time, and keeps retrying them.
+        self.grant_pool = MedalGrantPool("../data/mvm_titanium_tank_tour_progress.sq3",
+                                         lambda steam64: self.grant_medal_to_user(self.steam_api_key, self.promoid, steam64),
+                                         self.medal_granted, self.settings["grantworkers"], self.settings["grantretrydelay"], self.settings["grantmaxretrydelay"])
+        self.grant_pool.start()
+
+        #Give the medal to anyone who completed the tour but doesn't have it yet, and do it again every so often.
+        #(In case a medal drop ever slips through the cracks, e.g. the server crashed before its grant was persisted.)
+        self.check_all_tour_completions()
+        self.next_sweep = monotonic() + self.settings["grantsweepinterval"]
+
+        #If anything was replayed, take a fresh snapshot so the next restart doesn't have to replay it again:
+        if self.last_row_id != self.snapshot_row_id:
+            self.save_progress_snapshot()
+
+
+
+
+
+#Opens the tour progress database, tunes it, and applies any pending schema migrations.
+
+    def open_database(self, db_path):
+
+        #Create the database:
+        db = Connection(db_path, check_same_thread=False)
+
+        #Use write-ahead logging. The website server reads this database while we write to it,
+        #and in WAL mode readers and the writer never block each other.
+        db.execute("PRAGMA journal_mode=WAL")
+
+        #How hard to sync to disk on every commit. FULL keeps acknowledged wave credits safe even on power loss.
+        db.execute("PRAGMA synchronous={}".format(self.settings["synchronous"]))
+
+        #Page cache size (in KiB) and memory-mapped I/O size (in bytes):
+        db.execute("PRAGMA cache_size=-{}".format(self.settings["cachesize"]))
+        db.execute("PRAGMA mmap_size={}".format(self.settings["mmapsize"]))
+
+        #Apply the schema migrations the database doesn't have yet, one transaction per migration.
+        #The version is re-read inside the transaction, in case another program migrated it in the meantime.
+        while True:
+            db.execute("BEGIN IMMEDIATE")
+            try:
+                version = db.execute("PRAGMA user_version").fetchone()[0]
+                if version >= len(DATABASE_MIGRATIONS):
+                    db.commit()
+                    return db
+
+                for x in DATABASE_MIGRATIONS[version]:
+                    db.execute(x)
+                db.execute("PRAGMA user_version={}".format(version + 1))
+                db.commit()
+                print("Migrated tour progress database to version", version + 1)
+
+            except:
+                db.rollback()
+                raise
+
+
+
+
+
+#Brings the FirstWaveCredits table up to date with the wave credits recorded while it wasn't being kept.
+#(This only does any work if the "firstcredits" setting was turned off for a while.)
+
+    def sync_first_wave_credits(self):
+
+        self.db.execute("BEGIN IMMEDIATE")
+        try:
+            synced_row_id = self.db.execute("SELECT Value FROM ServerState WHERE Name = 'FirstCreditsRowID'").fetchone()[0]
+            self.db.execute("""INSERT INTO FirstWaveCredits (Steam64, MissionIndex, WaveNumber, TimeStamp)
+                               SELECT Steam64, MissionIndex, WaveNumber, TimeStamp FROM WaveCredits WHERE CreditID > ?
+                               ON CONFLICT (Steam64, MissionIndex, WaveNumber) DO UPDATE SET TimeStamp = excluded.TimeStamp
+                               WHERE excluded.TimeStamp < FirstWaveCredits.TimeStamp""", (synced_row_id,))
+            self.db.execute("UPDATE ServerState SET Value = (SELECT IFNULL(MAX(CreditID), 0) FROM WaveCredits) WHERE Name = 'FirstCreditsRowID'")
+            self.db.commit()
+        except:
+            self.db.rollback()
+            raise
+
+
+
+
+
+#Loads the progress snapshot into the progress dictionary and the medal recepients set.
+#Returns the time the snapshot was taken at, or None if there's no usable snapshot (then nothing is loaded).
+#
+#A snapshot is only usable if it was taken for the same tour, and it isn't ahead of the database
+#(which would mean the database was replaced or restored from a backup after it was taken).
+
+    def load_progress_snapshot(self, database_row_id):
+
+        if not self.settings["snapshotinterval"] or not isfile(self.snapshot_path):
+            return None
+
+        store = self.progress_dictionary
+        try:
+            with open(self.snapshot_path, mode="rb") as f:
+
+                #Read and check the header:
+                (magic, version, row_id, snapshot_time, completed_flags, mission_bits, total_missions, slots, medals) = SNAPSHOT_HEADER.unpack(f.read(SNAPSHOT_HEADER.size))
+                if magic != SNAPSHOT_MAGIC or version != SNAPSHOT_VERSION:
+                    print("Ignoring progress snapshot: unknown file format")
+                    return None
+                if (completed_flags, mission_bits, total_missions) != (store.completed_flags, store.mission_bits, store.total_missions):
+                    print("Ignoring progress snapshot: it was taken for a different tour")
+                    return None
+                if row_id > database_row_id:
+                    print("Ignoring progress snapshot: it's ahead of the database")
+                    return None
+
+                #Read the arrays straight into memory. (fromfile raises EOFError if the file is cut short.)
+                keys = array("Q")
+                keys.fromfile(f, slots)
+                flags = array("Q")
+                flags.fromfile(f, slots)
+                medal_recepients = array("Q")
+                medal_recepients.fromfile(f, medals)
+
+        except (OSError, EOFError, ValueError) as e:
+            print("Ignoring progress snapshot:", e)
+            return None
+
+        store.set_tables(keys, flags)
+        self.medal_recepients.update(medal_recepients)
+        self.last_row_id = row_id
+        self.snapshot_row_id = row_id
+        return snapshot_time
+
+
+
+
+
+#Takes a snapshot of the progress dictionary and the medal recepients set.
+#This must be called on the database thread, so that the snapshot matches self.last_row_id exactly.
+#
+#The arrays are copied here (a quick memory copy), and written to disk on a separate thread so the
+#database thread isn't held up by the disk. The file is written under a temporary name and then moved
+#over the old snapshot, so a crash halfway through never leaves a broken snapshot behind.
+
+    def save_progress_snapshot(self):
+
+        #Snapshots are turned off, or the last one is still being written:
+        if not self.settings["snapshotinterval"] or (self.snapshot_thread is not None and self.snapshot_thread.is_alive()):
+            return None
+
+        store = self.progress_dictionary
+        with self.medal_lock:
+            medal_recepients = array("Q", self.medal_recepients)
+        header = SNAPSHOT_HEADER.pack(SNAPSHOT_MAGIC, SNAPSHOT_VERSION, self.last_row_id, int(time()), store.completed_flags,
+                                      store.mission_bits, store.total_missions, len(store.keys), len(medal_recepients))
+
+        self.snapshot_row_id = self.last_row_id
+        self.snapshot_time = monotonic()
+        self.snapshot_thread = Thread(target=self.write_progress_snapshot, args=(header, array("Q", store.keys), array("Q", store.flags), medal_recepients))
+        self.snapshot_thread.start()
+
+
+
+
+
+#Writes a snapshot to disk. This is ran on its own thread.
+
+    def write_progress_snapshot(self, header, keys, flags, medal_recepients):
+
+        temp_path = self.snapshot_path + ".tmp"
+        try:
+            with open(temp_path, mode="wb") as f:
+                f.write(header)
+                keys.tofile(f)
+                flags.tofile(f)
+                medal_recepients.tofile(f)
+                f.flush()
+                fsync(f.fileno())
+            replace(temp_path, self.snapshot_path)
+
+        #If it failed, the old snapshot is still there. It's just further behind:
+        except OSError as e:
+            print("Progress Snapshot Error:", e)
 
 
 
@@ -257,9 +1355,11 @@ class potato(object):
 
     def load_tour_information(self):
 
-        #Open the steam API file and read in the medal promo ID and web API key:
+        #Open the steam API file and read in the medal promo ID and web API key.
+        #The steam API's base URL is optional: point it somewhere else to test against a stand-in server.
         promoid = None
         steam_api_key = None
+        steam_api_url = "https://api.steampowered.com"
         with open("../data/Steam API.csv", mode="r", encoding="UTF-8") as f:
             for x in reader(f):
                 cell = x[0].strip().lower()
@@ -267,6 +1367,8 @@ class potato(object):
                     steam_api_key = x[1]
                 elif cell == "promoid":
                     promoid = x[1]
+                elif cell == "baseurl":
+                    steam_api_url = x[1].strip().rstrip("/")
 
         #These cannot be set to None:
         if promoid is None:
@@ -306,13 +1408,76 @@ class potato(object):
             raise ValueError("TT API key not found!")
 
         #Return everything in one swoop to the constructor:
-        return promoid, steam_api_key, tt_api_key, tuple(completed_tour)
+        return promoid, steam_api_key, steam_api_url, tt_api_key, tuple(completed_tour)
+
+
+
+
+
+#Loads the medal server settings from the optional settings CSV file.
+#Every setting has a default value, so the file (and every row in it) can be left out.
+
+    def load_server_settings(self):
+
+        #Default settings:
+        settings = {
+                        "port":         65432,          #Port to listen on. You MUST use a port that's not open to the internet
+                        "queuesize":    100000,         #Maximum number of wave credits waiting on the database thread
+                        "queuepolicy":  "block",        #What to do when the queue is full: block, dropoldest or reject
+                        "queuetimeout": 5.0,            #How long (in seconds) the "block" policy waits for a free slot
+                        "batchsize":    500,            #Maximum number of wave credits written per database transaction
+                        "flushinterval": 0.05,          #How long (in seconds) a batch waits for more wave credits before it's written
+                        "ackmode":      "durable",      #When to answer SRCDS: durable (after the commit) or queued (right away)
+                        "acktimeout":   10.0,           #How long (in seconds) a durable acknowledgement waits for the commit
+                        "bulkmaxbytes": 65536,          #Largest bulk wave credits request (on /credits) accepted, in bytes
+                        "synchronous":  "full",         #SQLite synchronous pragma: full, normal or off
+                        "cachesize":    32768,          #SQLite page cache size, in KiB
+                        "mmapsize":     268435456,      #SQLite memory-mapped I/O size, in bytes
+                        "firstcredits": 1,              #Keep the deduplicated FirstWaveCredits table up to date (1) or not (0)
+                        "requestidttl": 86400,          #How long (in seconds) request IDs are remembered for retry detection
+                        "snapshotinterval": 300,        #How often (in seconds) to snapshot the progress dictionary to disk, 0 to turn snapshots off
+                        "grantworkers": 4,              #Number of threads sending medal drops to Steam at once
+                        "granttimeout": 30.0,           #How long (in seconds) to wait on Steam for a medal drop
+                        "grantretrydelay": 30.0,        #How long (in seconds) to wait before retrying a failed medal drop. Doubles every failure.
+                        "grantmaxretrydelay": 3600.0,   #Longest wait (in seconds) between retries of a failed medal drop
+                        "grantsweepinterval": 900,      #How often (in seconds) to look for players who completed the tour but never got the medal
+                        "notifyport":   27001,          #Local UDP port the website listens on for new wave credits, 0 to not notify it. The website reads this setting too (or takes -notifyport)
+                   }
+
+        #If there's no settings file, use the defaults:
+        if not isfile("../data/Medal Server.csv"):
+            return settings
+
+        #Per row, grab the setting name and convert its value to the same type as the default value:
+        with open("../data/Medal Server.csv", mode="r", encoding="UTF-8") as f:
+            for x in reader(f):
+
+                #Skip blank and short rows:
+                if len(x) < 2:
+                    continue
+
+                #Skip commented rows and unknown settings:
+                cell = x[0].strip().lower()
+                if cell.startswith("//") or cell not in settings:
+                    continue
+
+                settings[cell] = type(settings[cell])(x[1].strip().lower())
 
+        #Sanity check the queue policy and acknowledgement mode:
+        if settings["queuepolicy"] not in ("block", "dropoldest", "reject"):
+            raise ValueError("Invalid queue policy: " + settings["queuepolicy"])
+        if settings["ackmode"] not in ("durable", "queued"):
+            raise ValueError("Invalid acknowledgement mode: " + settings["ackmode"])
+        if settings["synchronous"] not in ("full", "normal", "off"):
+            raise ValueError("Invalid synchronous mode: " + settings["synchronous"])
 
+        return settings
 
 
 
-#Runs once every second to process POST requests.
+
+
+#Runs forever to process POST requests.
 #This is ran on a separate worker thread.
 
     def mainloop(self):
@@ -326,64 +1491,159 @@ class potato(object):
             except Exception as e:
                 print("Database Thread Error:", e)
 
-            #Then wait a second before looping again:
-            sleep(1)
 
 
 
 
-
-#Processes the queue of POST requests:
+#Processes the queue of POST requests.
+#
+#Wave credits are written in batches (group commit): one executemany per batch inside a single
+#transaction. Only after the batch is committed are the tickets punched and the progress dictionary
+#updated, so an acknowledged wave credit (and any medal it unlocks) is always backed by the database.
 
     def run(self):
 
-        #Since multiple threads hammer the post requests queue, the thread-safe way to
-        #handle this is to use a while loop that calls .pop() on that list until it
-        #raises IndexError, in which case we abort because then there's nothing left.
-        while True:
+        #Block until the HTTP server hands us a batch of wave credits, or until the next medal sweep is due.
+        #The queue wakes this thread up immediately, so there's no polling delay.
+        batch = self.post_requests_queue.get_batch(self.settings["batchsize"], self.settings["flushinterval"], self.next_sweep - monotonic())
 
-            #Try yanking out ONE post request:
-            try:
-                (steam64, timestamp, mission_index, wave_number) = self.post_requests_queue.pop()
+        #Sweep for players who completed the tour but don't have the medal:
+        if monotonic() >= self.next_sweep:
+            self.next_sweep = monotonic() + self.settings["grantsweepinterval"]
+            self.check_all_tour_completions()
 
-            #On failure, exit:
-            except IndexError:
-                self.db.commit()            #Save all the database transactions
-                return None
+        if not batch:
+            return None
 
-            #Now we have to record this progress data.
+        #Throw out retried requests: their request IDs were recorded already, either earlier or in this very batch.
+        #Their tickets still get punched as durable below, since the original wave credit is (or is about to be) in the database.
+        now = int(time())
+        request_ids = self.request_ids
+        new_request_ids = dict()
+        credits = list()
+        for (x, ticket, request_id) in batch:
+            if request_id in request_ids or request_id in new_request_ids:
+                self.duplicate_requests += 1
+                continue
+            new_request_ids[request_id] = now
+            credits.append(x)
+
+        #Write the whole batch into the database in one transaction:
+        start = monotonic()
+        try:
+            self.db.execute("BEGIN IMMEDIATE")
+            self.db.executemany("INSERT INTO WaveCredits (Steam64, TimeStamp, MissionIndex, WaveNumber) VALUES (?,?,?,?)", credits)
+            self.db.executemany("INSERT OR IGNORE INTO IngestKeys (RequestID, TimeStamp) VALUES (?,?)", new_request_ids.items())
+
+            #Keep the earliest timestamp of each wave credit in the deduplicated table, and remember how far it's synced:
+            if self.settings["firstcredits"]:
+                self.db.executemany("""INSERT INTO FirstWaveCredits (Steam64, MissionIndex, WaveNumber, TimeStamp) VALUES (?,?,?,?)
+                                       ON CONFLICT (Steam64, MissionIndex, WaveNumber) DO UPDATE SET TimeStamp = excluded.TimeStamp
+                                       WHERE excluded.TimeStamp < FirstWaveCredits.TimeStamp""", [(w, y, z, x) for (w, x, y, z) in credits])
+
+            #Remember the last rowid, so the progress snapshots know how far they are:
+            last_row_id = self.db.execute("SELECT IFNULL(MAX(CreditID), 0) FROM WaveCredits").fetchone()[0]
+            if self.settings["firstcredits"]:
+                self.db.execute("UPDATE ServerState SET Value = ? WHERE Name = 'FirstCreditsRowID'", (last_row_id,))
+
+            #Once a minute, forget the request IDs that are too old to belong to a retry:
+            expired = now - self.settings["requestidttl"]
+            if now - self.request_ids_pruned >= 60:
+                self.db.execute("DELETE FROM IngestKeys WHERE TimeStamp < ?", (expired,))
+
+            self.db.commit()
+
+        #If it failed, roll it back and punch the tickets without marking them durable.
+        #The tour servers get a 503 for these wave credits instead of a false acknowledgement.
+        except:
+            if self.db.in_transaction:
+                self.db.rollback()
+            for (x, ticket, request_id) in batch:
+                if ticket is not None:
+                    ticket.set()
+            raise
+
+        #The request IDs are on disk now, so remember them in memory too (and forget the expired ones):
+        request_ids.update(new_request_ids)
+        if now - self.request_ids_pruned >= 60:
+            self.request_ids_pruned = now
+            while len(request_ids) and next(iter(request_ids.values())) < expired:
+                request_ids.popitem(last=False)
+
+        #Update the writer metrics:
+        self.batches_committed += 1
+        self.credits_committed += len(credits)
+        self.last_batch_size = len(batch)
+        self.commit_seconds += monotonic() - start
+
+        #The batch is safe on disk now, so acknowledge every wave credit in it, and let the website know:
+        for (x, ticket, request_id) in batch:
+            if ticket is not None:
+                ticket.durable = True
+                ticket.set()
+        if credits:
+            self.notify_website(last_row_id)
+
+        #Then insert them into the progress dictionary:
+        for x in credits:
+            self.insert_client_wave_credit(*x)
+        self.last_row_id = last_row_id
 
-            #First, insert it into the database:
-            self.db.execute("INSERT INTO WaveCredits (Steam64, TimeStamp, MissionIndex, WaveNumber) VALUES (?,?,?,?)", (str(steam64), timestamp, mission_index, wave_number))
+        #Every so often, snapshot the progress dictionary so restarts don't have to replay the whole database:
+        if monotonic() - self.snapshot_time >= self.settings["snapshotinterval"]:
+            self.save_progress_snapshot()
 
-            #Then insert it into the progress dictionary:
-            self.insert_client_wave_credit(steam64, timestamp, mission_index, wave_number)
 
 
 
 
+#Tells the website that wave credits up to the given rowid are in the database.
+#
+#This is a single UDP datagram to localhost holding the rowid, so it never blocks the database thread, and it doesn't
+#matter if the website isn't running. (The website still checks the database every few seconds in case one gets lost.)
 
-#Inserts a client's wave credit into the progress dictionary:
+    def notify_website(self, row_id):
 
-    def insert_client_wave_credit(self, steam64, timestamp, mission_index, wave_number):
+        port = self.settings["notifyport"]
+        if not port:
+            return None
 
-        #First, put the steam ID in the dictionary, if it doesn't exist already:
-        steam64 = int(steam64)
-        if steam64 not in self.progress_dictionary:
-            self.progress_dictionary[steam64] = self.blank_tour_tuple
+        try:
+            self.notify_socket.sendto(str(row_id).encode(), ("127.0.0.1", port))
+        except OSError:
+            pass
+
+
+
+
+
+#Returns the ingest queue and database writer metrics as a tuple of (name, value) pairs:
 
-        #Then grab the tuple out:
-        tour_tuple = self.progress_dictionary[steam64]
+    def get_statistics(self):
 
-        #Grab the wave completion bitflags for this mission out:
-        bitflags = tour_tuple[mission_index]
+        #Average time spent per commit, in milliseconds:
+        batches = self.batches_committed
+        commit_ms = 1000*self.commit_seconds/batches if batches else 0
 
-        #Insert in this wave credit:
-        bitflags |= 1 << wave_number
+        return self.post_requests_queue.get_statistics() + (("batches_committed", batches), ("credits_committed", self.credits_committed),
+                                                            ("last_batch_size", self.last_batch_size), ("average_commit_ms", round(commit_ms, 3)),
+                                                            ("duplicate_requests", self.duplicate_requests), ("remembered_request_ids", len(self.request_ids))) + self.grant_pool.get_statistics()
 
-        #Rebuild the tuple and insert it back into the progress dictionary:
-        #(We use tuples instead of lists, since lists use more memory and we don't mutate these THAT much.)
-        self.progress_dictionary[steam64] = tour_tuple[:mission_index] + (bitflags,) + tour_tuple[mission_index+1:]
+
+
+
+
+#Inserts a client's wave credit into the progress dictionary:
+
+    def insert_client_wave_credit(self, steam64, timestamp, mission_index, wave_number):
+
+        #Set the wave's completion bit on the player's progress. This is done in place, so there's nothing to rebuild.
+        #(Bad steam IDs are turned away when they come in, but don't let one stop the rest of the batch either.)
+        steam64 = int(steam64)
+        try:
+            self.progress_dictionary.add_wave_credit(steam64, mission_index, wave_number)
+        except ValueError:
+            return None
 
         #Check if the player has completed the tour. If so, drop the medal on their inventory.
         #This is how we feature a real-time medal drop for tour completion:
@@ -393,41 +1653,51 @@ class potato(object):
 
 
 
+#Checks every player in the progress dictionary for tour completion.
+#Only players who have every completion bit but not the medal get past the quick check in here.
+
+    def check_all_tour_completions(self):
+        completed_flags = self.progress_dictionary.completed_flags
+        for (x, y) in self.progress_dictionary:
+            if y == completed_flags and x not in self.medal_recepients:
+                self.check_tour_completion(x)
+
+
+
+
+
 #Checks if a client has completed the tour:
 
     def check_tour_completion(self, steam64):
 
-        #If this player has received the medal already, there's no need to check for anything:
-        if steam64 in self.medal_recepients:
+        #If this player has received the medal already (or is about to), there's no need to check for anything:
+        if steam64 in self.medal_recepients or steam64 in self.grant_pool:
             return None
 
-        #Grab their tour tuple, and check if it contains all the correct bitflags:
-        if self.progress_dictionary[steam64] != self.completed_tour_tuple:
+        #Check if their progress contains all the correct bitflags:
+        if not self.progress_dictionary.has_completed_tour(steam64):
             return None
 
-        #If they don't have the medal, but they have completed the tour, then give them the medal.
-        #Or at least, try giving the medal:
-        verdict = self.grant_medal_to_user(self.steam_api_key, self.promoid, steam64)
+        #If they don't have the medal, but they have completed the tour, then queue up their medal drop.
+        #The grant pool keeps retrying it until it goes through.
+        self.grant_pool.submit(steam64)
 
-        #If it failed, exit. Try giving them the medal again another time.
-        #Upon closing The Titanium Tank Tour, run this server one last time to ensure all eligible participants receive the medal.
-        if not verdict:
-            return None
 
-        #If the medal drop succeeded, put the player's steam ID into the medal owners table so we don't give them a medal again:
-        self.db.execute("INSERT INTO MedalOwners (Steam64, TimeStamp) VALUES (?,?)", (str(steam64), int(time())))
 
-        print("Gave medal to:", steam64)
 
-        #Put their steam ID into the set as well (which is 1:1 to the database table):
-        self.medal_recepients.add(steam64)
 
-        #Save the database entry immediately:
-        self.db.commit()
+#Called by the grant pool after a medal drop went through and was put into the medal owners table.
+#This is ran on a medal grant thread.
+
+    def medal_granted(self, steam64):
+
+        print("Gave medal to:", steam64)
 
-        #Write their steam ID to the text file:
-        self.f.write(str(steam64) + "\n")
-        self.f.flush()
+        #Put their steam ID into the set as well (which is 1:1 to the database table), and write it to the text file:
+        with self.medal_lock:
+            self.medal_recepients.add(steam64)
+            self.f.write(str(steam64) + "\n")
+            self.f.flush()
 
 
 
@@ -466,10 +1736,10 @@ class potato(object):
         encoded_post_fields = urlencode(post_fields).encode()
 
         #Create the POST request to send to the steam API / item server.
-        request = Request("https://api.steampowered.com/ITFPromos_440/GrantItem/v1/", encoded_post_fields)
+        request = Request(self.steam_api_url + "/ITFPromos_440/GrantItem/v1/", encoded_post_fields)
 
         #Send the request and read the response:
-        response = urlopen(request)
+        response = urlopen(request, timeout=self.settings["granttimeout"])
         data = response.read().decode()
 
         #Parse the returned string into json:
@@ -491,27 +1761,22 @@ class potato(object):
 #####################################################
 
 
-#Because this program gives medals to TF2 players, place a safeguard in case it is accidentally ran:
-if input("Enter 1337 to start this server:\t").strip() != "1337":
-    print("Aborted.")
-    raise SystemExit
-
-
-
-
-
-#Start the progress class. Make sure its mainloop runs on a worker thread:
-master = potato()
-Thread(target=master.mainloop).start()
-
-
+#Run this program.
+if __name__ == "__main__":
 
+    #Because this program gives medals to TF2 players, place a safeguard in case it is accidentally ran:
+    if input("Enter 1337 to start this server:\t").strip() != "1337":
+        print("Aborted.")
+        raise SystemExit
 
+    #Start the progress class. Make sure its mainloop runs on a worker thread:
+    master = potato()
+    Thread(target=master.mainloop).start()
 
-#Start the HTTP server:
-handler = ThreadedHTTPServer(("", 65432), TourProgressHandler)      #You MUST use a port that's not open to the internet
-print("Starting Titanium Tank Medal Server...")
-handler.serve_forever()
+    #Start the HTTP server:
+    handler = ThreadedHTTPServer(("", master.settings["port"]), TourProgressHandler)      #You MUST use a port that's not open to the internet
+    print("Starting Titanium Tank Medal Server...")
+    handler.serve_forever()
 
 
 
@@ -0,0 +1,123 @@
+
+#Titanium Tank Global Statistics Benchmark
+#Compares the website's pure Python and NumPy global statistics engines, and checks that they build the exact same global.csv.
+
+"""
+=============================================================================
+Titanium Tank Global Statistics Benchmark
+Copyright (C) 2018 Potato's MvM Servers.  All rights reserved.
+=============================================================================
+
+This program is free software; you can redistribute it and/or modify it under
+the terms of the GNU General Public License, version 3.0, as published by the
+Free Software Foundation.
+
+This program is distributed in the hope that it will be useful, but WITHOUT
+ANY WARRANTY; without even the implied warranty of MERCHANTABILITY or FITNESS
+FOR A PARTICULAR PURPOSE.  See the GNU General Public License for more details.
+
+You should have received a copy of the GNU General Public License along with
+this program.  If not, see <http://www.gnu.org/licenses/>.
+"""
+
+#Usage: python "Global Statistics Benchmark.py" [player counts, comma separated]
+#Defaults to 10k, 100k and 1M players. Run it from this folder. NumPy must be installed.
+#
+#Each player gets a random amount of progress spread over a 6 week tour, and about 1 in 20 players completes the whole tour.
+
+#Imports
+from array import array
+from importlib.util import spec_from_file_location, module_from_spec
+from random import Random
+from sys import argv
+from time import perf_counter
+
+
+
+
+
+#Waves per mission in the tour, and when the tour starts:
+TOUR_WAVES = (6, 7, 7, 6, 7, 6)
+TOUR_START = 1525132800
+TOUR_LENGTH = 6*7*86400
+
+
+
+
+
+#Loads the website program as a module, without starting it:
+
+def load_website():
+    spec = spec_from_file_location("tour_website", "../website/Website Server.py")
+    module = module_from_spec(spec)
+    spec.loader.exec_module(module)
+    return module
+
+
+
+
+
+#Generates random tour progress, in the same format as the website's timestamp store: one row of timestamps per player,
+#all back to back in one array, with 0 for the wave credits they don't have.
+
+def generate_timestamps(players):
+
+    random = Random(players)
+    total_credits = sum(TOUR_WAVES)
+    timestamps = array("I")
+    for x in range(players):
+
+        #When this player joined, and the chance of them having each wave credit:
+        joined = TOUR_START + random.randrange(TOUR_LENGTH)
+        chance = 1.0 if random.random() < 0.05 else random.random()*0.5
+        row = [joined + random.randrange(7*86400) if random.random() < chance else 0 for y in range(total_credits)]
+
+        #Every player has at least one wave credit:
+        if not any(row):
+            row[0] = joined
+
+        timestamps.extend(row)
+
+    return timestamps
+
+
+
+
+
+#Runs the whole benchmark:
+
+def main():
+
+    sizes = [int(x) for x in argv[1].split(",")] if len(argv) > 1 else [10000, 100000, 1000000]
+
+    website = load_website()
+    if website.numpy is None:
+        raise SystemExit("NumPy isn't installed.")
+
+    total_credits = sum(TOUR_WAVES)
+    mission_slices = list()
+    for x in TOUR_WAVES:
+        start = mission_slices[-1][1] if mission_slices else 0
+        mission_slices.append((start, start + x))
+
+    print("{:>10} {:>12} {:>12} {:>10} {:>10}".format("Players", "Python s", "NumPy s", "Speedup", "Identical"))
+    for players in sizes:
+        timestamps = generate_timestamps(players)
+
+        results = list()
+        for use_numpy in (False, True):
+            statistics = website.GlobalStatistics(tuple(mission_slices), total_credits, website.DayBuckets())
+            start = perf_counter()
+            statistics.rebuild(timestamps, use_numpy)
+            csv_raw = statistics.build_csv(website.DayCounts(), players, players*10)
+            results.append((perf_counter() - start, csv_raw))
+
+        ((python_seconds, python_csv), (numpy_seconds, numpy_csv)) = results
+        print("{:>10} {:>12.3f} {:>12.3f} {:>9.1f}x {:>10}".format(players, python_seconds, numpy_seconds, python_seconds/numpy_seconds, str(python_csv == numpy_csv)))
+
+
+
+
+
+if __name__ == "__main__":
+    main()
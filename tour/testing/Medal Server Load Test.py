@@ -0,0 +1,367 @@
+
+#Titanium Tank Medal Server Load Test
+#Floods a throwaway copy of the medal server with wave credits, the way a full tour would at peak hours.
+
+"""
+=============================================================================
+Titanium Tank Medal Server Load Test
+Copyright (C) 2018 Potato's MvM Servers.  All rights reserved.
+=============================================================================
+
+This program is free software; you can redistribute it and/or modify it under
+the terms of the GNU General Public License, version 3.0, as published by the
+Free Software Foundation.
+
+This program is distributed in the hope that it will be useful, but WITHOUT
+ANY WARRANTY; without even the implied warranty of MERCHANTABILITY or FITNESS
+FOR A PARTICULAR PURPOSE.  See the GNU General Public License for more details.
+
+You should have received a copy of the GNU General Public License along with
+this program.  If not, see <http://www.gnu.org/licenses/>.
+"""
+
+#Usage: python "Medal Server Load Test.py" [--servers 50] [--players 6] [--waves 12] [--wave-time 2.0] [--burst sync] ...
+#Run it from this folder. See --help for every option.
+#
+#The medal server and the Steam API stand-in server are started in a temporary folder with their own config files,
+#so the test always runs against an empty database and never hands out real medals. Each simulated tour server
+#plays one mission, and at the end of every wave it reports a wave credit for each of its players: one form-encoded
+#POST per player, or with --bulk, one POST to /credits with every player's wave credit in it (like the tour plugin).
+#
+#Burst shapes (when each tour server reaches the end of a wave):
+#
+#- "sync":       Every server finishes the wave at the same moment. This is the worst case.
+#- "staggered":  Servers are spread evenly across the wave time.
+#- "random":     Each server finishes its waves at random (exponentially distributed) times.
+
+#Imports
+from argparse import ArgumentParser
+from concurrent.futures import ThreadPoolExecutor
+from os import mkdir
+from os.path import abspath, join
+from random import expovariate
+from shutil import rmtree
+from socket import create_connection
+from subprocess import Popen, PIPE, DEVNULL
+from sys import executable
+from tempfile import mkdtemp
+from threading import Thread, Event, Lock
+from time import sleep, time, perf_counter
+from urllib.error import HTTPError
+from urllib.parse import urlencode
+from urllib.request import urlopen
+
+
+
+
+
+#The tour used by the test. (Same layout as Tour Information.csv.)
+TOUR_MAPS = (("mvm_dockyard_rc5b", "Spyware Shipping", 6), ("mvm_downtown_final3", "Entertainer's Entourage", 7),
+             ("mvm_powerplant_rc1", "Power Palliative", 7), ("mvm_steep_rc", "Peak Performance", 6),
+             ("mvm_teien_rc3", "Program Seppuku", 7), ("mvm_waterfront_rc3", "Watershed Waylay", 6))
+
+TT_API_KEY = "loadtestkey"
+FIRST_STEAM64 = 76561197960265728
+
+
+
+
+
+#####################################################
+#####################################################
+#####################################################
+
+
+#Builds the temporary folder tree, with a data folder holding every config file the medal server needs.
+#Returns the path of the folder to run the medal server from.
+
+def build_test_folder(root, options):
+
+    mkdir(join(root, "data"))
+    mkdir(join(root, "medals"))
+
+    with open(join(root, "data", "Steam API.csv"), mode="w", encoding="UTF-8") as f:
+        f.write("general,loadtest\nmedal,loadtest\npromoid,1\nbaseurl,http://localhost:{}\n".format(options.steam_port))
+
+    with open(join(root, "data", "Tour Information.csv"), mode="w", encoding="UTF-8") as f:
+        f.write("apikey,{}\n".format(TT_API_KEY))
+        for x in TOUR_MAPS:
+            f.write("{},{},{}\n".format(*x))
+
+    with open(join(root, "data", "Medal Server.csv"), mode="w", encoding="UTF-8") as f:
+        f.write("port,{}\nnotifyport,0\n".format(options.port))
+        for x in options.setting:
+            f.write("{},{}\n".format(*x.split("=", 1)))
+
+    return join(root, "medals")
+
+
+
+
+
+#Waits for a server to accept connections on a port. Returns False if it didn't come up in time.
+
+def wait_for_port(port, timeout):
+
+    deadline = time() + timeout
+    while time() < deadline:
+        try:
+            create_connection(("localhost", port), 1).close()
+            return True
+        except OSError:
+            sleep(0.1)
+    return False
+
+
+
+
+
+#Grabs the medal server's statistics page as a dictionary:
+
+def get_statistics(port):
+
+    with urlopen("http://localhost:{}/stats".format(port), timeout=5) as f:
+        rows = (x.split(",", 1) for x in f.read().decode().splitlines() if x)
+        return {x: y for (x, y) in rows}
+
+
+
+
+
+#####################################################
+#####################################################
+#####################################################
+
+
+#Runs the load test and collects the results.
+
+class LoadTest(object):
+
+#Init:
+
+    def __init__(self, options):
+
+        self.options = options
+        self.url = "http://localhost:{}/".format(options.port)
+
+        #Results, per request:
+        self.lock = Lock()
+        self.latencies = list()
+        self.codes = dict()
+
+        #Statistics page samples:
+        self.peak_depth = 0
+        self.done = Event()
+
+
+
+
+
+#Sends one wave credit to the medal server:
+
+    def send_wave_credit(self, steam64, mission_index, wave_number, request_id):
+
+        post_fields = urlencode({"key": TT_API_KEY, "steam64": steam64, "timestamp": int(time()),
+                                 "mission": mission_index, "wave": wave_number, "requestid": request_id}).encode()
+        self.send_request(self.url, post_fields)
+
+
+
+
+
+#Sends a whole wave's worth of wave credits to the medal server in one bulk request.
+#Each wave credit is a (steam64, mission index, wave number, request ID) tuple.
+
+    def send_wave_credits(self, wave_credits):
+
+        now = int(time())
+        lines = ["{},{},{},{},{}".format(x, now, y, z, w) for (x, y, z, w) in wave_credits]
+        self.send_request(self.url + "credits", "\n".join([TT_API_KEY] + lines).encode())
+
+
+
+
+
+#Sends a POST request to the medal server, and records how long it took:
+
+    def send_request(self, url, data):
+
+        start = perf_counter()
+        try:
+            with urlopen(url, data, timeout=60) as f:
+                code = f.status
+        except HTTPError as e:
+            code = e.code
+        except OSError:
+            code = "error"
+        latency = perf_counter() - start
+
+        with self.lock:
+            self.latencies.append(latency)
+            self.codes[code] = self.codes.get(code, 0) + 1
+
+
+
+
+
+#Plays a whole tour server: waits for the end of every wave, then reports a wave credit for each of its players.
+
+    def run_tour_server(self, pool, server_index, start):
+
+        options = self.options
+        mission_index = server_index % len(TOUR_MAPS)
+        waves = TOUR_MAPS[mission_index][2]
+
+        #When this server finishes its first wave:
+        if options.burst == "staggered":
+            due = start + options.wave_time*(1 + server_index/options.servers)
+        elif options.burst == "random":
+            due = start + expovariate(1/options.wave_time)
+        else:
+            due = start + options.wave_time
+
+        for x in range(options.waves):
+            sleep(max(0, due - time()))
+            wave_number = 1 + x % waves
+            wave_credits = [(FIRST_STEAM64 + server_index*options.players + y, mission_index, wave_number, "{}:{}:{}".format(server_index, y, x))
+                            for y in range(options.players)]
+            if options.bulk:
+                pool.submit(self.send_wave_credits, wave_credits)
+            else:
+                for y in wave_credits:
+                    pool.submit(self.send_wave_credit, *y)
+
+            due += expovariate(1/options.wave_time) if options.burst == "random" else options.wave_time
+
+
+
+
+
+#Samples the medal server's queue depth until the test is over:
+
+    def watch_queue(self):
+
+        while not self.done.wait(0.25):
+            try:
+                self.peak_depth = max(self.peak_depth, int(get_statistics(self.options.port)["depth"]))
+            except (OSError, KeyError, ValueError):
+                pass
+
+
+
+
+
+#Runs every tour server at once and prints the report:
+
+    def run(self):
+
+        options = self.options
+        before = get_statistics(options.port)
+
+        watcher = Thread(target=self.watch_queue)
+        watcher.start()
+
+        start = time()
+        with ThreadPoolExecutor(options.concurrency) as pool:
+            servers = [Thread(target=self.run_tour_server, args=(pool, x, start)) for x in range(options.servers)]
+            for x in servers:
+                x.start()
+            for x in servers:
+                x.join()
+        elapsed = time() - start
+
+        self.done.set()
+        watcher.join()
+
+        #In "queued" acknowledgement mode, the last wave credits may still be on their way to the database:
+        for x in range(100):
+            after = get_statistics(options.port)
+            if after["depth"] == "0" and float(after["credits_committed"]) + float(after["duplicate_requests"]) >= float(after["processed"]):
+                break
+            sleep(0.1)
+        self.print_report(before, after, elapsed)
+
+
+
+
+
+#Prints the results:
+
+    def print_report(self, before, after, elapsed):
+
+        latencies = sorted(self.latencies)
+        def percentile(p):
+            return 1000*latencies[min(len(latencies) - 1, int(len(latencies)*p))] if latencies else 0
+
+        def delta(name):
+            return float(after.get(name, 0)) - float(before.get(name, 0))
+
+        batches = delta("batches_committed")
+        credits = delta("credits_committed")
+
+        print()
+        print("Requests sent:       {} in {:.2f} seconds ({} servers x {} players x {} waves, {} bursts{})".format(
+              len(latencies), elapsed, self.options.servers, self.options.players, self.options.waves, self.options.burst, ", bulk" if self.options.bulk else ""))
+        print("Responses:           " + ", ".join("{}: {}".format(x, y) for (x, y) in sorted(self.codes.items(), key=str)))
+        print("Latency (ms):        p50 {:.1f}   p90 {:.1f}   p99 {:.1f}   max {:.1f}".format(percentile(0.5), percentile(0.9), percentile(0.99), percentile(1)))
+        print("Credits committed:   {:.0f} ({:.1f} per second)".format(credits, credits/elapsed))
+        print("Commits:             {:.0f} ({:.1f} per second, {:.1f} credits per batch, {} ms average)".format(
+              batches, batches/elapsed, credits/batches if batches else 0, after.get("average_commit_ms")))
+        print("Queue depth:         peak {} (sampled), peak {} (server)".format(self.peak_depth, after.get("peak_depth")))
+        print("Dropped / rejected:  {:.0f} / {:.0f}".format(delta("dropped"), delta("rejected")))
+
+
+
+
+
+#####################################################
+#####################################################
+#####################################################
+
+
+#Run this program.
+if __name__ == "__main__":
+
+    parser = ArgumentParser(description="Load test for the Titanium Tank medal server.")
+    parser.add_argument("--servers", type=int, default=50, help="number of tour servers (default 50)")
+    parser.add_argument("--players", type=int, default=6, help="players per tour server (default 6)")
+    parser.add_argument("--waves", type=int, default=12, help="waves each tour server plays (default 12)")
+    parser.add_argument("--wave-time", type=float, default=2.0, help="seconds between the end of two waves (default 2)")
+    parser.add_argument("--burst", choices=("sync", "staggered", "random"), default="sync", help="when the servers finish their waves (default sync)")
+    parser.add_argument("--bulk", action="store_true", help="send each wave's wave credits in one bulk request")
+    parser.add_argument("--concurrency", type=int, default=64, help="wave credits in flight at once (default 64)")
+    parser.add_argument("--port", type=int, default=65500, help="port to run the medal server on (default 65500)")
+    parser.add_argument("--steam-port", type=int, default=27081, help="port to run the Steam API stand-in server on (default 27081)")
+    parser.add_argument("--steam-latency", type=float, default=200.0, help="Steam API stand-in latency in milliseconds (default 200)")
+    parser.add_argument("--setting", action="append", default=[], metavar="NAME=VALUE", help="medal server setting, can be used more than once")
+    parser.add_argument("--keep", action="store_true", help="keep the temporary folder (and its database) afterwards")
+    options = parser.parse_args()
+
+    root = mkdtemp(prefix="titanium_tank_load_test_")
+    medals_folder = build_test_folder(root, options)
+    processes = list()
+    try:
+
+        #Start the Steam API stand-in server, so medal drops don't go to Valve:
+        processes.append(Popen([executable, abspath("Steam API Stand-In Server.py"), "--port", str(options.steam_port),
+                                "--latency", str(options.steam_latency)], stdout=DEVNULL))
+
+        #Start the medal server, and get past its safeguard prompt:
+        medal_server = Popen([executable, abspath("../medals/Tour Medal Server.py")], cwd=medals_folder, stdin=PIPE, stdout=DEVNULL, stderr=DEVNULL)
+        processes.append(medal_server)
+        medal_server.stdin.write(b"1337\n")
+        medal_server.stdin.close()
+
+        if not wait_for_port(options.steam_port, 15) or not wait_for_port(options.port, 60):
+            raise SystemExit("The servers didn't start. Are the ports in use?")
+
+        LoadTest(options).run()
+
+    finally:
+        for x in processes:
+            x.kill()
+            x.wait()
+        if options.keep:
+            print("Test folder:", root)
+        else:
+            rmtree(root, ignore_errors=True)
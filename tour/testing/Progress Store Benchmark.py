@@ -0,0 +1,154 @@
+
+#Titanium Tank Progress Store Benchmark
+#Compares the medal server's compact progress store against the old dictionary of tuples.
+
+"""
+=============================================================================
+Titanium Tank Progress Store Benchmark
+Copyright (C) 2018 Potato's MvM Servers.  All rights reserved.
+=============================================================================
+
+This program is free software; you can redistribute it and/or modify it under
+the terms of the GNU General Public License, version 3.0, as published by the
+Free Software Foundation.
+
+This program is distributed in the hope that it will be useful, but WITHOUT
+ANY WARRANTY; without even the implied warranty of MERCHANTABILITY or FITNESS
+FOR A PARTICULAR PURPOSE.  See the GNU General Public License for more details.
+
+You should have received a copy of the GNU General Public License along with
+this program.  If not, see <http://www.gnu.org/licenses/>.
+"""
+
+#Usage: python "Progress Store Benchmark.py" [player counts, comma separated] [wave credits per player]
+#Defaults to 1M, 5M and 20M players with 3 wave credits each. Run it from this folder.
+#
+#Memory is counted with sys.getsizeof: the containers themselves plus every key and tuple they own.
+#(Small ints are cached by Python, so the bitflags inside the tuples don't cost anything extra.)
+#Make sure the machine has enough RAM for the dictionary at the biggest player count (~4 GB for 20M).
+
+#Imports
+from gc import collect
+from importlib.util import spec_from_file_location, module_from_spec
+from sys import argv, getsizeof
+from time import perf_counter
+
+
+
+
+
+#Waves per mission in the tour, and the steam64 ID of the first player:
+TOUR_WAVES = (6, 7, 7, 6, 7, 6)
+FIRST_STEAM64 = 76561197960265728
+
+
+
+
+
+#Loads the medal server program as a module, without starting it:
+
+def load_medal_server():
+    spec = spec_from_file_location("tour_medal_server", "../medals/Tour Medal Server.py")
+    module = module_from_spec(spec)
+    spec.loader.exec_module(module)
+    return module
+
+
+
+
+
+#Generates the i-th wave credit of the benchmark as a (steam64, mission index, wave number) tuple.
+#Players are visited in a scrambled order, so neither structure gets a sequential access pattern for free.
+
+def get_wave_credit(i, players):
+    steam64 = FIRST_STEAM64 + (i*2654435761) % players
+    mission_index = i % len(TOUR_WAVES)
+    wave_number = 1 + (i // len(TOUR_WAVES)) % TOUR_WAVES[mission_index]
+    return steam64, mission_index, wave_number
+
+
+
+
+
+#The old medal server approach: a dictionary of steam64 -> tuple of per-mission bitflags.
+#Returns (insert seconds, lookup seconds, bytes used).
+
+def run_dictionary(players, credits):
+
+    blank_tour_tuple = (0,)*len(TOUR_WAVES)
+    progress_dictionary = dict()
+
+    #Insert every wave credit, rebuilding the tuple each time:
+    start = perf_counter()
+    for i in range(players*credits):
+        (steam64, mission_index, wave_number) = get_wave_credit(i, players)
+        tour_tuple = progress_dictionary.get(steam64, blank_tour_tuple)
+        progress_dictionary[steam64] = tour_tuple[:mission_index] + (tour_tuple[mission_index] | (1 << wave_number),) + tour_tuple[mission_index+1:]
+    insert_seconds = perf_counter() - start
+
+    #Look every player up once:
+    start = perf_counter()
+    for i in range(players):
+        progress_dictionary.get(FIRST_STEAM64 + i)
+    lookup_seconds = perf_counter() - start
+
+    #Count the memory:
+    used = getsizeof(progress_dictionary) + sum(getsizeof(x) + getsizeof(y) for (x, y) in progress_dictionary.items())
+    return insert_seconds, lookup_seconds, used
+
+
+
+
+
+#The new medal server approach: the compact progress store.
+#Returns (insert seconds, lookup seconds, bytes used).
+
+def run_progress_store(store_class, players, credits):
+
+    completed_tour_tuple = tuple(sum(1 << y for y in range(1, x+1)) for x in TOUR_WAVES)
+    store = store_class(completed_tour_tuple)
+
+    #Insert every wave credit in place:
+    start = perf_counter()
+    for i in range(players*credits):
+        store.add_wave_credit(*get_wave_credit(i, players))
+    insert_seconds = perf_counter() - start
+
+    #Look every player up once:
+    start = perf_counter()
+    for i in range(players):
+        store.get(FIRST_STEAM64 + i)
+    lookup_seconds = perf_counter() - start
+
+    #Count the memory:
+    used = getsizeof(store.keys) + getsizeof(store.flags)
+    return insert_seconds, lookup_seconds, used
+
+
+
+
+
+#Runs the whole benchmark:
+
+def main():
+
+    #Read the command line arguments:
+    sizes = [int(x) for x in argv[1].split(",")] if len(argv) > 1 else [1000000, 5000000, 20000000]
+    credits = int(argv[2]) if len(argv) > 2 else 3
+
+    store_class = load_medal_server().ProgressStore
+
+    print("{:>10} {:>16} {:>10} {:>10} {:>12} {:>8}".format("Players", "Structure", "Insert s", "Lookup s", "MiB", "B/player"))
+    for players in sizes:
+        for (name, function) in (("dict of tuples", lambda: run_dictionary(players, credits)),
+                                 ("ProgressStore",  lambda: run_progress_store(store_class, players, credits))):
+            (insert_seconds, lookup_seconds, used) = function()
+            collect()
+            print("{:>10} {:>16} {:>10.2f} {:>10.2f} {:>12.1f} {:>8.1f}".format(players, name, insert_seconds, lookup_seconds, used/1048576, used/players))
+
+
+
+
+
+if __name__ == "__main__":
+    main()
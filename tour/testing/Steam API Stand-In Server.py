@@ -0,0 +1,286 @@
+
+#Titanium Tank Steam API Stand-In Server
+#Emulates the parts of the steam web API the tour uses, so the medal path can be tested without Valve.
+
+"""
+=============================================================================
+Titanium Tank Steam API Stand-In Server
+Copyright (C) 2018 Potato's MvM Servers.  All rights reserved.
+=============================================================================
+
+This program is free software; you can redistribute it and/or modify it under
+the terms of the GNU General Public License, version 3.0, as published by the
+Free Software Foundation.
+
+This program is distributed in the hope that it will be useful, but WITHOUT
+ANY WARRANTY; without even the implied warranty of MERCHANTABILITY or FITNESS
+FOR A PARTICULAR PURPOSE.  See the GNU General Public License for more details.
+
+You should have received a copy of the GNU General Public License along with
+this program.  If not, see <http://www.gnu.org/licenses/>.
+"""
+
+#Usage: python "Steam API Stand-In Server.py" [--port 27080] [--latency 0] [--jitter 0] [--error-rate 0] [--fail-rate 0] [--rate-limit 0]
+#
+#Then add this row to ../data/Steam API.csv, so the medal server, the website and the contest medal distributor use it:
+#
+#   baseurl,http://localhost:27080
+#
+#Emulated endpoints:
+#
+#- POST /ITFPromos_440/GrantItem/v1/                 Gives the "medal". Answers {"result": {"status": 1}} on success.
+#- GET  /ISteamUser/ResolveVanityURL/v1/?vanityurl=  Resolves any vanity URL to a made-up (but stable) steam64 ID.
+#                                                    Vanity URLs starting with "missing" aren't found.
+#- GET  /stats                                       Request counters, as name,value CSV rows.
+#
+#Faults are injected in this order: rate limiting (429), server errors (500), then failed API results (status 2 / success 42).
+
+#Imports
+from argparse import ArgumentParser
+from http.server import BaseHTTPRequestHandler
+from json import dumps
+from random import random, uniform
+from socketserver import ThreadingMixIn, TCPServer
+from threading import Lock
+from time import sleep, monotonic
+from urllib.parse import urlsplit, parse_qs
+from zlib import crc32
+
+
+
+
+
+#####################################################
+#####################################################
+#####################################################
+
+
+#The web server itself.
+
+class SteamAPIHandler(BaseHTTPRequestHandler):
+
+#Handles GrantItem:
+
+    def do_POST(self):
+
+        length = int(self.headers.get("Content-Length", 0))
+        params = parse_qs(self.rfile.read(length).decode())
+
+        if urlsplit(self.path).path.rstrip("/") != "/ITFPromos_440/GrantItem/v1":
+            return self.send_reply(404, None)
+
+        if self.inject_faults():
+            return None
+
+        #Check the parameters just like the real thing would:
+        try:
+            steam64 = int(params["steamid"][0])
+            params["key"][0]
+            params["promoid"][0]
+        except (KeyError, ValueError):
+            return self.send_reply(400, None)
+
+        #Fail the grant on purpose, or give the medal:
+        if random() < self.server.options.fail_rate:
+            self.server.count("grant_failures")
+            return self.send_reply(200, {"result": {"status": 2, "statusDetail": "Stand-in failure"}})
+
+        with self.server.lock:
+            if steam64 in self.server.medal_owners:
+                self.server.counters["duplicate_grants"] += 1
+            self.server.medal_owners.add(steam64)
+            self.server.counters["grants"] += 1
+
+        return self.send_reply(200, {"result": {"status": 1, "item_id": str(crc32(str(steam64).encode()))}})
+
+
+
+
+
+#Handles ResolveVanityURL and the stats page:
+
+    def do_GET(self):
+
+        url = urlsplit(self.path)
+        path = url.path.rstrip("/")
+
+        if path == "/stats":
+            return self.send_statistics()
+
+        if path != "/ISteamUser/ResolveVanityURL/v1":
+            return self.send_reply(404, None)
+
+        if self.inject_faults():
+            return None
+
+        params = parse_qs(url.query)
+        if "key" not in params or "vanityurl" not in params:
+            return self.send_reply(400, None)
+
+        #Unknown vanity URLs:
+        vanity_url = params["vanityurl"][0]
+        if vanity_url.lower().startswith("missing") or random() < self.server.options.fail_rate:
+            self.server.count("vanity_failures")
+            return self.send_reply(200, {"response": {"success": 42, "message": "No match"}})
+
+        #Made-up steam64 IDs, derived from the vanity URL so the same one always resolves to the same player:
+        self.server.count("vanity_lookups")
+        steam64 = 76561197960265728 + crc32(vanity_url.lower().encode())
+        return self.send_reply(200, {"response": {"success": 1, "steamid": str(steam64)}})
+
+
+
+
+
+#Waits out the emulated latency, then applies the rate limit and random server errors.
+#Returns True if a fault was sent back (and the request is done).
+
+    def inject_faults(self):
+
+        options = self.server.options
+        self.server.count("requests")
+
+        latency = options.latency + uniform(-options.jitter, options.jitter)
+        if latency > 0:
+            sleep(latency/1000)
+
+        if not self.server.take_rate_limit_token():
+            self.server.count("rate_limited")
+            self.send_reply(429, None)
+            return True
+
+        if random() < options.error_rate:
+            self.server.count("server_errors")
+            self.send_reply(500, None)
+            return True
+
+        return False
+
+
+
+
+
+#Sends a response code with an optional JSON body:
+
+    def send_reply(self, code, json):
+
+        data = dumps(json).encode() if json is not None else b""
+        self.send_response(code)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+
+
+
+
+#Sends the request counters as name,value CSV rows:
+
+    def send_statistics(self):
+
+        with self.server.lock:
+            rows = sorted(self.server.counters.items()) + [("medal_owners", len(self.server.medal_owners))]
+
+        data = "".join("{},{}\n".format(x, y) for (x, y) in rows).encode()
+        self.send_response(200)
+        self.send_header("Content-Type", "text/csv")
+        self.send_header("Content-Length", str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+
+
+
+
+#Keep the console quiet, this server gets hammered:
+
+    def log_message(self, format, *args):
+        pass
+
+
+
+
+
+#####################################################
+#####################################################
+#####################################################
+
+
+#Threaded server, holding the options, counters and rate limiter shared by every request.
+
+class StandInServer(ThreadingMixIn, TCPServer):
+    """Handle requests in a separate thread."""
+
+    allow_reuse_address = True
+    daemon_threads = True
+    request_queue_size = 128
+
+#Init:
+
+    def __init__(self, options):
+        super().__init__(("", options.port), SteamAPIHandler)
+        self.options = options
+        self.lock = Lock()
+        self.counters = {"requests": 0, "grants": 0, "duplicate_grants": 0, "grant_failures": 0, "vanity_lookups": 0,
+                         "vanity_failures": 0, "rate_limited": 0, "server_errors": 0}
+        self.medal_owners = set()
+
+        #Token bucket for the rate limit, allowing bursts of up to one second's worth of requests:
+        self.tokens = options.rate_limit
+        self.tokens_time = monotonic()
+
+
+
+
+
+#Adds one to a counter:
+
+    def count(self, name):
+        with self.lock:
+            self.counters[name] += 1
+
+
+
+
+
+#Takes a token out of the rate limit bucket. Returns False if the client is over the rate limit.
+
+    def take_rate_limit_token(self):
+
+        rate = self.options.rate_limit
+        if rate <= 0:
+            return True
+
+        with self.lock:
+            now = monotonic()
+            self.tokens = min(rate, self.tokens + (now - self.tokens_time)*rate)
+            self.tokens_time = now
+            if self.tokens < 1:
+                return False
+            self.tokens -= 1
+            return True
+
+
+
+
+
+#####################################################
+#####################################################
+#####################################################
+
+
+#Run this program.
+if __name__ == "__main__":
+
+    parser = ArgumentParser(description="Stand-in for the steam web API's GrantItem and ResolveVanityURL endpoints.")
+    parser.add_argument("--port", type=int, default=27080, help="port to listen on (default 27080)")
+    parser.add_argument("--latency", type=float, default=0.0, help="average response time in milliseconds")
+    parser.add_argument("--jitter", type=float, default=0.0, help="random +/- milliseconds added to the response time")
+    parser.add_argument("--error-rate", type=float, default=0.0, help="fraction of requests answered with HTTP 500")
+    parser.add_argument("--fail-rate", type=float, default=0.0, help="fraction of requests answered with a failed API result")
+    parser.add_argument("--rate-limit", type=float, default=0.0, help="requests per second before answering HTTP 429 (0 = no limit)")
+
+    server = StandInServer(parser.parse_args())
+    print("Starting Steam API Stand-In Server on port {}...".format(server.options.port))
+    server.serve_forever()
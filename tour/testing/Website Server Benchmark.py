@@ -0,0 +1,347 @@
+#Titanium Tank Website Server Benchmark
+#Compares the website's threaded and asyncio servers while thousands of idle browser connections are held open.
+
+"""
+=============================================================================
+Titanium Tank Website Server Benchmark
+Copyright (C) 2018 Potato's MvM Servers.  All rights reserved.
+=============================================================================
+
+This program is free software; you can redistribute it and/or modify it under
+the terms of the GNU General Public License, version 3.0, as published by the
+Free Software Foundation.
+
+This program is distributed in the hope that it will be useful, but WITHOUT
+ANY WARRANTY; without even the implied warranty of MERCHANTABILITY or FITNESS
+FOR A PARTICULAR PURPOSE.  See the GNU General Public License for more details.
+
+You should have received a copy of the GNU General Public License along with
+this program.  If not, see <http://www.gnu.org/licenses/>.
+"""
+
+#Usage: python "Website Server Benchmark.py" [--idle 2000] [--clients 32] [--requests 20000] [--engine both] ...
+#Run it from this folder. See --help for every option.
+#
+#A throwaway copy of the website is started in a temporary folder, with its own tour progress database full of random
+#players, and with its rate limit turned off (every request comes from this machine). For each server engine:
+#
+#- First, --idle connections are opened and left alone, like browsers that opened a connection and haven't sent
+#  anything yet (or are sitting between two requests of a persistent connection).
+#- Then --clients threads send --requests GET requests between them, as fast as they can: the main page, the global
+#  statistics, a player's progress, and a tour server's VDF lookup. Each client thread reuses its connection when the
+#  server allows it (HTTP/1.1), and reconnects otherwise.
+
+#Imports
+from argparse import ArgumentParser
+from http.client import HTTPConnection
+from os import mkdir
+from os.path import abspath, join
+from random import Random
+from shutil import copytree, rmtree
+from socket import create_connection
+from sqlite3 import Connection
+from subprocess import Popen, DEVNULL
+from sys import executable
+from tempfile import mkdtemp
+from threading import Thread, Lock
+from time import sleep, time, perf_counter
+
+#The resource module only exists on Unix. It's used to allow enough open sockets for the idle connections.
+try:
+    from resource import getrlimit, setrlimit, RLIMIT_NOFILE
+except ImportError:
+    getrlimit = None
+
+
+
+
+
+#The tour used by the benchmark. (Same layout as Tour Information.csv.)
+TOUR_MAPS = (("mvm_dockyard_rc5b", "Spyware Shipping", 6), ("mvm_downtown_final3", "Entertainer's Entourage", 7),
+             ("mvm_powerplant_rc1", "Power Palliative", 7), ("mvm_steep_rc", "Peak Performance", 6),
+             ("mvm_teien_rc3", "Program Seppuku", 7), ("mvm_waterfront_rc3", "Watershed Waylay", 6))
+
+FIRST_STEAM64 = 76561197960265728
+
+
+
+
+
+#####################################################
+#####################################################
+#####################################################
+
+
+#Builds the temporary folder tree: a data folder with the config files and a tour progress database, and a website
+#folder with a copy of the HTML pages and their css, javascript and images. Returns the path of the folder to run the website from.
+
+def build_test_folder(root, options):
+
+    for x in ("html", "css", "js", "img"):
+        copytree("../website/" + x, join(root, "website", x))
+    data_folder = join(root, "data")
+    mkdir(data_folder)
+
+    with open(join(data_folder, "Steam API.csv"), mode="w", encoding="UTF-8") as f:
+        f.write("general,benchmark\nbaseurl,http://localhost:1\n")
+
+    with open(join(data_folder, "Tour Information.csv"), mode="w", encoding="UTF-8") as f:
+        f.write("apikey,benchmark\n")
+        for x in TOUR_MAPS:
+            f.write("{},{},{}\n".format(*x))
+
+    #Every player gets a random amount of progress, earned over the last few weeks:
+    rng = Random(options.seed)
+    now = int(time())
+    wave_credits = list()
+    for x in range(options.players):
+        for (y, (map_name, mission_name, waves)) in enumerate(TOUR_MAPS):
+            for z in range(rng.randint(0, waves)):
+                wave_credits.append((str(FIRST_STEAM64 + x), now - rng.randint(0, 21*86400), y, z + 1))
+
+    db = Connection(join(data_folder, "mvm_titanium_tank_tour_progress.sq3"))
+    db.execute("CREATE TABLE WaveCredits (Steam64 Text, TimeStamp Int, MissionIndex Int, WaveNumber Int)")
+    db.executemany("INSERT INTO WaveCredits VALUES (?, ?, ?, ?)", wave_credits)
+    db.commit()
+    db.close()
+
+    return join(root, "website")
+
+
+
+
+
+#Waits for a server to accept connections on a port. Returns False if it didn't come up in time.
+
+def wait_for_port(port, timeout):
+
+    deadline = time() + timeout
+    while time() < deadline:
+        try:
+            create_connection(("localhost", port), 1).close()
+            return True
+        except OSError:
+            sleep(0.1)
+    return False
+
+
+
+
+
+#Returns a process's thread count and resident memory (in MB), or None if it can't be found out. (Linux only.)
+#With --prefork, this is only the loader process.
+
+def get_process_usage(pid):
+
+    try:
+        with open("/proc/{}/status".format(pid)) as f:
+            fields = dict(x.split(":", 1) for x in f if ":" in x)
+        return int(fields["Threads"]), int(fields["VmRSS"].split()[0])/1024
+    except (OSError, KeyError, ValueError):
+        return None
+
+
+
+
+
+#Raises the limit of open files as far as it goes, so the idle connections fit. (The website inherits it.)
+
+def raise_open_file_limit():
+
+    if getrlimit is None:
+        return None
+    (soft, hard) = getrlimit(RLIMIT_NOFILE)
+    try:
+        setrlimit(RLIMIT_NOFILE, (hard, hard))
+    except (ValueError, OSError):
+        pass
+
+
+
+
+
+#####################################################
+#####################################################
+#####################################################
+
+
+#Benchmarks one server engine.
+
+class Benchmark(object):
+
+#Init:
+
+    def __init__(self, options, engine, port):
+
+        self.options = options
+        self.engine = engine
+        self.port = port
+
+        #The URLs the clients request, in turn:
+        self.urls = ("/TitaniumTank", "/TitaniumTank/global.csv", "/TitaniumTank/{}.csv", "/TitaniumTank/vdf/?steam64={}")
+
+        #Results:
+        self.lock = Lock()
+        self.latencies = list()
+        self.codes = dict()
+        self.connections = 0
+
+
+
+
+
+#Runs one client thread: sends its share of the requests, one after the other.
+
+    def run_client(self, client_index, requests):
+
+        rng = Random(client_index)
+        connection = HTTPConnection("localhost", self.port, timeout=60)
+        latencies = list()
+        codes = dict()
+        connections = 0
+
+        for x in range(requests):
+            url = self.urls[x % len(self.urls)].format(FIRST_STEAM64 + rng.randrange(self.options.players))
+
+            if connection.sock is None:
+                connections += 1
+
+            start = perf_counter()
+            try:
+                connection.request("GET", url, headers={"Accept-Encoding": "gzip"})
+                response = connection.getresponse()
+                response.read()
+                code = response.status
+                if response.will_close:
+                    connection.close()
+            except OSError:
+                code = "error"
+                connection.close()
+            latencies.append(perf_counter() - start)
+            codes[code] = codes.get(code, 0) + 1
+
+        connection.close()
+        with self.lock:
+            self.latencies += latencies
+            self.connections += connections
+            for (x, y) in codes.items():
+                self.codes[x] = self.codes.get(x, 0) + y
+
+
+
+
+
+#Opens the idle connections. Returns the ones that got through.
+
+    def open_idle_connections(self):
+
+        idle = list()
+        for x in range(self.options.idle):
+            try:
+                idle.append(create_connection(("localhost", self.port), 10))
+            except OSError:
+                pass
+        return idle
+
+
+
+
+
+#Starts the website, runs the benchmark against it, and prints the report:
+
+    def run(self, website_folder):
+
+        options = self.options
+        command = [executable, abspath("../website/Website Server.py"), "-port", str(self.port), "-nolimit"]
+        if self.engine == "asyncio":
+            command.append("-asyncio")
+        if options.prefork:
+            command += ["-prefork", str(options.prefork)]
+
+        website = Popen(command, cwd=website_folder, stdout=DEVNULL, stderr=DEVNULL)
+        idle = list()
+        try:
+            if not wait_for_port(self.port, 120):
+                raise SystemExit("The website didn't start. Is port {} in use?".format(self.port))
+
+            start = perf_counter()
+            idle = self.open_idle_connections()
+            idle_time = perf_counter() - start
+            sleep(1)
+            idle_usage = get_process_usage(website.pid)
+
+            share = options.requests // options.clients
+            clients = [Thread(target=self.run_client, args=(x, share)) for x in range(options.clients)]
+            start = perf_counter()
+            for x in clients:
+                x.start()
+            for x in clients:
+                x.join()
+            elapsed = perf_counter() - start
+
+            self.print_report(len(idle), idle_time, idle_usage, get_process_usage(website.pid), elapsed)
+
+        finally:
+            for x in idle:
+                x.close()
+            website.kill()
+            website.wait()
+
+
+
+
+
+#Prints the results:
+
+    def print_report(self, idle_count, idle_time, idle_usage, final_usage, elapsed):
+
+        latencies = sorted(self.latencies)
+        def percentile(p):
+            return 1000*latencies[min(len(latencies) - 1, int(len(latencies)*p))] if latencies else 0
+
+        def usage(x):
+            return "{} threads, {:.1f} MB".format(*x) if x is not None else "n/a"
+
+        print()
+        print("Engine:              " + self.engine + (", {} worker processes".format(self.options.prefork) if self.options.prefork else ""))
+        print("Idle connections:    {} of {} opened in {:.2f} seconds".format(idle_count, self.options.idle, idle_time))
+        print("Website usage:       {} with the idle connections, {} at the end".format(usage(idle_usage), usage(final_usage)))
+        print("Requests sent:       {} in {:.2f} seconds ({:.0f} per second, {} clients)".format(
+              len(latencies), elapsed, len(latencies)/elapsed, self.options.clients))
+        print("Connections opened:  {}".format(self.connections))
+        print("Responses:           " + ", ".join("{}: {}".format(x, y) for (x, y) in sorted(self.codes.items(), key=str)))
+        print("Latency (ms):        p50 {:.1f}   p90 {:.1f}   p99 {:.1f}   max {:.1f}".format(percentile(0.5), percentile(0.9), percentile(0.99), percentile(1)))
+
+
+
+
+
+#####################################################
+#####################################################
+#####################################################
+
+
+#Run this program.
+if __name__ == "__main__":
+
+    parser = ArgumentParser(description="Benchmark for the Titanium Tank website's threaded and asyncio servers.")
+    parser.add_argument("--idle", type=int, default=2000, help="idle connections held open during the benchmark (default 2000)")
+    parser.add_argument("--clients", type=int, default=32, help="client threads sending requests (default 32)")
+    parser.add_argument("--requests", type=int, default=20000, help="requests sent between every client (default 20000)")
+    parser.add_argument("--players", type=int, default=10000, help="players in the tour progress database (default 10000)")
+    parser.add_argument("--engine", choices=("both", "threaded", "asyncio"), default="both", help="server engine to benchmark (default both)")
+    parser.add_argument("--prefork", type=int, default=0, help="run the website with this many worker processes (default 0: one process)")
+    parser.add_argument("--port", type=int, default=27090, help="port to run the website on, the next one is used too (default 27090)")
+    parser.add_argument("--seed", type=int, default=1, help="random seed for the players' progress (default 1)")
+    options = parser.parse_args()
+
+    raise_open_file_limit()
+    engines = ("threaded", "asyncio") if options.engine == "both" else (options.engine,)
+
+    root = mkdtemp(prefix="titanium_tank_website_benchmark_")
+    try:
+        website_folder = build_test_folder(root, options)
+        for (x, y) in enumerate(engines):
+            Benchmark(options, y, options.port + x).run(website_folder)
+    finally:
+        rmtree(root, ignore_errors=True)
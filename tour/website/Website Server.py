@@ -21,19 +21,47 @@ this program.  If not, see <http://www.gnu.org/licenses/>.
 """
 
 #Imports
+from array import array
+from asyncio import start_server, get_running_loop, run as asyncio_run, wait_for, shield, IncompleteReadError, LimitOverrunError, TimeoutError as AsyncTimeoutError
+from bisect import bisect_right
+from collections import OrderedDict, deque
 from csv import reader
+from datetime import date
+from email.utils import parsedate_to_datetime
 from gzip import compress as gzip_compress
+from hashlib import sha1
 from http.server import SimpleHTTPRequestHandler, HTTPServer
+from io import BytesIO
+from itertools import islice
 from json import JSONDecoder
-from os import getcwd, sep
-from os.path import getmtime
+from mmap import mmap, ACCESS_READ
+from multiprocessing import Process, Queue, parent_process
+from os import getcwd, sep, remove, listdir, _exit
+from os.path import abspath, dirname, join, isdir, isfile, splitext
+from pickle import dump as pickle_dump, load as pickle_load
+from queue import Empty
+from shutil import rmtree
+from socket import socket, create_server, AF_INET, SOCK_DGRAM
 from socketserver import ThreadingMixIn, TCPServer
 from sqlite3 import Connection
-from threading import Thread
-from time import sleep, strftime, localtime, time
+from struct import Struct
+from sys import argv, path as sys_path
+from tempfile import mkdtemp
+from threading import Thread, Lock, Condition
+from time import sleep, strftime, localtime, mktime, monotonic, time
 from urllib.parse import urlparse, parse_qs, urlencode
 from urllib.request import urlopen
 
+#The vanity URL cache is shared with the contest medal distributor, in the common folder:
+sys_path.append(join(dirname(abspath(__file__)), "..", "common"))
+from vanity_cache import VanityCache
+
+#NumPy is optional. If it's installed, full rebuilds of the global statistics are vectorized with it.
+try:
+    import numpy
+except ImportError:
+    numpy = None
+
 
 
 
@@ -46,6 +74,9 @@ from urllib.request import urlopen
 
 class TourProgressWebsite(SimpleHTTPRequestHandler):
 
+    #True while answering a HEAD request: the headers are sent like usual, but no data after them.
+    head_only = False
+
 #Called every time a GET request is made.
 #
 #For our purposes, get requests are made by:
@@ -67,10 +98,30 @@ class TourProgressWebsite(SimpleHTTPRequestHandler):
 
 
 
+#Called when a HEAD request is made.
+#
+#It's answered just like a GET request, minus the data. (The HEAD handler this inherits would serve files out of the
+#working directory instead, and it doesn't work with the asyncio server at all.)
+
+    def do_HEAD(self):
+
+        self.head_only = True
+        try:
+            self.process_get_request()
+        except Exception as e:
+            print("Error in HEAD:", e)
+        finally:
+            self.head_only = False
+
+
+
+
+
 #Called when a POST request is made.
 #
 #For our purposes, POST requests are made by:
 #- MvM servers reporting their server information (requires TT API key).
+#- MvM servers fetching the tour progress of a whole lobby at once (requires TT API key).
 #- Clients submitting a steam profile link to check progress (no API key).
 
     def do_POST(self):
@@ -93,21 +144,22 @@ class TourProgressWebsite(SimpleHTTPRequestHandler):
 
     def process_get_request(self):
 
+        #For sanity, make the path all lowercase and remove any trailing slashes:
+        relative_path = self.path.strip("/").lower()
+
+        #Split it along the slashes:
+        path_split = relative_path.split("/")
+
         #Check rate limit. Don't allow clients to interact with the server
         #if they make way too many requests to it. No legitimate user should
         #ever hit the rate limit, but just to be safe, impose a check anyway.
-        if self.exceeded_rate_limit():
+        #(Static assets have their own, more generous rate limit, see potato.asset_rate_limiter.)
+        if self.exceeded_rate_limit(path_split[:2] == ["titaniumtank", "static"]):
             return None
 
         #Check if the browser requesting the data supports gzipped compressed content:
         self.supports_gzip = self.check_gzip_support()
 
-        #For sanity, make the path all lowercase and remove any trailing slashes:
-        relative_path = self.path.strip("/").lower()
-
-        #Split it along the slashes:
-        path_split = relative_path.split("/")
-
         #The first section must be "titaniumtank" or else send 404:
         if path_split[0] != "titaniumtank":
             self.serve_page(404)
@@ -124,6 +176,11 @@ class TourProgressWebsite(SimpleHTTPRequestHandler):
 
         #Based on the string, determine where we go.
 
+        #Static assets (css, javascript and images), named by the rest of the path:
+        if resource == "static":
+            self.serve_asset("/".join(path_split[2:]).split("?")[0])
+            return None
+
         #Global tour information:
         if resource == "global":
             self.serve_page(200, "global")
@@ -134,6 +191,11 @@ class TourProgressWebsite(SimpleHTTPRequestHandler):
             self.serve_page(200, "servers")
             return None
 
+        #Live tour server information, for the servers page:
+        if resource == "events":
+            self.serve_server_events()
+            return None
+
         #Tour information requested by SRCDS:
         if resource == "vdf":
             self.serve_vdf_data()
@@ -172,57 +234,63 @@ class TourProgressWebsite(SimpleHTTPRequestHandler):
         #Based on the csv filename, determine what we serve back.
 
         #Global data:
+        #(It only changes when the global statistics are rebuilt, so browsers can keep their copy until then.)
         if csv_filename == "global.csv":
-            (raw, compressed) = master.global_data_csv
-            data = compressed if self.supports_gzip else raw
-
-        #Server data:
-        elif csv_filename == "servers.csv":
-            data = self.generate_server_csv()
+            (raw, compressed, etag, last_modified) = master.global_data_csv
+            if self.client_has_version(etag, last_modified):
+                self.serve_not_modified("no-cache", etag, last_modified)
+                return None
+            self.serve_data(compressed if self.supports_gzip else raw, "no-cache", etag, last_modified)
+            return None
 
-        #Player data:
-        else:
+        #Website statistics:
+        if csv_filename == "stats.csv":
+            statistics = (master.response_cache.get_statistics() + master.rate_limiter.get_statistics() + master.server_rate_limiter.get_statistics() +
+                          master.asset_rate_limiter.get_statistics() + master.banned_ips.get_statistics() + master.vanity_cache.get_statistics() +
+                          master.server_events.get_statistics())
+            self.serve_data(create_csv_rows(statistics).encode())
+            return None
 
-            #The steam ID is a 64-bit number. Try converting it to an integer first:
-            try:
-                steam64 = int(csv_filename.replace(".csv", ""))
+        #Server data (changes every second):
+        if csv_filename == "servers.csv":
+            data = self.generate_server_csv()
+            self.serve_data(data)
+            return None
 
-            #If it fails, serve a 404 error:
-            except:
-                self.serve_page(404)
-                return None
+        #Player data.
+        #The steam ID is a 64-bit number. Try converting it to an integer first:
+        try:
+            steam64 = int(csv_filename.replace(".csv", ""))
 
-            #Grab the data for this player's tour progress:
-            data = self.generate_player_csv(steam64)
+        #If it fails, serve a 404 error:
+        except:
+            self.serve_page(404)
+            return None
 
+        #Grab the data for this player's tour progress.
+        #It's versioned by the row ID of the last wave credit that changed it, as of when the data was built. The cache
+        #entry keeps that version with the data, so the ETag always matches the data that's sent, even if the player
+        #changed in between (pre-fork workers only throw out their cached data a moment after the row ID changes).
+        entry = self.get_player_entry(steam64, "csv", None, self.generate_player_csv)
+        etag = "{}-p{}".format(master.instance_tag, entry[2])
 
-        #Serve the CSV data to the client:
-        self.serve_data(data)
+        #If the browser already has that version, tell it to use its own copy. Otherwise, serve it to the client:
+        if self.client_has_version(etag):
+            self.serve_not_modified("no-cache", etag)
+            return None
+        self.serve_data(self.get_entry_data(entry), "no-cache", etag)
 
 
 
 
 
 #Generates a CSV file of server data to send to the client.
+#(Servers that stopped reporting are taken off the list by a timer, see ServerEvents.)
 
     def generate_server_csv(self):
 
-        #The first row is the current unix time:
-        t = int(time())
-        csv_list = [str(t)]
-
-        #Add subsequent servers to it:
-        server_dict = master.server_info_dict
-        for x in server_dict:
-
-            #If the server hasn't reported an update for over a minute now, assume it went offline.
-            #Only include servers that have reported data sometime within the past minute.
-            data = server_dict[x]
-            if (t - data[-1]) < 60:
-                csv_list.append(create_csv_row(data))
-
-        #Join all the rows by newlines and make a binary string:
-        csv_raw = "\n".join(csv_list).encode()
+        #The first row is the current unix time, followed by a row per server. Make it a binary string:
+        csv_raw = master.server_events.build_csv().encode()
 
         #Based on whether the client accepts gzip encoding or not,
         #determine whether we should compress this data or not:
@@ -232,39 +300,143 @@ class TourProgressWebsite(SimpleHTTPRequestHandler):
 
 
 
-#Generates a CSV file of player data to send to the client.
+#Streams the tour server information to the servers page as it changes, with Server-Sent Events (see ServerEvents).
+#The connection stays open until the browser goes away, with a comment line every 15 seconds to check on it.
+
+    def serve_server_events(self):
+
+        #Make sure there's room for another browser:
+        if not master.server_events.add_listener():
+            self.supports_gzip = False
+            self.serve_data(bytes(), http_code=503)
+            return None
+
+        #Send the headers. There's no length, the stream ends when the connection closes:
+        self.send_response(200)
+        self.send_header("Content-Type", "text/event-stream")
+        self.send_header("Cache-Control", "no-store")
+        self.end_headers()
+        self.close_connection = True
+
+        #Then stream the events. (HEAD requests only get the headers.)
+        if self.head_only:
+            master.server_events.remove_listener()
+            return None
+        self.stream_server_events()
+
+
+
+
+
+#Sends the events to the browser, forever. (The asyncio server does this on its own, see AsyncHTTPServer.)
+
+    def stream_server_events(self):
+
+        events = master.server_events
+        try:
+
+            #Tell the browser to wait 5 seconds before reconnecting, then send it the whole table, and every event after it:
+            self.wfile.write(b"retry: 5000\n\n")
+            (data, position) = events.get_events(None)
+            while True:
+                self.wfile.write(data or b": keep-alive\n\n")
+                (data, position) = events.wait_for_events(position, 15)
+
+        #The browser went away:
+        except OSError:
+            pass
+
+        finally:
+            events.remove_listener()
+
+
 
-    def generate_player_csv(self, steam64):
 
-        #The first row contains the server timestamp, total wave credits (39), and total maximum waves (7).
+
+#Generates a CSV file of player data to send to the client. row_id is the player's data version.
+#This goes through the response cache, see get_player_entry.
+
+    def generate_player_csv(self, steam64, mission_index, row_id):
+
+        #The first row contains the player's data version, total wave credits (39), and total maximum waves (7).
+        #(The browser gets the server's time from the Date header, so that this data only changes when the player's progress does.)
         p = master                              #One global lookup
         max_waves = p.max_waves
-        first_row = create_csv_row((int(time()), p.total_credits, max_waves))
+        first_row = create_csv_row((row_id, p.total_credits, max_waves))
 
         #Put this in a list:
         csv_list = [first_row]
 
-        #Per mission tuple in this player's tour dictionary:
-        for x in p.tour_progress_dict.get(steam64, ()):
+        #Per mission in this player's row of timestamps (players without any progress don't get any rows):
+        row = p.tour_progress.get(steam64)
+        for (start, end) in (p.mission_slices if row is not None else ()):
 
             #This is the row that becomes the CSV file string.
-            #None's become empty strings, timestamps stay the same:
-            new_row = ["" if y is None else y for y in x]
+            #Missing wave credits (0's) become empty strings, timestamps stay the same:
+            new_row = [y or "" for y in row[start:end]]
 
             #Pad it with -1's for missions that have less than the maximum number of waves:
-            padding = max_waves - len(x)
+            padding = max_waves - (end - start)
             new_row.extend((-1,)*padding)
 
             #Compile it into a CSV row string and put it into the csv list:
             csv_list.append(create_csv_row(new_row))
 
 
-        #Join all the rows by newlines and make a binary string:
-        csv_raw = "\n".join(csv_list).encode()
+        #Join all the rows by newlines:
+        return "\n".join(csv_list)
+
+
+
+
+
+#Returns a player's data of some kind (csv or tour), raw or gzipped depending on what the client supports.
+#See get_player_entry.
+
+    def get_player_data(self, steam64, kind, mission_index, build_function):
+        return self.get_entry_data(self.get_player_entry(steam64, kind, mission_index, build_function))
+
+
+
+
+
+#Returns the response cache's [raw, gzipped, data version] entry of a player's data of some kind (csv or tour).
+#
+#If it's not in the cache, build_function(steam64, mission_index, row_id) builds the data as a string, and it's put in
+#the cache. The data version (the player's row ID) is read before the data is built, so the data is never older than it.
+
+    def get_player_entry(self, steam64, kind, mission_index, build_function):
+
+        #Look it up:
+        cache = master.response_cache
+        key = (steam64, kind, mission_index)
+        entry = cache.get(key)
+
+        #If it's not there, build it and cache it:
+        if entry is None:
+            epoch = cache.epoch
+            row_id = master.player_row_ids.get(steam64, 0)
+            entry = cache.put(key, build_function(steam64, mission_index, row_id).encode(), epoch, row_id)
+
+        return entry
+
+
 
-        #Based on whether the client accepts gzip encoding or not,
-        #determine whether we should compress this data or not:
-        return gzip_compress(csv_raw) if self.supports_gzip else csv_raw
+
+
+#Given a [raw, gzipped, ...] entry of data, returns the raw or gzipped data depending on what the client supports.
+
+    def get_entry_data(self, entry):
+
+        #Serve the raw data if the client can't take gzip:
+        if not self.supports_gzip:
+            return entry[0]
+
+        #Otherwise, gzip it if nobody has yet.
+        #(Two threads may both do it at once, but they end up with the same bytes, so that's harmless.)
+        if entry[1] is None:
+            entry[1] = gzip_compress(entry[0])
+        return entry[1]
 
 
 
@@ -283,17 +455,12 @@ class TourProgressWebsite(SimpleHTTPRequestHandler):
 
         #If the mission index is unspecified, generate the global tour keyvalue string:
         if mission_index is None:
-            data = self.build_full_tour_kv(steam64)
+            payload = self.get_player_data(steam64, "tour", None, self.build_full_tour_kv)
 
-        #Otherwise, only return the bitflags for just that mission:
+        #Otherwise, only return the bitflags for just that mission.
+        #That keyvalue file is prebuilt for every possible bitflags value, so it doesn't need the response cache:
         else:
-            data = self.build_mission_kv(steam64, mission_index)
-
-
-        #Based on whether the client accepts gzip encoding or not,
-        #determine whether we should compress this data or not:
-        raw_data = data.encode()
-        payload = gzip_compress(raw_data) if self.supports_gzip else raw_data
+            payload = self.get_entry_data(self.get_mission_kv_entry(steam64, mission_index))
 
         #Then serve it to the client:
         self.serve_data(payload)
@@ -331,26 +498,20 @@ class TourProgressWebsite(SimpleHTTPRequestHandler):
 
 
 
-#Builds the full keyvalues tree of this steam ID's data:
+#Builds the full keyvalues tree of this steam ID's data, out of the prebuilt lines for their missions' bitflags.
+#(The mission index is always None and the row ID isn't used, they're only here so this fits get_player_entry.)
 
-    def build_full_tour_kv(self, steam64):
+    def build_full_tour_kv(self, steam64, mission_index, row_id):
 
-        #If this steam ID doesn't exist in the progress dictionary, return an empty keyvalue file:
-        tour_info = master.tour_progress_dict.get(steam64)
-        if tour_info is None:
+        #If this steam ID doesn't exist in the progress store, return an empty keyvalue file:
+        bitflags = master.tour_progress.get_bitflags(steam64)
+        if bitflags is None:
             return '"tour"\n{\n}'
 
-        #Start off with the key header:
+        #Start off with the key header, then put in each mission followed by the bitflag of wave completions:
+        lines = master.tour_kv_lines
         kv = ['"tour"\n{']
-
-        #Per mission tuple:
-        for (x,y) in enumerate(tour_info):
-
-            #Get the bitflag of wave completions for this mission:
-            bitflags = self.get_mission_completion_bitflags(y)
-
-            #Put the mission in followed by the bitflag of wave completions:
-            kv.append('"{}" "{}"'.format(x, bitflags))
+        kv.extend(lines[x][y] for (x,y) in enumerate(bitflags))
 
         #Then close the keyvalue file:
         kv.append("}")
@@ -362,45 +523,17 @@ class TourProgressWebsite(SimpleHTTPRequestHandler):
 
 
 
-#Builds a keyvalue of just one mission's data:
-
-    def build_mission_kv(self, steam64, mission_index):
-
-        #If this steam ID doesn't exist in the progress dictionary, return an empty keyvalue file:
-        tour_info = master.tour_progress_dict.get(steam64)
-        if tour_info is None:
-            return '"mission"\n{\n}'
-
-        #Otherwise, use the mission index to get the mission tuple of interest:
-        mission_tuple = tour_info[mission_index]
-
-        #Compute the bitflags for this mission tuple:
-        bitflags = self.get_mission_completion_bitflags(mission_tuple)
+#Returns the prebuilt [raw, gzipped] entry of the keyvalue file of just one mission's data:
 
-        #Generate and return the keyvalue string:
-        return '"mission"\n{\n"%d"\t"%d"\n}' % (mission_index, bitflags)
+    def get_mission_kv_entry(self, steam64, mission_index):
 
+        #If this steam ID doesn't exist in the progress store, return an empty keyvalue file:
+        bitflags = master.tour_progress.get_bitflags(steam64)
+        if bitflags is None:
+            return master.empty_mission_kv_entry
 
-
-
-
-#Given a timestamp tuple representing a mission's wave credits, return a bitflag consisting
-#of the mission's wave credits. This is used to build keyvalue files to send back to SRCDS.
-
-    def get_mission_completion_bitflags(self, mission_tuple):
-
-        #Store the completion bitflag for this mission here:
-        bitflags = 0
-
-        #Per wave in the mission:
-        for (x,y) in enumerate(mission_tuple, start=1):
-
-            #If there is a timestamp specified, then set the appropriate bit on the bitflag:
-            if y is not None:
-                bitflags |= 1 << x
-
-        #Done
-        return bitflags
+        #Otherwise, look up the one for this mission's bitflags:
+        return master.mission_kv_entries[mission_index][bitflags[mission_index]]
 
 
 
@@ -423,9 +556,14 @@ class TourProgressWebsite(SimpleHTTPRequestHandler):
         #Grab the data size:
         content_len = int(self.headers['content-length'])
 
-        #If it's over 255 chars, cap it to 255. (So that people don't put 1 GB of shit in there.)
-        if content_len > 255:
-            content_len = 255
+        #Batch VDF requests go to the VDF link, and carry a whole lobby's worth of steam IDs:
+        path_split = urlparse(self.path).path.strip("/").lower().split("/")
+        is_vdf_batch = len(path_split) > 1 and path_split[1] == "vdf"
+
+        #If it's over 255 chars (4096 for batch VDF requests), cap it. (So that people don't put 1 GB of shit in there.)
+        max_len = 4096 if is_vdf_batch else 255
+        if content_len > max_len:
+            content_len = max_len
 
         #Read in the post body data for the specified number of bytes:
         post_body = self.rfile.read(content_len)
@@ -440,7 +578,15 @@ class TourProgressWebsite(SimpleHTTPRequestHandler):
         #
         #These requests have a key parameter since they require the TT API key.
         #Otherwise, random POST requests from the internet can mess up the server page.
-        if "key" in params_dict:
+        #
+        #SRCDS also posts to the VDF link with the key, to get the tour progress of every player on the server at once.
+        if "key" in params_dict and is_vdf_batch:
+            try:
+                self.serve_vdf_batch(params_dict)
+            except:
+                return None
+
+        elif "key" in params_dict:
             try:
                 self.handle_server_info_report(params_dict)
             except:
@@ -467,6 +613,45 @@ class TourProgressWebsite(SimpleHTTPRequestHandler):
 
     def handle_server_info_report(self, params_dict):
 
+        #Drop the request unless it comes from a tour server:
+        client_ip = self.authenticate_tour_server(params_dict)
+        if client_ip is None:
+            return None
+
+        #Cache the master object locally:
+        p = master
+
+        #Grab all the other data:
+        server_number = params_dict["number"][0]
+        mission_index = params_dict["mission"][0]
+        wave_number   = params_dict["wave"][0]
+        round_state   = params_dict["roundstate"][0]
+        defenders     = params_dict["defenders"][0]
+        connecting    = params_dict["connecting"][0]
+        is_passworded = params_dict["haspassword"][0]
+        port_number   = params_dict["port"][0]
+
+        #Get the total number of waves for this mission:
+        total_waves = p.tour_maps_list[int(mission_index)][1]
+
+        #Place all this into the global server information dictionary:
+        p.server_info_dict[server_number] = (server_number, is_passworded, mission_index, defenders,
+                                             connecting, wave_number, total_waves, round_state,
+                                             client_ip, port_number, int(time()))
+
+        #Give this request's token back to the IP address it came from.
+        #Valid server information reports are not subject to the rate limitation.
+        p.rate_limiter.refund(self.client_address[0])
+
+
+
+
+
+#Checks the TT API key of a request that claims to come from a tour server.
+#Returns the tour server's IP address, or None if the request has to be dropped.
+
+    def authenticate_tour_server(self, params_dict):
+
         #Grab the IP address of the client:
         client_ip = self.client_address[0]
 
@@ -483,43 +668,91 @@ class TourProgressWebsite(SimpleHTTPRequestHandler):
 
         #If this IP is banned from making POST requests with a web API key, drop the request.
         #This prevents outsiders from trying to brute force guess the API key.
-        if client_ip in p.banned_post_ips:
+        if p.banned_ips.is_banned(client_ip):
             return None
 
         #First, check the key that was passed to here.
         #
-        #If a bad key was passed in, permanently ban that IP address. This means someone is
+        #If a bad key was passed in, ban that IP address (for a week). This means someone is
         #trying to inject their server into the main server information page.
+        #Also empty their rate limit bucket, so they have to wait a while before they can make any other requests.
         #
         #Nobody except authorized tour servers have any reason to make a POST request with
         #a Titanium Tank API key.
         key = params_dict["key"][0]
         if key != p.tt_api_key:
-            p.banned_post_ips.add(client_ip)
-            p.ip_requests_count[client_ip] = 9001
+            p.banned_ips.ban(client_ip, p.ban_duration, "Bad TT API key")
+            p.rate_limiter.drain(self.client_address[0])
             return None
 
-        #Grab all the other data:
-        server_number = params_dict["number"][0]
-        mission_index = params_dict["mission"][0]
-        wave_number   = params_dict["wave"][0]
-        round_state   = params_dict["roundstate"][0]
-        defenders     = params_dict["defenders"][0]
-        connecting    = params_dict["connecting"][0]
-        is_passworded = params_dict["haspassword"][0]
-        port_number   = params_dict["port"][0]
+        return client_ip
 
-        #Get the total number of waves for this mission:
-        total_waves = p.tour_maps_list[int(mission_index)][1]
 
-        #Place all this into the global server information dictionary:
-        p.server_info_dict[server_number] = (server_number, is_passworded, mission_index, defenders,
-                                             connecting, wave_number, total_waves, round_state,
-                                             client_ip, port_number, int(time()))
 
-        #Decrement this IP's rate limit request from the dictionary.
-        #Valid server information reports are not subject to the rate limitation.
-        p.ip_requests_count[client_ip] -= 1
+
+
+#Serves the tour progress of many players at once, to a tour server.
+#
+#When the map changes, SRCDS wants the progress of everyone on the server. Rather than a GET request for each player,
+#which all count towards the public rate limit of the server's IP address, it can post every steam ID to the VDF link
+#in one go, along with the TT API key:
+#
+#   key=<TT API key>&steam64=<steam64>,<steam64>,...&mission=<mission index>
+#
+#The mission index is optional, like for the GET requests. The keyvalues file that comes back has a block for every
+#steam ID (empty for players without any progress), with the bitflags of every mission, or only of that mission:
+#
+#   "players"
+#   {
+#   "<steam64>"
+#   {
+#   "<mission index>" "<bitflags>"
+#   ...
+#   }
+#   ...
+#   }
+#
+#Authenticated tour servers get their own rate limit, see potato.server_rate_limiter.
+
+    def serve_vdf_batch(self, params_dict):
+
+        #Drop the request unless it comes from a tour server:
+        if self.authenticate_tour_server(params_dict) is None:
+            return None
+
+        #It doesn't count towards the public rate limit, only towards the tour servers' one:
+        p = master
+        p.rate_limiter.refund(self.client_address[0])
+        if not p.server_rate_limiter.take(self.client_address[0]):
+            return None
+
+        #Grab the steam IDs. They can be comma separated, or each be their own parameter. Up to 64 of them are served:
+        steam64s = [int(y) for x in params_dict["steam64"] for y in x.split(",") if y][:64]
+
+        #Grab the mission index, if there is one:
+        mission_index = params_dict.get("mission")
+        if mission_index is not None:
+            mission_index = int(mission_index[0])
+            if not 0 <= mission_index < len(p.mission_slices):
+                raise ValueError("Bad mission index: {}".format(mission_index))
+
+        #Build the keyvalues file out of the prebuilt lines for each player's missions' bitflags:
+        lines = p.tour_kv_lines
+        kv = ['"players"\n{']
+        for x in steam64s:
+            kv.append('"{}"\n{{'.format(x))
+            bitflags = p.tour_progress.get_bitflags(x)
+            if bitflags is not None:
+                if mission_index is None:
+                    kv.extend(lines[y][z] for (y,z) in enumerate(bitflags))
+                else:
+                    kv.append(lines[mission_index][bitflags[mission_index]])
+            kv.append("}")
+        kv.append("}")
+
+        #Then serve it to the tour server:
+        data = "\n".join(kv).encode()
+        self.serve_data(gzip_compress(data) if self.supports_gzip else data)
 
 
 
@@ -563,6 +796,7 @@ class TourProgressWebsite(SimpleHTTPRequestHandler):
         #Using the steam ID, redirect the client to the proper tour progress page:
         self.send_response(301)
         self.send_header('Location', '/TitaniumTank/{}'.format(steam64))
+        self.send_header('Content-Length', '0')
         self.end_headers()
 
         #Return true to denote success (avoid triggering the exception handler):
@@ -573,87 +807,114 @@ class TourProgressWebsite(SimpleHTTPRequestHandler):
 
 
 #Resolves a custom steam profile vanity URL to a steam64 ID.
+#The answer comes out of the vanity URL cache if someone looked it up recently, see VanityCache.
 
     def resolve_vanity_url(self, vanity_url):
 
-        #Reference: https://lab.xpaw.me/steam_api_documentation.html#ISteamUser_ResolveVanityURL_v1
+        #If the vanity URL resolves to a steam ID, return it:
+        steam64 = master.vanity_cache.resolve(vanity_url)
+        if steam64 is not None:
+            return steam64
 
-        #Create the GET parameters and build the full API url:
-        params = urlencode({'key':master.steam_api_key, 'vanityurl': vanity_url})
-        url = "https://api.steampowered.com/ISteamUser/ResolveVanityURL/v1/?" + params
+        #Otherwise, raise an exception and abort the call stack.
+        raise ValueError("Unknown vanity URL: " + vanity_url)
 
-        #Open the response and read it in:
-        with urlopen(url) as f:
-            data = f.read().decode()
 
-        #Parse the resulting json:
-        json_parser = JSONDecoder()
-        root = json_parser.decode(data)
 
-        #Grab the response node:
-        response_node = root["response"]
 
-        #If the API call was a success, return the steam ID:
-        if response_node["success"] == 1:
-            return int(response_node["steamid"])
 
-        #Otherwise, raise an exception and abort the call stack.
-        raise
+#####################################################
 
 
+#Returns true if a client has hit the server rate limit, false otherwise.
+#Requests for static assets are checked against the static assets' rate limit instead.
 
+    def exceeded_rate_limit(self, is_asset=False):
 
+        #Clients are allowed to make 1 request to the server per second, but burst requests of up to 60 are supported.
+        #Once they run out, they get another request every second.
+        if is_asset:
+            return not master.asset_rate_limiter.take(self.client_address[0])
+        return not master.rate_limiter.take(self.client_address[0])
 
-#####################################################
 
 
-#Returns true if a client has hit the server rate limit, false otherwise.
 
-    def exceeded_rate_limit(self):
 
-        #Grab client IP address:
-        client_ip = self.client_address[0]
+#Serves a page to the client.
+#
+#The main pages only change when the server restarts, so browsers may keep them for a few minutes, and then check back
+#with their ETag. The 404 and bad profile pages aren't cached.
 
-        #Clients are allowed to make a maximum of 60 requests to the server in a minute.
-        #This normalizes to 1 request per second, but burst requests are supported.
+    def serve_page(self, http_code, html_key=None):
 
-        #Get the number of requests they have made so far:
-        ip_dict = master.ip_requests_count
-        if client_ip not in ip_dict:
-            ip_dict[client_ip] = 0
-        requests_count = ip_dict[client_ip]
+        #Grab the page we are to serve to the client:
+        (raw, compressed, etag) = master.html_pages[html_key]
 
-        #If they have hit 60 already, return true since they did hit the rate limit.
-        #They will have to try again between 1-60 seconds later, depending on the current system time.
-        if requests_count > 60:
-            return True
+        #Error pages:
+        if http_code != 200 or not isinstance(html_key, str):
+            self.serve_data(compressed if self.supports_gzip else raw, http_code=http_code)
+            return None
 
-        #Otherwise, mark this client as making a request:
-        ip_dict[client_ip] += 1
+        #If the browser already has this page, tell it to use its own copy:
+        last_modified = master.start_time
+        if self.client_has_version(etag, last_modified):
+            self.serve_not_modified("max-age=300", etag, last_modified)
+            return None
 
+        #Otherwise, serve it:
+        self.serve_data(compressed if self.supports_gzip else raw, "max-age=300", etag, last_modified)
 
 
 
 
-#Serves a page to the client.
 
-    def serve_page(self, http_code, html_key=None):
+#Serves a static asset (css, javascript or image) to the client. See AssetTable.
+#
+#Versioned names never change, so browsers keep those for a year without checking back.
+#Plain names get checked with their ETag every time.
 
-        #Set the HTTP code:
-        self.send_response(http_code)
+    def serve_asset(self, name):
 
-        #If gzip is supported, set that header as well:
-        if self.supports_gzip:
-            self.send_header("Content-Encoding", "gzip")
+        #Grab the asset, if there is one:
+        asset = master.assets.get(name)
+        if asset is None:
+            self.serve_page(404)
+            return None
+        (raw, compressed, path, size, etag, content_type, cache_control) = asset
 
-        #We're done with headers:
+        #Images aren't gzipped, whatever the browser supports:
+        self.supports_gzip = self.supports_gzip and compressed is not None
+
+        #If the browser already has this asset, tell it to use its own copy:
+        if self.client_has_version(etag):
+            self.serve_not_modified(cache_control, etag)
+            return None
+
+        #Assets kept in memory:
+        if raw is not None:
+            self.serve_data(compressed if self.supports_gzip else raw, cache_control, etag, content_type=content_type)
+            return None
+
+        #Big images go straight from their file to the client, after the headers:
+        self.send_response(200)
+        self.send_header("Content-Type", content_type)
+        self.send_cache_headers(cache_control, etag, None)
+        self.send_header("Content-Length", str(size))
         self.end_headers()
+        if not self.head_only:
+            self.send_file(path, size)
+
 
-        #Grab the page we are to serve to the client:
-        (raw, compressed) = master.html_pages[html_key]
 
-        #And serve it:
-        self.wfile.write(compressed if self.supports_gzip else raw)
+
+
+#Sends the first size bytes of a file to the client, from the file straight to the socket.
+#(socket.sendfile uses os.sendfile where the OS has it, and falls back to plain sends where it doesn't, like on Windows.)
+
+    def send_file(self, path, size):
+        with open(path, "rb") as f:
+            self.connection.sendfile(f, 0, size)
 
 
 
@@ -663,52 +924,2374 @@ class TourProgressWebsite(SimpleHTTPRequestHandler):
 #
 #Note: Due to caching mechanisms we have, this function assumes the payload is
 #gzipped already if the client supports gzipped data. It will not gzip on its own!
+#
+#cache_control is the Cache-Control policy of the data. Data with an ETag (and optionally a Last-Modified unix time)
+#can be revalidated by the browser later on, see client_has_version.
+#content_type is only sent if it's given: browsers figure out the pages and CSV files by themselves.
 
-    def serve_data(self, data):
+    def serve_data(self, data, cache_control="no-store", etag=None, last_modified=None, http_code=200, content_type=None):
 
-        #Set the HTTP code (always 200):
-        self.send_response(200)
+        #Set the HTTP code, and the type of the data if we have it:
+        self.send_response(http_code)
+        if content_type is not None:
+            self.send_header("Content-Type", content_type)
 
         #If gzip is supported, set that header as well:
         if self.supports_gzip:
             self.send_header("Content-Encoding", "gzip")
 
+        #Caching headers, and the length of the data:
+        self.send_cache_headers(cache_control, etag, last_modified)
+        self.send_header("Content-Length", str(len(data)))
+
         #We're done with headers:
         self.end_headers()
         
-        #Send it to the client:
-        self.wfile.write(data)
+        #Send it to the client: (Unless it's a HEAD request, which only gets the headers.)
+        if not self.head_only:
+            self.wfile.write(data)
 
 
 
 
 
-#Returns true if the requesting web browser supports gzip data, false otherwise.
+#Tells the client that the copy of the data it has is still good (304 Not Modified), without sending the data again:
 
-    def check_gzip_support(self):
+    def serve_not_modified(self, cache_control, etag, last_modified=None):
+        self.send_response(304)
+        self.send_cache_headers(cache_control, etag, last_modified)
+        self.end_headers()
 
-        #Check for the accept-encoding header:
-        accepted_encoding = self.headers.get("Accept-Encoding")
-        if accepted_encoding is None:
-            return False
 
-        #Check if gzip is one of the accepted encodings:
-        return "gzip" in accepted_encoding.lower()
 
 
 
+#Sends the caching headers.
+#
+#The gzipped and plain versions of the data are different bytes, so they get different ETags, and caches are told
+#that the response depends on the Accept-Encoding header.
 
+    def send_cache_headers(self, cache_control, etag, last_modified):
 
-#####################################################
-#####################################################
-#####################################################
+        self.send_header("Cache-Control", cache_control)
+        self.send_header("Vary", "Accept-Encoding")
+        if etag is not None:
+            self.send_header("ETag", self.get_etag_header(etag))
+        if last_modified is not None:
+            self.send_header("Last-Modified", self.date_time_string(last_modified))
+
+
+
+
+
+#Returns the ETag header value of a version tag, for the encoding the client gets:
+
+    def get_etag_header(self, etag):
+        return '"{}{}"'.format(etag, "-gzip" if self.supports_gzip else "")
+
+
+
+
+
+#Returns true if the client already has the given version of the data, according to its conditional GET headers.
+#
+#If-None-Match (ETags) wins over If-Modified-Since, like the HTTP spec says.
+
+    def client_has_version(self, etag, last_modified=None):
+
+        #Check the ETags the client has:
+        if_none_match = self.headers.get("If-None-Match")
+        if if_none_match is not None:
+            etag = self.get_etag_header(etag)
+            return any(x.strip() in (etag, "W/" + etag, "*") for x in if_none_match.split(","))
+
+        #Otherwise, check the time of the client's copy:
+        if_modified_since = self.headers.get("If-Modified-Since")
+        if if_modified_since is None or last_modified is None:
+            return False
+        try:
+            return int(last_modified) <= parsedate_to_datetime(if_modified_since).timestamp()
+        except (TypeError, ValueError):
+            return False
+
+
+
+
+
+#Returns true if the requesting web browser supports gzip data, false otherwise.
+
+    def check_gzip_support(self):
+
+        #Check for the accept-encoding header:
+        accepted_encoding = self.headers.get("Accept-Encoding")
+        if accepted_encoding is None:
+            return False
+
+        #Check if gzip is one of the accepted encodings:
+        return "gzip" in accepted_encoding.lower()
+
+
+
+
+
+#####################################################
+#####################################################
+#####################################################
 
 
 #Makes the HTTP server threaded.
 
-class ThreadedHTTPServer(ThreadingMixIn, TCPServer):
-    """Handle requests in a separate thread."""
-    pass
+class ThreadedHTTPServer(ThreadingMixIn, TCPServer):
+    """Handle requests in a separate thread."""
+    pass
+
+
+
+
+
+#####################################################
+#####################################################
+#####################################################
+
+
+#The website's request handler, for the asyncio server. It speaks HTTP/1.1, so browsers can keep their connection open.
+#
+#The asyncio server reads each whole request off the connection itself, and then hands it to this handler as if it
+#came off a socket: the request goes in rfile, and whatever the handler writes to wfile is the response. That way every
+#request goes through the same routing (do_GET/do_POST) as with the threaded server.
+
+class AsyncTourProgressWebsite(TourProgressWebsite):
+
+    protocol_version = "HTTP/1.1"
+
+#Init. Unlike the threaded server's handlers, this doesn't handle anything by itself: call handle_request for every request.
+
+    def __init__(self, client_address, server):
+        self.client_address = client_address
+        self.server = server
+        self.close_connection = True
+
+
+
+
+
+#Handles one whole request (request line, headers and body) and returns the response.
+#
+#Dropped requests (rate limited clients, bad server reports...) get no response at all. Their connection is closed,
+#just like with the threaded server.
+
+    def handle_request(self, request):
+
+        self.rfile = BytesIO(request)
+        self.wfile = BytesIO()
+        self.streaming = False
+        self.pending_file = None
+        self.handle_one_request()
+
+        response = self.wfile.getvalue()
+        if not response:
+            self.close_connection = True
+        return response
+
+
+
+
+
+#Requests for the server events only send the headers here. The asyncio server streams the events itself afterwards.
+
+    def stream_server_events(self):
+        self.streaming = True
+
+
+
+
+
+#Files only get their headers sent here too. The asyncio server sends the file after them, see AsyncHTTPServer.send_file.
+
+    def send_file(self, path, size):
+        self.pending_file = (path, size)
+
+
+
+
+
+#Serves the website with asyncio, on one thread, instead of with a thread per connection.
+#
+#An idle connection only costs a few kilobytes this way, instead of a whole thread, so thousands of browsers can keep
+#their connections open. GET requests are all served out of memory (or straight from a file, with sendfile), so they're handled right on the event loop.
+#POST requests may have to wait on the steam web API (vanity URLs), so they go to a thread pool instead.
+#
+#Browsers following the server events are woken up through a future, which is swapped for a new one every time the
+#server events get new events.
+
+class AsyncHTTPServer(object):
+
+#Init. Connections that don't send a request for idle_timeout seconds are closed.
+#Requests bigger than max_request_size bytes (headers and body, each) get their connection closed.
+#If a listening socket is given (pre-fork workers share one), it's served instead of binding the server address.
+
+    def __init__(self, server_address, listen_socket=None, idle_timeout=60, max_request_size=65536):
+
+        self.server_address = server_address
+        self.listen_socket = listen_socket
+        self.idle_timeout = idle_timeout
+        self.max_request_size = max_request_size
+        self.events_changed = None
+
+
+
+
+
+#Runs the server forever:
+
+    def serve_forever(self):
+        asyncio_run(self.serve())
+
+
+
+
+
+#The server's coroutine:
+
+    async def serve(self):
+
+        #Get woken up by the server events, from whatever thread adds them:
+        loop = get_running_loop()
+        self.events_changed = loop.create_future()
+        master.server_events.add_waker(lambda: loop.call_soon_threadsafe(self.wake_event_streams))
+
+        if self.listen_socket is not None:
+            server = await start_server(self.handle_connection, sock=self.listen_socket, limit=self.max_request_size)
+        else:
+            (host, port) = self.server_address
+            server = await start_server(self.handle_connection, host or None, port, limit=self.max_request_size, backlog=1024)
+        async with server:
+            await server.serve_forever()
+
+
+
+
+
+#Serves every request of one connection, one after the other, until either side closes it.
+
+    async def handle_connection(self, reader, writer):
+
+        loop = get_running_loop()
+        handler = AsyncTourProgressWebsite(writer.get_extra_info("peername")[:2], self)
+
+        try:
+            while True:
+
+                #Read the request line and the headers, and then the body. Close the connection if it sits idle too long.
+                #(Closing the connection ends the reads.)
+                timer = loop.call_later(self.idle_timeout, writer.close)
+                try:
+                    head = await reader.readuntil(b"\r\n\r\n")
+                    body = await reader.readexactly(self.get_content_length(head))
+                finally:
+                    timer.cancel()
+
+                #Handle it and send the response back:
+                if head.startswith(b"POST"):
+                    response = await loop.run_in_executor(None, handler.handle_request, head + body)
+                else:
+                    response = handler.handle_request(head + body)
+
+                #Server events keep the connection for themselves:
+                if handler.streaming:
+                    await self.stream_server_events(writer, response)
+                    break
+
+                writer.write(response)
+                await writer.drain()
+
+                #Big images are sent straight from their file, after the headers:
+                if handler.pending_file is not None:
+                    await self.send_file(writer, *handler.pending_file)
+
+                if handler.close_connection:
+                    break
+
+        except (IncompleteReadError, LimitOverrunError, ConnectionError, ValueError):
+            pass
+
+        #Nothing a client sends should end this task with an unhandled exception. Just close the connection:
+        except Exception as e:
+            print("Error in connection:", e)
+
+        finally:
+            writer.close()
+
+
+
+
+
+#Sends the first size bytes of a file to a browser, from the file straight to the socket.
+#(loop.sendfile uses os.sendfile where the OS has it, and falls back to reading the file in chunks where it doesn't.)
+
+    async def send_file(self, writer, path, size):
+        with open(path, "rb") as f:
+            await get_running_loop().sendfile(writer.transport, f, 0, size)
+
+
+
+
+
+#Sends the response headers and then the server events to a browser, forever. (See TourProgressWebsite.stream_server_events.)
+
+    async def stream_server_events(self, writer, response):
+
+        events = master.server_events
+        try:
+            writer.write(response + b"retry: 5000\n\n")
+            position = None
+            while True:
+
+                #Grab the future before the events, so none can come in between unnoticed:
+                changed = self.events_changed
+                (data, position) = events.get_events(position)
+                if data:
+                    writer.write(data)
+                    await writer.drain()
+                    continue
+
+                #Wait for more, checking on the browser every 15 seconds:
+                try:
+                    await wait_for(shield(changed), 15)
+                except AsyncTimeoutError:
+                    writer.write(b": keep-alive\n\n")
+                    await writer.drain()
+
+        finally:
+            events.remove_listener()
+
+
+
+
+
+#Wakes up every browser following the server events. (Runs on the event loop.)
+
+    def wake_event_streams(self):
+        if not self.events_changed.done():
+            self.events_changed.set_result(None)
+            self.events_changed = get_running_loop().create_future()
+
+
+
+
+
+#Returns the length of a request's body, out of its headers.
+#
+#Raises ValueError for bodies that can't be read: chunked ones, and ones that are too big.
+
+    def get_content_length(self, head):
+
+        content_length = 0
+        for x in head.split(b"\r\n")[1:]:
+            (name, _, value) = x.partition(b":")
+            name = name.strip().lower()
+            if name == b"content-length":
+                content_length = int(value)
+            elif name == b"transfer-encoding":
+                raise ValueError("Chunked requests are not supported")
+
+        if content_length < 0 or content_length > self.max_request_size:
+            raise ValueError("Bad request body length")
+        return content_length
+
+
+
+
+
+#####################################################
+#####################################################
+#####################################################
+
+
+#Pre-fork mode: a loader process owns the database thread, and worker processes serve the website.
+#
+#The loader publishes everything the workers need to a snapshot: a folder of files that every process maps into memory.
+#
+#- The control file holds the generation (version) of everything below, the loader's start time (for the ETags), and a
+#  ring buffer of the steam64 IDs whose progress changed, so the workers know what to throw out of their response caches.
+#- The player table (players-<generation>) is an open addressing hash table of steam64 IDs, pointing to fixed size
+#  records of each player's data version (row ID), wave credit timestamps and mission completion bitflags. Records are updated in place, each with
+#  a sequence number that's odd while it's being written, so readers never need a lock: they just read again.
+#  When the table fills up, a table twice as big is written next to it, and the workers switch over.
+#- The global statistics and the tour server information are small, so they're written to their own files
+#  (global-<generation> and servers-<generation>) whenever they change.
+
+#Layout of the control file: table generation, global statistics generation, servers generation, ring buffer
+#position and start time, followed by the ring buffer of steam64 IDs:
+SNAPSHOT_CONTROL = Struct("<QQQQd")
+SNAPSHOT_LOG = Struct("<Q")
+SNAPSHOT_LOG_SIZE = 65536
+
+#Layout of the player table: its header (log2 of the number of slots, and the most records it holds), then the slots
+#(steam64 ID and record number + 1, or zeros for an empty slot), then the records.
+SNAPSHOT_TABLE = Struct("<QQ")
+SNAPSHOT_SLOT = Struct("<QQ")
+SNAPSHOT_SEQUENCE = Struct("<Q")
+
+#Slot of a steam64 ID in a table of 2**bits slots. (Fibonacci hashing, so nearby steam64 IDs spread out.)
+get_snapshot_slot = lambda steam64, bits: ((steam64*0x9E3779B97F4A7C15) & 0xFFFFFFFFFFFFFFFF) >> (64 - bits)
+
+
+
+
+
+#The loader's side of the snapshot. Only the database thread publishes players and global statistics, and only the
+#server reports thread publishes servers.
+
+class SnapshotPublisher(object):
+
+#Init. mission_slices are the tour's missions, like in the tour progress store. start_time is passed on to the workers.
+
+    def __init__(self, mission_slices, start_time):
+
+        self.path = mkdtemp(prefix="titanium_tank_website_")
+        self.record = Struct("<QQ{}I{}I".format(mission_slices[-1][1], len(mission_slices)))
+
+        #Create the control file:
+        self.generations = [0, 0, 0]
+        self.log_position = 0
+        self.control = self.create_file("control", SNAPSHOT_CONTROL.size + SNAPSHOT_LOG_SIZE*SNAPSHOT_LOG.size)
+        SNAPSHOT_CONTROL.pack_into(self.control, 0, 0, 0, 0, 0, start_time)
+
+        #Start off with an empty player table:
+        self.records = dict()
+        self.create_table(TimestampStore(mission_slices), dict())
+
+
+
+
+
+#Creates a file of the given size in the snapshot folder and maps it into memory:
+
+    def create_file(self, name, size):
+
+        with open(join(self.path, name), mode="w+b") as f:
+            f.truncate(size)
+            return mmap(f.fileno(), size)
+
+
+
+
+
+#Bumps the generation of one of the published things (0: player table, 1: global statistics, 2: servers).
+#Returns the new generation.
+
+    def bump_generation(self, index):
+
+        self.generations[index] += 1
+        SNAPSHOT_SEQUENCE.pack_into(self.control, index*SNAPSHOT_SEQUENCE.size, self.generations[index])
+        return self.generations[index]
+
+
+
+
+
+#Writes a whole new player table, big enough for twice the players there are now, and switches the workers over to it.
+
+    def create_table(self, tour_progress, player_row_ids):
+
+        self.max_records = max(65536, 2*len(tour_progress))
+        self.bits = (2*self.max_records - 1).bit_length()
+        self.records_offset = SNAPSHOT_TABLE.size + SNAPSHOT_SLOT.size*(1 << self.bits)
+
+        generation = self.generations[0] + 1
+        self.table = self.create_file("players-{}".format(generation), self.records_offset + self.record.size*self.max_records)
+        SNAPSHOT_TABLE.pack_into(self.table, 0, self.bits, self.max_records)
+
+        self.records = dict()
+        for (x, y) in tour_progress.items():
+            self.write_player(x, y, tour_progress.get_bitflags(x), player_row_ids.get(x, 0))
+
+        self.bump_generation(0)
+        self.remove_file("players-{}".format(generation - 1))
+
+
+
+
+
+#Writes a player's record, adding them to the table if they're new.
+
+    def write_player(self, steam64, timestamps, bitflags, row_id):
+
+        table = self.table
+
+        #Existing players: make the sequence number odd, write the record, then make the sequence number even again.
+        index = self.records.get(steam64)
+        if index is not None:
+            offset = self.records_offset + index*self.record.size
+            sequence = SNAPSHOT_SEQUENCE.unpack_from(table, offset)[0]
+            SNAPSHOT_SEQUENCE.pack_into(table, offset, sequence + 1)
+            self.record.pack_into(table, offset, sequence + 1, row_id, *timestamps, *bitflags)
+            SNAPSHOT_SEQUENCE.pack_into(table, offset, sequence + 2)
+            return None
+
+        #New players: write their record, and then their slot. The slot's record number goes in before the steam64 ID,
+        #so readers never find a steam64 ID without its record.
+        index = len(self.records)
+        self.records[steam64] = index
+        self.record.pack_into(table, self.records_offset + index*self.record.size, 0, row_id, *timestamps, *bitflags)
+
+        mask = (1 << self.bits) - 1
+        slot = get_snapshot_slot(steam64, self.bits)
+        while SNAPSHOT_SLOT.unpack_from(table, SNAPSHOT_TABLE.size + slot*SNAPSHOT_SLOT.size)[0] != 0:
+            slot = (slot + 1) & mask
+        offset = SNAPSHOT_TABLE.size + slot*SNAPSHOT_SLOT.size
+        SNAPSHOT_SEQUENCE.pack_into(table, offset + SNAPSHOT_SEQUENCE.size, index + 1)
+        SNAPSHOT_SEQUENCE.pack_into(table, offset, steam64)
+
+
+
+
+
+#Publishes the players whose progress changed. (Called by the database thread.)
+
+    def publish_players(self, steam64s, tour_progress, player_row_ids):
+
+        #If they don't all fit, write a bigger table. The workers throw out their whole response caches when they switch over.
+        new_players = sum(1 for x in steam64s if x not in self.records)
+        if len(self.records) + new_players > self.max_records:
+            self.create_table(tour_progress, player_row_ids)
+            return None
+
+        for x in steam64s:
+            self.write_player(x, tour_progress.get(x), tour_progress.get_bitflags(x), player_row_ids.get(x, 0))
+
+        #Then tell the workers who changed. The position goes up last, once the steam64 IDs are in the ring buffer.
+        position = self.log_position
+        for x in steam64s:
+            SNAPSHOT_LOG.pack_into(self.control, SNAPSHOT_CONTROL.size + (position % SNAPSHOT_LOG_SIZE)*SNAPSHOT_LOG.size, x)
+            position += 1
+        self.log_position = position
+        SNAPSHOT_SEQUENCE.pack_into(self.control, 3*SNAPSHOT_SEQUENCE.size, position)
+
+
+
+
+
+#Publishes a small piece of data to its own file, and bumps its generation once it's all written:
+
+    def publish_data(self, index, name, data):
+
+        generation = self.generations[index] + 1
+        with open(join(self.path, "{}-{}".format(name, generation)), mode="wb") as f:
+            pickle_dump(data, f)
+        self.bump_generation(index)
+        self.remove_file("{}-{}".format(name, generation - 2))
+
+
+
+
+
+#Publishes the global statistics CSV data (the raw and gzipped data, ETag and last modified time):
+
+    def publish_global_csv(self, global_data_csv):
+        self.publish_data(1, "global", global_data_csv)
+
+
+
+
+
+#Publishes the tour server information dictionary:
+
+    def publish_servers(self, server_info_dict):
+        self.publish_data(2, "servers", server_info_dict)
+
+
+
+
+
+#Removes an old file from the snapshot folder. (On Windows, a worker may still have it open. It goes away with the folder.)
+
+    def remove_file(self, name):
+        try:
+            remove(join(self.path, name))
+        except OSError:
+            pass
+
+
+
+
+
+#Removes the whole snapshot folder:
+
+    def close(self):
+        rmtree(self.path, ignore_errors=True)
+
+
+
+
+
+#####################################################
+
+
+#A worker's side of the snapshot.
+#
+#Workers look players up straight out of the loader's player table, and a follower thread keeps the rest up to date:
+#it throws players that changed out of the response cache, and picks up new global statistics and servers.
+
+class SnapshotReader(object):
+
+#Init:
+
+    def __init__(self, path, mission_slices):
+
+        self.path = path
+        self.total_credits = mission_slices[-1][1]
+        self.record = Struct("<QQ{}I{}I".format(self.total_credits, len(mission_slices)))
+
+        with open(join(path, "control"), mode="rb") as f:
+            self.control = mmap(f.fileno(), 0, access=ACCESS_READ)
+        self.start_time = SNAPSHOT_CONTROL.unpack_from(self.control, 0)[4]
+
+        #What this worker is up to. (Its response cache starts out empty, so there's nothing to throw out from before.)
+        self.generations = [0, 0, 0]
+        self.log_position = self.read_control(3)
+        self.open_table(self.read_control(0))
+
+
+
+
+
+#Reads one of the numbers at the start of the control file:
+
+    def read_control(self, index):
+        return SNAPSHOT_SEQUENCE.unpack_from(self.control, index*SNAPSHOT_SEQUENCE.size)[0]
+
+
+
+
+
+#Maps a generation of the player table into memory.
+#
+#The old table isn't closed, since request threads may still be reading it. It goes away once they're done with it.
+
+    def open_table(self, generation):
+
+        with open(join(self.path, "players-{}".format(generation)), mode="rb") as f:
+            table = mmap(f.fileno(), 0, access=ACCESS_READ)
+        (bits, max_records) = SNAPSHOT_TABLE.unpack_from(table, 0)
+
+        self.table = (table, bits, SNAPSHOT_TABLE.size + SNAPSHOT_SLOT.size*(1 << bits))
+        self.generations[0] = generation
+
+
+
+
+
+#Returns a player's record (sequence number, row ID, the timestamps, and then the bitflags), or None if they're not in the table:
+
+    def read_player(self, steam64):
+
+        (table, bits, records_offset) = self.table
+
+        #Find their slot:
+        mask = (1 << bits) - 1
+        slot = get_snapshot_slot(steam64, bits)
+        while True:
+            (key, index) = SNAPSHOT_SLOT.unpack_from(table, SNAPSHOT_TABLE.size + slot*SNAPSHOT_SLOT.size)
+            if key == steam64:
+                break
+            if key == 0:
+                return None
+            slot = (slot + 1) & mask
+
+        #Read their record. If the loader was writing it at the same time, read it again:
+        offset = records_offset + (index - 1)*self.record.size
+        while True:
+            record = self.record.unpack_from(table, offset)
+            if not record[0] & 1 and SNAPSHOT_SEQUENCE.unpack_from(table, offset)[0] == record[0]:
+                return record
+
+
+
+
+
+#Returns a player's row of wave credit timestamps, like the loader's tour progress store does:
+
+    def get_progress(self, steam64, default=None):
+
+        record = self.read_player(steam64)
+        if record is None:
+            return default
+        return record[2:2 + self.total_credits]
+
+
+
+
+
+#Returns a player's mission completion bitflags, like the loader's tour progress store does:
+
+    def get_bitflags(self, steam64, default=None):
+
+        record = self.read_player(steam64)
+        if record is None:
+            return default
+        return record[2 + self.total_credits:]
+
+
+
+
+
+#Returns a player's data version (the row ID of the last wave credit that changed their progress):
+
+    def get_row_id(self, steam64, default=None):
+
+        record = self.read_player(steam64)
+        if record is None:
+            return default
+        return record[1]
+
+
+
+
+
+#Reads a small piece of published data:
+
+    def load_data(self, name, generation):
+        with open(join(self.path, "{}-{}".format(name, generation)), mode="rb") as f:
+            return pickle_load(f)
+
+
+
+
+
+#Runs on the worker's follower thread, checking the snapshot for changes a few times a second.
+#Bans made by the other workers are picked up here too.
+#If the loader goes away, the snapshot won't change anymore, so the whole worker stops.
+
+    def follow(self, worker):
+
+        loader = parent_process()
+        while loader.is_alive():
+            try:
+                self.update(worker)
+                worker.banned_ips.reload()
+            except Exception as e:
+                print("Snapshot follower error: ", e)
+            sleep(0.05)
+        _exit(0)
+
+
+
+
+
+#Catches up with the loader.
+#
+#The ring buffer's position is read first: anything the loader wrote to the player table before that is either in
+#the table generation read after it, or it got logged and gets thrown out of the response cache here.
+
+    def update(self, worker):
+
+        cache = worker.response_cache
+        log_position = self.read_control(3)
+
+        #If the loader wrote a new player table, switch over to it. Everything cached may be out of date:
+        generation = self.read_control(0)
+        if generation != self.generations[0]:
+            self.open_table(generation)
+            cache.clear()
+
+        #Throw out the players that changed. If more changed than the ring buffer holds, throw out everything.
+        elif log_position - self.log_position > SNAPSHOT_LOG_SIZE:
+            cache.clear()
+
+        else:
+            for x in range(self.log_position, log_position):
+                cache.invalidate(SNAPSHOT_LOG.unpack_from(self.control, SNAPSHOT_CONTROL.size + (x % SNAPSHOT_LOG_SIZE)*SNAPSHOT_LOG.size)[0])
+
+            #If the loader went around the ring buffer while we were reading it, some of those were overwritten:
+            if self.read_control(3) - self.log_position > SNAPSHOT_LOG_SIZE:
+                cache.clear()
+
+        self.log_position = log_position
+
+        #New global statistics:
+        generation = self.read_control(1)
+        if generation != self.generations[1]:
+            worker.global_data_csv = self.load_data("global", generation)
+            self.generations[1] = generation
+
+        #New tour server information:
+        generation = self.read_control(2)
+        if generation != self.generations[2]:
+            worker.server_events.replace(self.load_data("servers", generation))
+            self.generations[2] = generation
+
+
+
+
+
+#####################################################
+
+
+#Stands in for a player lookup (tour_progress.get and get_bitflags, and player_row_ids.get) in the pre-fork workers:
+
+class SnapshotView(object):
+
+    def __init__(self, get_function, get_bitflags_function=None):
+        self.get = get_function
+        self.get_bitflags = get_bitflags_function
+
+
+
+
+
+#Stands in for the tour server information dictionary in the pre-fork workers.
+#
+#Tour servers report to whichever worker takes their connection, so reports are sent to the loader, which keeps the
+#real dictionary and publishes it back out to every worker's server events.
+
+class SnapshotServers(object):
+
+    def __init__(self, server_events, server_reports):
+        self.server_events = server_events
+        self.server_reports = server_reports
+
+    def __setitem__(self, key, value):
+        self.server_reports.put((key, value))
+
+    def __getitem__(self, key):
+        return self.server_events[key]
+
+    def __iter__(self):
+        return iter(self.server_events)
+
+
+
+
+
+#####################################################
+#####################################################
+#####################################################
+
+
+#Tour server information, and a live stream of its changes for the servers page (Server-Sent Events).
+#
+#Tour servers report their state every few seconds (see handle_server_info_report). Each report is compared with the
+#server's last one, and what changed goes into a short log of numbered events:
+#
+#- update: the server's whole CSV row (like in servers.csv), when anything besides the report time changed.
+#- seen: "server number,report time", when only the report time changed.
+#- remove: the server number, once the server hasn't reported for offline_time seconds.
+#
+#Browsers following the events link get the whole table first (a "servers" event, with the same data as servers.csv),
+#and then every event after it. If one falls so far behind that its events aren't in the log anymore, it just gets the
+#whole table again. A timer thread takes servers that stopped reporting off the list.
+#
+#Request threads wait on the condition for new events. The asyncio server can't block, so it registers a waker
+#instead, which gets called (on whatever thread added the events) every time there are new ones.
+
+class ServerEvents(object):
+
+#Init. Up to max_events events are kept, and up to max_listeners browsers can follow them at once.
+
+    def __init__(self, offline_time=60, max_events=256, max_listeners=2000):
+
+        self.offline_time = offline_time
+        self.max_listeners = max_listeners
+        self.listeners = 0
+        self.wakers = list()
+
+        #Server number -> CSV row tuple, the last field being the time of the last report:
+        self.servers = dict()
+
+        #The log of events, as (event number, encoded event) pairs, and the number of the next event:
+        self.events = deque(maxlen=max_events)
+        self.position = 0
+        self.condition = Condition()
+
+        #Start the timer:
+        Thread(target=self.expire_servers, daemon=True).start()
+
+
+
+
+
+#Puts a server's report in, and logs what changed:
+
+    def __setitem__(self, key, value):
+        with self.condition:
+            self.set_server(key, value)
+
+    def __getitem__(self, key):
+        with self.condition:
+            return self.servers[key]
+
+    def __iter__(self):
+        with self.condition:
+            return iter(list(self.servers))
+
+
+
+
+
+#Returns a copy of the server information dictionary:
+
+    def get_servers(self):
+        with self.condition:
+            return dict(self.servers)
+
+
+
+
+
+#Replaces all the server information with the given dictionary, and logs what changed.
+#(Pre-fork workers get the loader's dictionary this way.)
+
+    def replace(self, servers):
+
+        with self.condition:
+            for x in [x for x in self.servers if x not in servers]:
+                del self.servers[x]
+                self.add_event("remove", x)
+
+            for (x, y) in servers.items():
+                if self.servers.get(x) != y:
+                    self.set_server(x, y)
+
+
+
+
+
+#Puts a server's row in, and logs the change. Rows of servers that are offline already are left out.
+#(Call this with the lock held.)
+
+    def set_server(self, key, value):
+
+        old_value = self.servers.get(key)
+        if value[-1] + self.offline_time <= time():
+            if old_value is not None:
+                del self.servers[key]
+                self.add_event("remove", key)
+            return None
+
+        self.servers[key] = value
+        if old_value is not None and old_value[:-1] == value[:-1]:
+            self.add_event("seen", "{},{}".format(key, value[-1]))
+        else:
+            self.add_event("update", create_csv_row(value))
+
+
+
+
+
+#Logs an event, and wakes up everyone waiting for it. Data with several lines takes a data field per line.
+#(Call this with the lock held.)
+
+    def add_event(self, kind, data):
+
+        self.events.append((self.position, self.format_event(kind, data)))
+        self.position += 1
+        self.condition.notify_all()
+        for x in self.wakers:
+            x()
+
+    def format_event(self, kind, data):
+        return "event: {}\n{}\n".format(kind, "".join("data: {}\n".format(x) for x in str(data).split("\n"))).encode()
+
+
+
+
+
+#Returns the events after the given event number (None for a new listener), and the event number to continue from.
+#Listeners that are too far behind get the whole table instead.
+
+    def get_events(self, position):
+        with self.condition:
+            return self.read_events(position)
+
+
+
+
+
+#Like get_events, but waits up to timeout seconds for new events first. Returns no data if there weren't any.
+
+    def wait_for_events(self, position, timeout):
+        with self.condition:
+            self.condition.wait_for(lambda: position != self.position, timeout)
+            return self.read_events(position)
+
+
+
+
+
+#(Call this with the lock held.)
+
+    def read_events(self, position):
+
+        first = self.position - len(self.events)
+        if position is None or position < first:
+            return (self.format_event("servers", self.build_csv()), self.position)
+        return (bytes().join(y for (x, y) in islice(self.events, position - first, None)), self.position)
+
+
+
+
+
+#Returns the CSV data of the server information: the current time, followed by every server's row.
+#(This is the servers.csv file.)
+
+    def build_csv(self):
+        with self.condition:
+            return "\n".join([str(int(time()))] + [create_csv_row(x) for x in self.servers.values()])
+
+
+
+
+
+#Counts a listener in. Returns False if there are too many already.
+
+    def add_listener(self):
+        with self.condition:
+            if self.listeners >= self.max_listeners:
+                return False
+            self.listeners += 1
+            return True
+
+    def remove_listener(self):
+        with self.condition:
+            self.listeners -= 1
+
+
+
+
+
+#Registers a function to call every time there are new events:
+
+    def add_waker(self, callback):
+        with self.condition:
+            self.wakers.append(callback)
+
+
+
+
+
+#Runs forever on the timer thread: takes servers off the list once they haven't reported for offline_time seconds,
+#and sleeps until the next one is due. (New events wake it up too, in case a new server is due first.)
+
+    def expire_servers(self):
+
+        with self.condition:
+            while True:
+                now = time()
+                for (x, y) in list(self.servers.items()):
+                    if y[-1] + self.offline_time <= now:
+                        del self.servers[x]
+                        self.add_event("remove", x)
+
+                deadlines = [y[-1] + self.offline_time for y in self.servers.values()]
+                self.condition.wait(min(deadlines) - now if deadlines else None)
+
+
+
+
+
+#Returns the counters as a tuple of (name, value) pairs:
+
+    def get_statistics(self):
+        with self.condition:
+            return (("event_servers", len(self.servers)), ("event_listeners", self.listeners), ("events_sent", self.position))
+
+
+
+
+
+#####################################################
+#####################################################
+#####################################################
+
+
+#Static assets of the website (the css, javascript and images), served by the website itself under /TitaniumTank/static/.
+#
+#Everything is loaded once, when the website starts, so serving an asset never touches the file system or compresses
+#anything. The css and the javascript are kept in memory, raw and gzipped at the highest level (it only happens once).
+#Images are compressed already, so they aren't gzipped, and the big ones (the background picture and the medal) stay
+#on disk: they're sent straight from the file to the socket with sendfile, without going through Python.
+#
+#Every asset can be requested under two names: its plain name (css/app.css), and a versioned name with a hash of its
+#contents in it (css/app.0123456789ab.css). Nothing ever changes under a versioned name, so browsers may keep those
+#forever. The pages, the css and the javascript link their assets on GitHub pages, and those links are rewritten to the
+#versioned names as they're loaded. (The images go first since the css and the javascript link them, so the hash of
+#a css file changes along with the images it uses.)
+
+#Asset types served, by file extension: (Content-Type, gzipped or not)
+ASSET_TYPES = {
+                ".css":  ("text/css; charset=utf-8", True),
+                ".js":   ("application/javascript; charset=utf-8", True),
+                ".png":  ("image/png", False),
+                ".jpg":  ("image/jpeg", False),
+              }
+
+#Where the pages and the css link the assets from:
+ASSET_GITHUB_URL = "https://hydrogen-mvm.github.io/TitaniumTank/"
+
+class AssetTable(object):
+
+#Init. Loads the assets of the given subfolders of a folder, in order.
+#Images of at least sendfile_size bytes are left on disk, to be sent with sendfile.
+
+    def __init__(self, folder, subfolders=("img", "css", "js"), sendfile_size=65536):
+
+        self.sendfile_size = sendfile_size
+
+        #Asset name (lowercase, relative to /TitaniumTank/static/) ->
+        #(raw data or None, gzipped data or None, file path, size, ETag, Content-Type, Cache-Control)
+        self.assets = dict()
+
+        #The GitHub links of the assets loaded so far, and the versioned URLs they're rewritten to:
+        self.links = list()
+
+        for x in subfolders:
+            path = join(folder, x)
+            if not isdir(path):
+                continue
+            for y in sorted(listdir(path)):
+                self.load_asset(x + "/" + y, join(path, y))
+
+
+
+
+
+#Loads one asset file, if it's a type we serve:
+
+    def load_asset(self, name, path):
+
+        (base, extension) = splitext(name.lower())
+        if extension not in ASSET_TYPES:
+            return None
+        (content_type, compressible) = ASSET_TYPES[extension]
+
+        with open(path, "rb") as f:
+            data = f.read()
+
+        #Point the links in text assets at the assets we serve, and then gzip them:
+        compressed = None
+        if compressible:
+            data = self.rewrite_links(data.decode("UTF-8")).encode("UTF-8")
+            compressed = gzip_compress(data, 9, mtime=0)
+
+        #The ETag is a hash of the contents. It goes in the versioned name too:
+        etag = sha1(data).hexdigest()[:12]
+        versioned_name = "{}.{}{}".format(base, etag, extension)
+
+        #Big images get sent from the file instead of from memory:
+        size = len(data)
+        if not compressible and size >= self.sendfile_size:
+            data = None
+
+        self.assets[base + extension] = (data, compressed, path, size, etag, content_type, "no-cache")
+        self.assets[versioned_name] = (data, compressed, path, size, etag, content_type, "public, max-age=31536000, immutable")
+        self.links.append((ASSET_GITHUB_URL + name, "/TitaniumTank/static/" + versioned_name))
+
+
+
+
+
+#Rewrites the GitHub links to the assets loaded so far in a text (page, css or javascript) to their versioned URLs:
+
+    def rewrite_links(self, text):
+        for (x, y) in self.links:
+            text = text.replace(x, y)
+        return text
+
+
+
+
+
+#Returns the asset with the given name, or None if there isn't one:
+
+    def get(self, name):
+        return self.assets.get(name)
+
+
+
+
+
+#####################################################
+#####################################################
+#####################################################
+
+
+#Least recently used cache of the data served for each player (their CSV and VDF files), raw and gzipped,
+#along with the player's data version (row ID) the data was built from.
+#
+#Entries are keyed by (steam64, kind, mission index), and a player's entries are thrown out as soon as their progress changes.
+#The request threads fill the cache while the database thread empties it, so everything goes through a lock.
+
+class ResponseCache(object):
+
+#Init. max_entries is the most entries kept before the least recently used ones get thrown out.
+
+    def __init__(self, max_entries):
+
+        self.max_entries = max_entries
+        self.lock = Lock()
+
+        #The entries, oldest first, and the keys of each player's entries:
+        self.entries = OrderedDict()
+        self.player_keys = dict()
+
+        #Goes up on every invalidation. Data built before an invalidation isn't put in the cache, since it may be stale.
+        self.epoch = 0
+
+        #Counters:
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.invalidations = 0
+
+
+
+
+
+#Returns the [raw, gzipped, data version] entry of a key, or None if it's not in the cache.
+#The gzipped data is None until someone asks for it.
+
+    def get(self, key):
+
+        with self.lock:
+            entry = self.entries.get(key)
+            if entry is None:
+                self.misses += 1
+                return None
+            self.entries.move_to_end(key)
+            self.hits += 1
+            return entry
+
+
+
+
+
+#Puts raw data, built from the given data version, in the cache and returns its entry.
+#epoch is the cache's epoch from before the data was built. If a player was invalidated since, the entry isn't kept.
+
+    def put(self, key, raw, epoch, row_id=0):
+
+        entry = [raw, None, row_id]
+        with self.lock:
+            if epoch != self.epoch:
+                return entry
+
+            self.entries[key] = entry
+            self.player_keys.setdefault(key[0], set()).add(key)
+
+            #Throw out the least recently used entries:
+            while len(self.entries) > self.max_entries:
+                (old_key, old_entry) = self.entries.popitem(last=False)
+                self.forget_key(old_key)
+                self.evictions += 1
+
+        return entry
+
+
+
+
+
+#Throws out every entry of a player.
+#
+#Only the database thread calls this, so the epoch can be bumped without the lock. It has to be bumped before
+#checking for the player's entries: that way, put either sees the new epoch, or adds entries that get seen here.
+#This keeps the common case (a player with nothing cached, like during the first load) cheap.
+
+    def invalidate(self, steam64):
+
+        self.epoch += 1
+        if steam64 not in self.player_keys:
+            return None
+
+        with self.lock:
+            keys = self.player_keys.pop(steam64, None)
+            if keys is None:
+                return None
+            for x in keys:
+                del self.entries[x]
+            self.invalidations += 1
+
+
+
+
+
+#Throws out every entry. (Pre-fork workers do this when they can't tell which players changed, see SnapshotReader.)
+
+    def clear(self):
+
+        self.epoch += 1
+        with self.lock:
+            self.entries.clear()
+            self.player_keys.clear()
+            self.invalidations += 1
+
+
+
+
+
+#Removes an evicted key from its player's set of keys. (Call this with the lock held.)
+
+    def forget_key(self, key):
+        keys = self.player_keys[key[0]]
+        keys.discard(key)
+        if not keys:
+            del self.player_keys[key[0]]
+
+
+
+
+
+#Returns the cache counters as a tuple of (name, value) pairs:
+
+    def get_statistics(self):
+
+        with self.lock:
+            lookups = self.hits + self.misses
+            return (("cache_entries", len(self.entries)), ("cache_max_entries", self.max_entries), ("cache_hits", self.hits),
+                    ("cache_misses", self.misses), ("cache_hit_ratio", "{:.3f}".format(self.hits/lookups if lookups else 0)),
+                    ("cache_evictions", self.evictions), ("cache_invalidations", self.invalidations))
+
+
+
+
+
+#####################################################
+#####################################################
+#####################################################
+
+
+#Per IP address rate limiter, using token buckets.
+#
+#Every IP address gets a bucket of tokens that refills at a steady rate, up to a maximum. Each request takes a token,
+#and requests are refused while the bucket is empty. Buckets are only refilled when they're looked at, so idle IP addresses
+#cost nothing. Only the most recently seen IP addresses are kept track of: when there are too many, the least recently
+#seen ones are forgotten, which just gives them a full bucket again if they come back.
+
+class RateLimiter(object):
+
+#Init. rate is how many tokens a bucket gets back per second, burst is the most tokens a bucket can hold,
+#and max_entries is the most IP addresses kept track of at once. name prefixes the counters' names in the statistics.
+
+    def __init__(self, rate, burst, max_entries, name="rate_limit"):
+
+        self.name = name
+        self.rate = rate
+        self.burst = burst
+        self.max_entries = max_entries
+        self.lock = Lock()
+
+        #Each IP address paired with its [tokens, time of the last refill], least recently seen first:
+        self.buckets = OrderedDict()
+
+        #Counters:
+        self.allowed = 0
+        self.limited = 0
+        self.evictions = 0
+
+
+
+
+
+#Takes a token out of an IP address's bucket. Returns False if the bucket is empty (the client is over the rate limit).
+
+    def take(self, ip):
+
+        with self.lock:
+            bucket = self.refill(ip)
+            if bucket[0] < 1:
+                self.limited += 1
+                return False
+            bucket[0] -= 1
+            self.allowed += 1
+            return True
+
+
+
+
+
+#Gives a token back to an IP address, for requests that shouldn't count towards the rate limit:
+
+    def refund(self, ip):
+
+        with self.lock:
+            bucket = self.refill(ip)
+            bucket[0] = min(self.burst, bucket[0] + 1)
+
+
+
+
+
+#Empties an IP address's bucket, so it has to wait for it to refill before making any more requests:
+
+    def drain(self, ip):
+
+        with self.lock:
+            self.refill(ip)[0] = 0
+
+
+
+
+
+#Returns the bucket of an IP address, refilled up to now. Buckets of new IP addresses start out full.
+#(Call this with the lock held.)
+
+    def refill(self, ip):
+
+        now = monotonic()
+        buckets = self.buckets
+        bucket = buckets.get(ip)
+
+        if bucket is None:
+            bucket = buckets[ip] = [self.burst, now]
+            if len(buckets) > self.max_entries:
+                buckets.popitem(last=False)
+                self.evictions += 1
+            return bucket
+
+        buckets.move_to_end(ip)
+        bucket[0] = min(self.burst, bucket[0] + (now - bucket[1])*self.rate)
+        bucket[1] = now
+        return bucket
+
+
+
+
+
+#Returns the rate limiter counters as a tuple of (name, value) pairs:
+
+    def get_statistics(self):
+
+        with self.lock:
+            return ((self.name + "_ips", len(self.buckets)), (self.name + "_max_ips", self.max_entries), (self.name + "_allowed", self.allowed),
+                    (self.name + "_limited", self.limited), (self.name + "_evictions", self.evictions))
+
+
+
+
+
+#####################################################
+#####################################################
+#####################################################
+
+
+#Banned IP addresses, each with the time their ban runs out.
+#
+#The bans are kept in their own small database so they survive restarts, and are mirrored in a dictionary for quick lookups.
+#Expired bans are dropped when they're looked at, and on startup. If the list ever gets full, the ban closest to running
+#out makes room for the new one.
+
+class BanList(object):
+
+#Init. db_path is the path of the bans database, and max_bans the most bans kept at once.
+
+    def __init__(self, db_path, max_bans):
+
+        self.max_bans = max_bans
+        self.lock = Lock()
+
+        #Open the database, create the table if it's not there, and drop the bans that ran out while we were offline:
+        self.db = Connection(db_path, check_same_thread=False)
+        self.db.execute("CREATE TABLE IF NOT EXISTS Bans (IP TEXT PRIMARY KEY, Expires INTEGER, Reason TEXT)")
+        self.db.execute("DELETE FROM Bans WHERE Expires <= ?", (int(time()),))
+        self.db.commit()
+
+        #IP address -> unix time the ban runs out:
+        self.bans = dict(self.db.execute("SELECT IP, Expires FROM Bans"))
+        self.data_version = self.db.execute("PRAGMA data_version").fetchone()[0]
+
+
+
+
+
+#Returns true if an IP address is banned:
+
+    def is_banned(self, ip):
+
+        #Most IP addresses were never banned:
+        expires = self.bans.get(ip)
+        if expires is None:
+            return False
+
+        if expires > time():
+            return True
+
+        #The ban ran out, so drop it:
+        with self.lock:
+            if self.bans.pop(ip, None) is not None:
+                self.db.execute("DELETE FROM Bans WHERE IP = ?", (ip,))
+                self.db.commit()
+        return False
+
+
+
+
+
+#Bans an IP address for a number of seconds:
+
+    def ban(self, ip, duration, reason):
+
+        expires = int(time() + duration)
+        with self.lock:
+
+            #Make room if the list is full. Expired bans go first, then the ones closest to running out:
+            bans = self.bans
+            if ip not in bans and len(bans) >= self.max_bans:
+                now = time()
+                expired = [x for (x, y) in bans.items() if y <= now] or [min(bans, key=bans.get)]
+                for x in expired:
+                    del bans[x]
+                self.db.executemany("DELETE FROM Bans WHERE IP = ?", ((x,) for x in expired))
+
+            bans[ip] = expires
+            self.db.execute("INSERT OR REPLACE INTO Bans (IP, Expires, Reason) VALUES (?,?,?)", (ip, expires, reason))
+            self.db.commit()
+
+
+
+
+
+#Picks up bans made by the other processes sharing the bans database (the pre-fork workers).
+#SQLite only changes data_version when another connection commits, so this does nothing if no one else did:
+
+    def reload(self):
+        with self.lock:
+            data_version = self.db.execute("PRAGMA data_version").fetchone()[0]
+            if data_version != self.data_version:
+                self.data_version = data_version
+                self.bans = dict(self.db.execute("SELECT IP, Expires FROM Bans"))
+
+
+
+
+
+#Returns the ban list counters as a tuple of (name, value) pairs:
+
+    def get_statistics(self):
+        return (("banned_ips", len(self.bans)), ("max_banned_ips", self.max_bans))
+
+
+
+
+
+#####################################################
+#####################################################
+#####################################################
+
+
+#Maps timestamps to local dates (days), without calling localtime on every single one of them.
+#
+#Days are numbered by their date's ordinal (see datetime.date.toordinal), so they sort in the order they happened.
+#The epoch time of local midnight is worked out once for every day the tour has touched so far, with mktime, which
+#takes care of DST changes. A timestamp's day is then found by bisecting that list, and the last day looked up is
+#kept around, since wave credits mostly come in on the same day as the one before.
+#
+#Every day between the first and the last one gets a midnight (and a count in every DayCounts), so a single bogus
+#timestamp decades away would cost thousands of them. Only timestamps that pass is_valid may be looked up.
+
+#Wave credits can't be any older than this (January 1st 2018, before the tour started):
+DAY_BUCKETS_FIRST_TIMESTAMP = 1514764800
+
+class DayBuckets(object):
+
+#Init. Timestamps more than max_future seconds ahead of the clock are bogus.
+
+    def __init__(self, max_future=86400):
+
+        self.max_future = max_future
+
+        #The first day covered, and the epoch time of local midnight on each day from it on.
+        #There's always one more midnight than days: the last one is the end of the last day.
+        self.first_day = None
+        self.midnights = list()
+
+        #The last day looked up, and when it starts and ends:
+        self.last_day = None
+        self.last_start = 0
+        self.last_end = 0
+
+
+
+
+
+#Returns true if a timestamp is in the range wave credits can have, false otherwise:
+
+    def is_valid(self, timestamp):
+        return DAY_BUCKETS_FIRST_TIMESTAMP <= timestamp <= time() + self.max_future
+
+
+
+
+
+#Returns the range of timestamps is_valid lets through, as a (first, last) pair:
+
+    def get_valid_range(self):
+        return (DAY_BUCKETS_FIRST_TIMESTAMP, int(time()) + self.max_future)
+
+
+
+
+
+#Returns the day of a timestamp:
+
+    def get_day(self, timestamp):
+
+        #Same day as last time?
+        if self.last_start <= timestamp < self.last_end:
+            return self.last_day
+
+        #Make sure the midnights cover this timestamp, then look it up:
+        midnights = self.midnights
+        if not midnights or not midnights[0] <= timestamp < midnights[-1]:
+            self.extend(timestamp)
+            midnights = self.midnights
+        index = bisect_right(midnights, timestamp) - 1
+
+        self.last_day = self.first_day + index
+        self.last_start = midnights[index]
+        self.last_end = midnights[index + 1]
+        return self.last_day
+
+
+
+
+
+#Makes the midnights list cover the day of a timestamp, along with every day between it and the days already covered.
+#This is the only place that calls localtime.
+
+    def extend(self, timestamp):
+
+        stamp = localtime(timestamp)
+        day = date(stamp.tm_year, stamp.tm_mon, stamp.tm_mday).toordinal()
+
+        if self.first_day is None:
+            (first_day, last_day) = (day, day)
+        else:
+            first_day = min(day, self.first_day)
+            last_day = max(day, self.first_day + len(self.midnights) - 2)
+
+        self.first_day = first_day
+        self.midnights = [self.get_midnight(x) for x in range(first_day, last_day + 2)]
+
+
+
+
+
+#Returns the epoch time of local midnight at the start of a day:
+
+    def get_midnight(self, day):
+        x = date.fromordinal(day)
+        return int(mktime((x.year, x.month, x.day, 0, 0, 0, 0, 0, -1)))
+
+
+
+
+
+#Returns the day of a date string (YYYY-MM-DD), like SQLite's date() gives out, or None if there's no date.
+#(SQLite gives out NULL for timestamps it can't turn into a date.)
+
+    def get_day_from_string(self, date_string):
+        if date_string is None:
+            return None
+        return date.fromisoformat(date_string).toordinal()
+
+
+
+
+
+#Returns the (Month, Day) pair of a day, for the CSV data:
+
+    def get_date_key(self, day):
+        x = date.fromordinal(day)
+        return (x.month, x.day)
+
+
+
+
+
+#####################################################
+#####################################################
+#####################################################
+
+
+#A count for each day, kept in a dense list that grows to fit whatever days get counted.
+
+class DayCounts(object):
+
+#Init:
+
+    def __init__(self):
+
+        #The day of the first count in the list:
+        self.first_day = 0
+        self.counts = list()
+
+
+
+
+
+#Adds a number to the count of a day:
+
+    def add(self, day, amount):
+
+        counts = self.counts
+        if not counts:
+            self.first_day = day
+            counts.append(0)
+        elif day < self.first_day:
+            counts[0:0] = [0]*(self.first_day - day)
+            self.first_day = day
+        elif day >= self.first_day + len(counts):
+            counts.extend([0]*(day - self.first_day - len(counts) + 1))
+
+        counts[day - self.first_day] += amount
+
+
+
+
+
+#Returns the count of a day (0 if nothing was counted that day):
+
+    def get(self, day):
+        index = day - self.first_day
+        return self.counts[index] if 0 <= index < len(self.counts) else 0
+
+
+
+
+
+#Returns the days with a count that isn't 0, in order:
+
+    def get_days(self):
+        return [self.first_day + i for (i, x) in enumerate(self.counts) if x]
+
+
+
+
+
+#Returns the sum of every day's count:
+
+    def total(self):
+        return sum(self.counts)
+
+
+
+
+
+#####################################################
+#####################################################
+#####################################################
+
+
+#Compact tour progress store: steam64 ID -> the timestamp of every wave credit the player has earned.
+#
+#This replaces a dictionary of tuples of per-mission tuples. Every player gets a fixed size row of total_credits
+#timestamps (0 = wave credit not earned), with the missions' waves laid out one after another (see mission_slices).
+#All the rows sit back to back in one array('I'), in the order the players showed up, so rows are just slices of it,
+#and NumPy can look at all of them at once without copying anything.
+#
+#The steam IDs live in an open addressing hash table (linear probing) made of two parallel arrays, the same way as the
+#medal server's ProgressStore: one array('Q') of steam IDs (0 = empty slot) and one array('I') of row numbers.
+#
+#Next to the timestamps, every player also gets a row of mission completion bitflags, one per mission, in another
+#array('I'). Bit N is set once the player has the wave credit for wave N (wave numbers start at 1, so bit 0 is never
+#set), which is exactly what SRCDS asks for in the VDF files. They're kept up to date as wave credits come in, instead of
+#being worked out from the timestamps on every request.
+#
+#Memory cost: 4 bytes per wave credit and per mission in the tour, plus 12 bytes per slot (the table doubles once it's
+#70% full), so roughly 200 to 220 bytes per player in a 6 mission, 39 wave credit tour. A dictionary of tuples costs
+#well over 1 KB per player, most of it boxed timestamps.
+
+class TimestampStore(object):
+
+#Init the store. mission_slices are the (start, end) slices of each mission's waves in a player's row of timestamps.
+
+    def __init__(self, mission_slices, capacity=1024):
+
+        self.mission_slices = mission_slices
+        self.row_size = mission_slices[-1][1] if mission_slices else 0
+        self.timestamps = array("I")
+        self.empty_row = array("I", bytes(4*self.row_size))
+
+        self.missions = len(mission_slices)
+        self.bitflags = array("I")
+        self.empty_bitflags = array("I", bytes(4*self.missions))
+
+        #Build the hash table. The capacity must be a power of 2.
+        #Request threads look players up while the database thread adds them, so the table's arrays are swapped out
+        #all at once, as a (keys, rows, mask, shift) tuple, once they're completely filled in.
+        self.count = 0
+        self.table = self.allocate(max(8, 1 << (capacity - 1).bit_length()))
+
+
+
+
+
+#Returns an empty hash table with the given number of slots:
+
+    def allocate(self, capacity):
+        self.grow_at = capacity*7 // 10
+        return (array("Q", bytes(8*capacity)), array("I", bytes(4*capacity)), capacity - 1, 64 - (capacity.bit_length() - 1))
+
+
+
+
+
+#Returns the slot a steam ID is stored in, or the empty slot where it would go.
+#
+#Steam IDs share their upper 32 bits, so they're scrambled with Fibonacci hashing (multiply by 2^64/phi
+#and keep the top bits) to spread them evenly across the table.
+
+    def find_slot(self, table, steam64):
+        (keys, rows, mask, shift) = table
+        i = ((steam64 * 11400714819323198485) & 0xFFFFFFFFFFFFFFFF) >> shift
+        while True:
+            key = keys[i]
+            if key == steam64 or key == 0:
+                return i
+            i = (i + 1) & mask
+
+
+
+
+
+#Doubles the size of the hash table, and moves every player into it. (Their rows stay where they are.)
+
+    def grow(self):
+        (old_keys, old_rows, old_mask, old_shift) = self.table
+        table = self.allocate(2*len(old_keys))
+        (keys, rows, mask, shift) = table
+        for (x, y) in zip(old_keys, old_rows):
+            if x:
+                i = self.find_slot(table, x)
+                keys[i] = x
+                rows[i] = y
+        self.table = table
+
+
+
+
+
+#Gives a player a wave credit: sets the timestamp of the wave in their row and its bit in the mission's bitflags,
+#unless they have it already. Wave numbers start at 1. Returns True if their progress changed.
+#Missions and waves that aren't part of the tour are ignored, and so are timestamps and steam IDs that don't fit in
+#the arrays. (0 can't be either: it means "not earned" and "empty slot".) Nothing is touched for those.
+#
+#old_rows is a dictionary of the players that changed since some point: the first time a player changes, a copy of
+#their row from before goes in there (None for new players).
+
+    def add_wave_credit(self, steam64, mission_index, wave_number, timestamp, old_rows):
+
+        #Check the timestamp and steam ID first, so a bad one never claims a slot:
+        if not (0 < timestamp < 0x100000000 and 0 < steam64 < 0x10000000000000000):
+            return False
+
+        #Find the wave's index in the player's row of timestamps:
+        if not 0 <= mission_index < self.missions:
+            return False
+        (start, end) = self.mission_slices[mission_index]
+        index = start + wave_number - 1
+        if not start <= index < end:
+            return False
+
+        #Find the player's slot. (This is find_slot, inlined since this is the hot path.)
+        (keys, rows, mask, shift) = self.table
+        i = ((steam64 * 11400714819323198485) & 0xFFFFFFFFFFFFFFFF) >> shift
+        key = keys[i]
+        while key != steam64 and key != 0:
+            i = (i + 1) & mask
+            key = keys[i]
+
+        #Existing players: leave wave credits they already have alone.
+        timestamps = self.timestamps
+        if key:
+            row = rows[i]
+            start = row*self.row_size
+            if timestamps[start + index]:
+                return False
+            if steam64 not in old_rows:
+                old_rows[steam64] = timestamps[start:start + self.row_size]
+
+        #New players: give them empty rows, then claim the empty slot (growing the table first if needed).
+        #The row number goes in before the steam ID, so request threads never find a steam ID without its rows.
+        else:
+            row = self.count
+            start = len(timestamps)
+            timestamps.extend(self.empty_row)
+            self.bitflags.extend(self.empty_bitflags)
+            if self.count >= self.grow_at:
+                self.grow()
+                (keys, rows, mask, shift) = self.table
+                i = self.find_slot(self.table, steam64)
+            rows[i] = row
+            keys[i] = steam64
+            self.count += 1
+            if steam64 not in old_rows:
+                old_rows[steam64] = None
+
+        timestamps[start + index] = timestamp
+        self.bitflags[row*self.missions + mission_index] |= 1 << wave_number
+        return True
+
+
+
+
+
+#Returns a copy of a player's row, or default if they have no progress:
+
+    def get(self, steam64, default=None):
+        table = self.table
+        i = self.find_slot(table, steam64)
+        if not table[0][i]:
+            return default
+        start = table[1][i]*self.row_size
+        return self.timestamps[start:start + self.row_size]
+
+
+
+
+
+#Returns a copy of a player's mission completion bitflags, or default if they have no progress:
+
+    def get_bitflags(self, steam64, default=None):
+        table = self.table
+        i = self.find_slot(table, steam64)
+        if not table[0][i]:
+            return default
+        start = table[1][i]*self.missions
+        return self.bitflags[start:start + self.missions]
+
+
+
+
+
+#Number of players in the store:
+
+    def __len__(self):
+        return self.count
+
+
+
+
+
+#Iterates over (steam64, row) of every player in the store:
+
+    def items(self):
+        (keys, rows, mask, shift) = self.table
+        row_size = self.row_size
+        return ((x, self.timestamps[y*row_size:(y + 1)*row_size]) for (x, y) in zip(keys, rows) if x)
+
+
+
+
+
+#####################################################
+#####################################################
+#####################################################
+
+
+#Global tour statistics, kept up to date incrementally.
+#
+#Every counter in here is a sum over all players, so a player's contribution can be taken back out just as easily
+#as it was put in. When players earn new wave credits, their old progress is subtracted and their new progress is
+#added back in, instead of going through every player ever again. Building the CSV data from the counters only
+#costs as much as the number of dates in the tour, no matter how many players there are.
+
+class GlobalStatistics(object):
+
+#Init all the counters to zero. mission_slices are the (start, end) slices of each mission's waves in a player's row of
+#timestamps, total_credits the number of wave credits in the tour, and day_buckets the DayBuckets used to find the day
+#of each timestamp.
+
+    def __init__(self, mission_slices, total_credits, day_buckets):
+
+        self.mission_slices = mission_slices
+        self.total_credits = total_credits
+        self.day_buckets = day_buckets
+        self.total_missions = len(mission_slices)
+        self.reset()
+
+
+
+
+
+#Sets all the counters back to zero:
+
+    def reset(self):
+
+        total_credits = self.total_credits
+
+        #The total wave credits earned per wave, per map.
+        #This is used to generate the line graph in quadrant 2 (wave credits vs wave number for each map).
+        self.mission_counter = [[0]*(y - x) for (x, y) in self.mission_slices]
+
+        #The number of players that have earned a set number of wave credits.
+        #This is used to generate the line graph in quadrant 1 (players vs wave credits count).
+        self.credits_counter = [0]*total_credits
+
+        #How many players have participated and completed each mission in the tour:
+        self.participants_counter = [0]*self.total_missions
+        self.completionists_counter = [0]*self.total_missions
+
+        #How many players received a medal:
+        self.medal_recepients = 0
+
+        #The number of new players who participated in the tour each day,
+        #and the number of people who *finished* the tour on each day:
+        self.timestamp_participated_dict = DayCounts()
+        self.timestamp_completed_dict = DayCounts()
+
+        #The number of new players who have played at least 1 wave on each map, for each day, and the number of players
+        #who have beaten each map, on each day. The map index is used to index into these lists.
+        self.map_index_date_participant_counter = [DayCounts() for x in range(self.total_missions)]
+        self.map_index_date_completist_counter = [DayCounts() for x in range(self.total_missions)]
+
+        #The number of UNIQUE wave credits awarded on each day:
+        self.unique_wave_credits_awarded_dict = DayCounts()
+
+
+
+
+
+#Rebuilds the statistics from scratch, out of every player's row of timestamps. timestamps is an array('I') of all
+#the rows back to back, like TimestampStore keeps them.
+#This is vectorized with NumPy if it's installed (and use_numpy isn't turned off). Both ways give the exact same counters.
+
+    def rebuild(self, timestamps, use_numpy=True):
+
+        self.reset()
+        if numpy is not None and use_numpy:
+            self.add_players_numpy(timestamps)
+        else:
+            credits = self.total_credits
+            for x in range(0, len(timestamps), credits):
+                self.add_player(timestamps[x:x + credits])
+
+
+
+
+
+#Adds a player's row of timestamps to the statistics. Use a sign of -1 to take it back out.
+
+    def add_player(self, row, sign=1):
+
+        #Keep a count of how many wave credits this player has earned, and the first and last time they earned one:
+        wave_credits_earned = 0
+        first_timestamp = None
+        last_timestamp = None
+
+        #Keep track of whether the player has completed the tour or not.
+        #Assume they have unless otherwise proven.
+        completed_tour = True
+
+        #Per mission in the row:
+        for (x,(start,end)) in enumerate(self.mission_slices):
+
+            #Did this player complete the mission in full? (There needs to be a single missing wave credit for this to become false.)
+            completed_mission = True
+
+            #The first and last time they earned a wave credit on this mission. (Stays None if they never played it.)
+            first_mission_timestamp = None
+            last_mission_timestamp = None
+
+            #Per wave in the mission:
+            for (i,j) in enumerate(row[start:end]):
+
+                #If this value is 0, that means they didn't earn a wave credit for this wave.
+                #This also means they didn't complete the mission:
+                if not j:
+                    completed_mission = False
+                    continue
+
+                #Raise the mission counter, and the number of wave credits this player has earned:
+                self.mission_counter[x][i] += sign
+                wave_credits_earned += 1
+
+                #Keep track of the first and last timestamps:
+                if first_mission_timestamp is None or j < first_mission_timestamp:
+                    first_mission_timestamp = j
+                if last_mission_timestamp is None or j > last_mission_timestamp:
+                    last_mission_timestamp = j
+
+                #Increment the awarded wave credits dictionary:
+                self.add_to_date(self.unique_wave_credits_awarded_dict, j, sign)
+
+            #If the player completed this mission, raise the completionists counter. Otherwise, they didn't complete the tour:
+            if completed_mission:
+                self.completionists_counter[x] += sign
+            else:
+                completed_tour = False
+
+            #If they didn't participate in this mission by completing at least one wave in full, grind the next iteration:
+            if first_mission_timestamp is None:
+                continue
+
+            #Raise the participation counter for this mission, and count them as a new player on this map on the day they first played it:
+            self.participants_counter[x] += sign
+            self.add_to_date(self.map_index_date_participant_counter[x], first_mission_timestamp, sign)
+
+            #If they beat the mission, do the same for the day they beat it:
+            if completed_mission:
+                self.add_to_date(self.map_index_date_completist_counter[x], last_mission_timestamp, sign)
+
+            #Keep track of the first and last timestamps across the whole tour:
+            if first_timestamp is None or first_mission_timestamp < first_timestamp:
+                first_timestamp = first_mission_timestamp
+            if last_timestamp is None or last_mission_timestamp > last_timestamp:
+                last_timestamp = last_mission_timestamp
+
+        #A player with no wave credits doesn't count towards anything:
+        if first_timestamp is None:
+            return None
+
+        #Increment the global credits counter based on the number of wave credits this player has:
+        self.credits_counter[wave_credits_earned-1] += sign
+
+        #If this player has completed all the missions, raise the medal recepients counter:
+        if completed_tour:
+            self.medal_recepients += sign
+
+        #The smallest timestamp is the time they participated in the tour.
+        #If the player beat the tour, do the same thing with the largest timestamp for the completed players dictionary.
+        self.add_to_date(self.timestamp_participated_dict, first_timestamp, sign)
+        if wave_credits_earned >= self.total_credits:
+            self.add_to_date(self.timestamp_completed_dict, last_timestamp, sign)
+
+
+
+
+
+#Adds every player's row of timestamps to the statistics, using NumPy.
+#
+#The rows are looked at as a (players x wave credits) matrix, without copying them, with 0 for the wave credits a player
+#doesn't have. Every counter is then a sum, minimum or maximum over that matrix, and every per-date counter is a bincount
+#over date indexes.
+
+    def add_players_numpy(self, rows):
+
+        #Build the timestamp matrix. Each row is a player, and the missions' waves are laid out one after another:
+        credits = self.total_credits
+        players = len(rows) // credits
+        if not players:
+            return None
+        timestamps = numpy.frombuffer(rows, dtype=numpy.uint32).reshape(players, credits)
+        earned = timestamps != 0
+
+        #Count the wave credits up into 15 minute blocks of time first. UTC offsets (DST included) are all multiples of
+        #15 minutes, so every block falls on a single local date, and there are far fewer blocks than wave credits:
+        (blocks, block_credits) = numpy.unique(timestamps[earned] // 900, return_counts=True)
+        if not len(blocks):
+            return None
+
+        #Make the day buckets cover the whole tour, then grab their midnights. Dates are indexes into the midnights from here on:
+        day_buckets = self.day_buckets
+        day_buckets.get_day(int(blocks[0])*900)
+        day_buckets.get_day(int(blocks[-1])*900)
+        first_day = day_buckets.first_day
+        midnights = numpy.array(day_buckets.midnights, dtype=numpy.int64)
+
+        #Returns the date indexes of an array of timestamps:
+        get_dates = lambda stamps: numpy.searchsorted(midnights, stamps.astype(numpy.int64), side="right") - 1
+        block_dates = get_dates(blocks*900)
+
+        #Counts up an array of date indexes into a DayCounts:
+        def add_dates(day_counts, dates, weights=None):
+            for (i, x) in enumerate(numpy.bincount(dates, weights, minlength=len(midnights)).tolist()):
+                if x:
+                    day_counts.add(first_day + i, int(x))
+
+        #Per mission:
+        completed_tour = numpy.ones(players, dtype=bool)
+        first_timestamps = numpy.full(players, 0xFFFFFFFF, dtype=numpy.uint32)
+        last_timestamps = numpy.zeros(players, dtype=numpy.uint32)
+        offset = 0
+        for (x, y) in enumerate(self.mission_counter):
+
+            #Cut this mission's waves out of the matrix:
+            mission_timestamps = timestamps[:, offset:offset+len(y)]
+            mission_earned = earned[:, offset:offset+len(y)]
+            offset += len(y)
+
+            #Wave credits earned per wave, and who participated in and completed the mission:
+            for (i, j) in enumerate(mission_earned.sum(axis=0).tolist()):
+                y[i] += j
+            participated = mission_earned.any(axis=1)
+            completed = mission_earned.all(axis=1)
+            self.participants_counter[x] += int(participated.sum())
+            self.completionists_counter[x] += int(completed.sum())
+            completed_tour &= completed
+
+            #The first time each player played this mission, and the time they beat it:
+            first_mission_timestamps = numpy.where(mission_earned, mission_timestamps, 0xFFFFFFFF).min(axis=1)
+            last_mission_timestamps = mission_timestamps.max(axis=1)
+            add_dates(self.map_index_date_participant_counter[x], get_dates(first_mission_timestamps[participated]))
+            add_dates(self.map_index_date_completist_counter[x], get_dates(last_mission_timestamps[completed]))
+
+            numpy.minimum(first_timestamps, first_mission_timestamps, out=first_timestamps)
+            numpy.maximum(last_timestamps, last_mission_timestamps, out=last_timestamps)
+
+        #Unique wave credits awarded per day. (Every wave credit was already counted up into its 15 minute block.)
+        add_dates(self.unique_wave_credits_awarded_dict, block_dates, block_credits)
+
+        #Players per number of wave credits, and medal recepients (players with no wave credits don't count towards anything):
+        wave_credits_earned = earned.sum(axis=1)
+        participated = wave_credits_earned > 0
+        for (i, x) in enumerate(numpy.bincount(wave_credits_earned[participated] - 1, minlength=credits).tolist()):
+            self.credits_counter[i] += x
+        self.medal_recepients += int((completed_tour & participated).sum())
+
+        #The days players joined and finished the tour:
+        add_dates(self.timestamp_participated_dict, get_dates(first_timestamps[participated]))
+        add_dates(self.timestamp_completed_dict, get_dates(last_timestamps[wave_credits_earned >= credits]))
+
+
+
+
+
+#Adds a number to the count of the day of a timestamp, in a DayCounts:
+
+    def add_to_date(self, day_counts, timestamp, amount):
+        day_counts.add(self.day_buckets.get_day(timestamp), amount)
+
+
+
+
+
+#Builds the CSV data that the client uses to display global tour statistics.
+#
+#wave_credits_earned_per_day is the total wave credits given each day (including duplicates),
+#tour_participants is the number of players, and total_credits_awarded is the number of wave credits ever awarded.
+
+    def build_csv(self, wave_credits_earned_per_day, tour_participants, total_credits_awarded):
+
+        #Total unique wave credits can be obtained by summing the awarded wave credits per day:
+        global_credits_acquired = self.unique_wave_credits_awarded_dict.total()
+
+        #Total missions participated and completed can be found by summing the participants and completionists arrays accordingly:
+        total_participated_missions = sum(self.participants_counter)
+        total_completed_missions = sum(self.completionists_counter)
+
+        ##########################################################
+
+        #Now we build the CSV data to transmit to clients.
+        csv_data = list()
+
+        #The mission counter list is transposed. Javascript expects the columns as maps and the wave numbers as rows,
+        #but the counter list has it backwards. All the lists need to be the same length first, so pad them
+        #with -1's until they reach the length of the longest list. (Padded copies - the counters carry on after this.)
+        longest_list_len = len(max(self.mission_counter, key=len))
+        mission_counter = [x + [-1]*(longest_list_len - len(x)) for x in self.mission_counter]
+
+        #Put the mission counter first into the csv data list:
+        for x in zip(*mission_counter):
+            csv_data.append(create_csv_row(x))
+
+        #Add an = as a delimiter:
+        csv_data.append("=")
+
+        #Then put the player wave credits counter in next.
+        #
+        #Leave out the last value from the list because that's the total medal recepients, which we don't want
+        #to include, or else it will skew the chart horribly.
+        csv_data.append(create_csv_row(self.credits_counter[:-1]))
+
+        #Add an = as a delimiter:
+        csv_data.append("=")
+
+        #Participants and completionists counters go next:
+        csv_data.append(create_csv_row(self.participants_counter))
+        csv_data.append(create_csv_row(self.completionists_counter))
+
+        #Add an = as a delimiter:
+        csv_data.append("=")
+
+        #For each date, compute the local and cumulative sum of the relevant data sections.
+
+        #Go through every day that wave credits were awarded on, in order.
+        #Because everything ultimately is measured by wave credit and/or its timestamp, it is safe to use these days.
+        date_keys = tuple(self.unique_wave_credits_awarded_dict.get_days())
+
+        #Using the participants counter dictionary for each map and each date, compute the cumulative sum of participants on each map on each date:
+        cumulative_map_date_participants_counts = [self.compute_successive_sum_dict(x, date_keys) for x in self.map_index_date_participant_counter]
+
+        #Do the same thing with the completists counter dictionary as well:
+        cumulative_map_date_completists_counts  = [self.compute_successive_sum_dict(x, date_keys) for x in self.map_index_date_completist_counter]
+
+        #Now, compute the *grand total* number of missions each player has completed and participated in on each day.
+        #These are NOT stacked dictionaries, but these are the sum of all missions participated/completed across all maps.
+        new_mission_completists = dict()            #Completed
+        new_mission_participants = dict()           #Participated
+
+        #Loop across every date tuple:
+        for x in date_keys:
+
+            #Total missions played by all participants:
+            new_mission_participants[x] = sum(y.get(x) for y in self.map_index_date_participant_counter)
+
+            #Total missions completed by all participants (completists):
+            new_mission_completists[x] = sum(y.get(x) for y in self.map_index_date_completist_counter)
+
+
+        #Now we need to generate the CSV data with all this data in it.
+        #
+        #Put all the dictionaries we have created in a single list:
+        dictionary_list =   cumulative_map_date_participants_counts + cumulative_map_date_completists_counts + [self.timestamp_participated_dict, self.timestamp_completed_dict,
+                            new_mission_participants, new_mission_completists, self.unique_wave_credits_awarded_dict, wave_credits_earned_per_day]
+
+        #Using that dictionary list, generate the CSV rows for each dictionary in it.
+        #Loop across each date key:
+        for x in date_keys:
+
+            #Put the date (Month & Day) in the row first. Flatten it out into (as) a list, since this is a CSV file.
+            row_data = list(self.day_buckets.get_date_key(x))
+
+            #Then for each dictionary, grab the value for this date from it, and put the value into the row list.
+            for y in dictionary_list:
+                row_data.append(y.get(x))
+
+            #Then build a CSV string and put it into the big CSV data list:
+            csv_data.append(create_csv_row(row_data))
+
+
+        #Add an = as a delimiter:
+        csv_data.append("=")
+
+        #The statistics table information go last:
+        global_str = create_csv_row((tour_participants, self.medal_recepients, total_credits_awarded, global_credits_acquired, total_participated_missions, total_completed_missions))
+        csv_data.append(global_str)
+
+        #Then build the full CSV file:
+        return "\n".join(csv_data).encode()
+
+
+
+
+
+#Given a dictionary containing data for each date, return a dictionary that contains
+#the successive sum of the data leading up to each date ("stack the dictionary").
+
+    def compute_successive_sum_dict(self, dates_dict, date_keys):
+
+        #In this dictionary, store the cumulative sum of the data for each date:
+        stacked_dict = dict()
+
+        #Per date key, from day 1 up to today:
+        for (x,y) in enumerate(date_keys):
+
+            #If the cumulative sum dictionary is empty, then init the sum at 0:
+            if not len(stacked_dict):
+                previous_sum = 0
+
+            #Otherwise, grab the sum of the PREVIOUS day:
+            else:
+                previous_key = date_keys[x-1]
+                previous_sum = stacked_dict.get(previous_key, 0)
+
+            #Add the previous sum to this sum and put it in the stacked dictionary:
+            stacked_dict[y] = previous_sum + dates_dict.get(y)
+
+        #Done
+        return stacked_dict
 
 
 
@@ -723,9 +3306,9 @@ class ThreadedHTTPServer(ThreadingMixIn, TCPServer):
 
 class potato(object):
 
-#Init
+#Init. Pre-fork workers pass the path of the loader's snapshot, and the queue to send tour server reports to the loader.
 
-    def __init__(self):
+    def __init__(self, snapshot_path=None, server_reports=None):
 
         #From the CSV files we need:
         #
@@ -743,10 +3326,15 @@ class potato(object):
         #
         #That way, if we happen to reach the Steam API rate limit (which is 100k requests...)
         #then the dummy API key is banned, not the medal API key.
+        #
+        #The steam API's base URL can be changed too, to test against a stand-in server.
+        self.steam_api_url = "https://api.steampowered.com"
         with open("../data/Steam API.csv") as f:
             for x in reader(f):
                 if x[0].lower() == "general":
                     self.steam_api_key = x[1]
+                elif x[0].lower() == "baseurl":
+                    self.steam_api_url = x[1].strip().rstrip("/")
 
         #Grab the TT web API key and build the tour list:
         with open("../data/Tour Information.csv") as f:
@@ -757,69 +3345,170 @@ class potato(object):
                 elif cell.startswith("mvm_"):
                     self.tour_maps_list.append((x[0], int(x[2])))
 
-        #A null tour tuple. This represents a blank tour with no progress made on it.
-        #While we build the null tuple, also compute the total number of wave credits in this tour.
-        self.null_tuple = list()
+        #Where each mission's waves are in a player's row of wave credit timestamps, as (start, end) slices.
+        #(See TimestampStore.) While we build them, also compute the total number of wave credits in this tour.
+        self.mission_slices = list()
         self.total_credits = 0
         for (x,y) in self.tour_maps_list:
+            self.mission_slices.append((self.total_credits, self.total_credits + y))
             self.total_credits += y
-            self.null_tuple.append((None,)*y)
 
         #...actually make it into a tuple:
-        self.null_tuple = tuple(self.null_tuple)
+        self.mission_slices = tuple(self.mission_slices)
 
         #Cache the maximum number of waves any single mission has:
         self.max_waves = max(self.tour_maps_list, key=lambda j: j[1])[1]
 
-        #Now init the tour database:
-
-        #Create the database file:
-        self.db_path = "../data/mvm_titanium_tank_tour_progress.sq3"
-        self.db = Connection(self.db_path, check_same_thread=False)
-
-        #Create the tour progress table. This contains ALL players' tour data.
-        self.db.execute("CREATE TABLE IF NOT EXISTS WaveCredits (Steam64 Text, TimeStamp Int, MissionIndex Int, WaveNumber Int)")
-
-        #Commit the query:
-        self.db.commit()
-
-        #Hold the database file's modification time stamp here.
-        #We will check if the file was updated, and if so, refresh our tour data dictionary cache:
-        self.mod_time = 0
+        #Prebuild the VDF files SRCDS asks for (see serve_vdf_data), for every mission and every value its bitflags can have.
+        #(Bit N is wave N, so a mission with W waves has bitflags below 2**(W+1).) Per mission, indexed by the bitflags:
+        #
+        #- The full tour keyvalue file's line for the mission.
+        #- The whole encoded keyvalue file of just that mission, as a [raw, gzipped] entry like the response cache's.
+        #  Each one is gzipped the first time a client wants it.
+        self.tour_kv_lines = list()
+        self.mission_kv_entries = list()
+        for (x,(y,z)) in enumerate(self.tour_maps_list):
+            self.tour_kv_lines.append(tuple('"{}" "{}"'.format(x, w) for w in range(2 << z)))
+            self.mission_kv_entries.append(tuple([('"mission"\n{\n"%d"\t"%d"\n}' % (x, w)).encode(), None] for w in range(2 << z)))
+
+        #...actually make them into tuples:
+        self.tour_kv_lines = tuple(self.tour_kv_lines)
+        self.mission_kv_entries = tuple(self.mission_kv_entries)
+
+        #Players without any progress get an empty keyvalue file:
+        self.empty_mission_kv_entry = ['"mission"\n{\n}'.encode(), None]
+
+        #Now init the tour database.
+        #(Pre-fork workers never touch it: they read everything out of the loader's snapshot instead.)
+        if snapshot_path is None:
+
+            #Create the database file:
+            self.db_path = "../data/mvm_titanium_tank_tour_progress.sq3"
+            self.db = Connection(self.db_path, check_same_thread=False)
+
+            #Create the tour progress table. This contains ALL players' tour data.
+            #(The medal server owns the schema and migrates it. This is only here so a fresh database can be read.)
+            self.db.execute("CREATE TABLE IF NOT EXISTS WaveCredits (Steam64 Text, TimeStamp Int, MissionIndex Int, WaveNumber Int)")
+
+            #Commit the query:
+            self.db.commit()
+
+            #The medal server puts the database in WAL mode, so our reads never block its writes (and vice versa).
+            #Give the reader a decent page cache (in KiB) and memory-map the database file (in bytes):
+            self.db.execute("PRAGMA cache_size=-32768")
+            self.db.execute("PRAGMA mmap_size=268435456")
+
+            #Hold the database's data version here.
+            #We will check if another connection (the medal server) changed the database, and if so, refresh our tour data dictionary cache.
+            #
+            #The file's modification time can't be used for this: in WAL mode, commits go to the -wal file,
+            #and the database file itself is only touched when the WAL is checkpointed.
+            self.data_version = None
+
+            #Store the rowid of the most-recent loaded database entry.
+            #This allows us to not have to load previously-cached data from the dictionary.
+            self.row_id = 0
+
+            #The medal server sends a UDP datagram to this port every time it commits new wave credits, so we can load them
+            #right away instead of polling the database. The database is still checked every few seconds, in case a datagram
+            #gets lost or the medal server has notifications turned off. If the port can't be used, fall back to polling every second.
+            #(See load_notify_port for which port that is.)
+            notify_port = self.load_notify_port()
+            self.notify_socket = None
+            self.poll_interval = 1
+            if notify_port:
+                self.notify_socket = socket(AF_INET, SOCK_DGRAM)
+                try:
+                    self.notify_socket.bind(("127.0.0.1", notify_port))
+                    self.poll_interval = 5
+                except OSError as e:
+                    print("Can't listen for medal server notifications, polling the database instead:", e)
+                    self.notify_socket.close()
+                    self.notify_socket = None
+
+        #The big tour progress store: every player's wave credit timestamps.
+        self.tour_progress = TimestampStore(self.mission_slices)
+
+        #The dictionary that holds the tour server information.
+        #It also streams its changes to the browsers on the servers page, and takes servers that go offline off the list.
+        self.server_events = ServerEvents()
+        self.server_info_dict = self.server_events
+
+        #IP address rate limiter.
+        #This is used to prevent a single IP address from making too many GET/POST requests to this web server.
+        #(1 request per second, bursts of up to 60, and up to 100000 IP addresses kept track of.)
+        #In pre-fork mode, every worker process has its own rate limiters, so all the rate limits here are per worker.
+        #The -nolimit command line option turns it off, for benchmarks.
+        self.rate_limiter = RateLimiter(1.0, 60, 100000) if "-nolimit" not in argv else RateLimiter(1000000.0, 1000000, 100000)
+
+        #Tour servers that passed the TT API key have their own rate limit, for the requests that don't count towards the one above.
+        #(Every tour server on the same machine shares an IP address: 10 requests per second, bursts of up to 100.)
+        self.server_rate_limiter = RateLimiter(10.0, 100, 1000, "server_rate_limit")
+
+        #Static assets (css, javascript and images) have a rate limit of their own, so they don't eat into the one above.
+        #A page load asks for several of them, and players behind the same NAT share an IP address, so it's more generous:
+        #10 requests per second, bursts of up to 300. (Browsers keep the versioned assets, so repeat visits don't ask again.)
+        self.asset_rate_limiter = RateLimiter(10.0, 300, 100000, "asset_rate_limit") if "-nolimit" not in argv else RateLimiter(1000000.0, 1000000, 100000, "asset_rate_limit")
+
+        #Banned IP addresses, and how long (in seconds) they're banned for.
+        #Use this to drop invalid POST requests that attempt to pass a fake TT API key.
+        self.banned_ips = BanList("../data/mvm_titanium_tank_website_bans.sq3", 100000)
+        self.ban_duration = 7*86400
 
-        #Store the rowid of the most-recent loaded database entry.
-        #This allows us to not have to load previously-cached data from the dictionary.
-        self.row_id = 0
+        #Resolved steam vanity URLs. Names that resolve are kept for a week, and unknown names for an hour:
+        self.vanity_cache = VanityCache("../data/mvm_titanium_tank_vanity_cache.sq3", self.fetch_vanity_url, 7*86400, 3600, 100000)
 
-        #The big tour dictionary:
-        self.tour_progress_dict = dict()
+        #The csv data containing the global tour statistics, and the counters it's built from:
+        self.global_data_csv = (bytes(), bytes(), None, None)
 
-        #The dictionary that holds the tour server information:
-        self.server_info_dict = dict()
+        #Version tags for the ETags: every time the global statistics are rebuilt, their generation goes up.
+        #The instance tag makes sure ETags from before a restart never match.
+        self.start_time = time()
+        self.instance_tag = "{:x}".format(int(self.start_time))
+        self.global_data_generation = 0
+        self.day_buckets = DayBuckets()
+        self.global_statistics = GlobalStatistics(self.mission_slices, self.total_credits, self.day_buckets)
 
-        #IP address rate limit dictionary.
-        #This gets dumped out once a minute, but is otherwise used to prevent a single IP address
-        #from making too many GET/POST requests to this web server.
-        self.ip_requests_count = dict()
+        #Players whose progress changed since the global statistics were last built, paired with their row of
+        #timestamps from back then (None for new players):
+        self.touched_players = dict()
 
-        #Set of banned IP addresses.
-        #Use this to drop invalid POST requests that attempt to pass a fake TT API key.
-        self.banned_post_ips = set()
+        #The row ID of the last wave credit that changed each player's progress, for their data's ETag:
+        self.player_row_ids = dict()
 
-        #The csv data containing the global tour statistics:
-        self.global_data_csv = (bytes(), bytes())
+        #The CSV and VDF data served for each player, so that it isn't rebuilt and gzipped on every request:
+        self.response_cache = ResponseCache(50000)
 
         #For one of the global stats graphs, we want to keep track of the total number
         #of wave credits given each day, including duplicates.
-        self.wave_credits_earned_per_day = dict()
+        self.wave_credits_earned_per_day = DayCounts()
 
-        #Preload all the HTML webpages from the html folder into a dictionary.
+        #Pre-fork mode.
+        #
+        #The loader publishes everything the workers serve to a snapshot, and collects the tour server reports they get.
+        #(See start_publishing.)
+        self.publisher = None
+        self.server_reports = server_reports
+
+        #The workers look players and tour servers up in the loader's snapshot instead of their own dictionaries.
+        #They also take the loader's start time, so that every worker hands out the same ETags.
+        self.snapshot = None
+        if snapshot_path is not None:
+            self.snapshot = SnapshotReader(snapshot_path, self.mission_slices)
+            self.tour_progress = SnapshotView(self.snapshot.get_progress, self.snapshot.get_bitflags)
+            self.player_row_ids = SnapshotView(self.snapshot.get_row_id)
+            self.server_info_dict = SnapshotServers(self.server_events, server_reports)
+            self.start_time = self.snapshot.start_time
+            self.instance_tag = "{:x}".format(int(self.start_time))
+
+        #Preload the css, javascript and images, and then all the HTML webpages from the html folder into a dictionary.
         #
         #This will allow us to serve webpages to the client quickly without hammering the file system,
         #which allows us to skip some I/O overhead.
         #
-        #The javascript, css, and images are served from GitHub so that we can easily update them
-        #with a GitHub commit without having to restart this web server.
+        #The pages link the javascript, css, and images on GitHub. Those links get pointed at the copies we serve
+        #ourselves (see AssetTable), so changes to them need a restart of this web server, just like the pages.
+        self.assets = AssetTable(getcwd())
         self.html_pages =  {
                                 "main":       self.load_html_page("main.html"),
                                 "global":     self.load_html_page("global.html"),
@@ -833,471 +3522,432 @@ class potato(object):
 
 
 
-#Given a HTML file name, load it, compress it down, and return it to the caller.
-#These HTML files are cached globally for a quick web server response time.
-
-    def load_html_page(self, filename):
-
-        #We can trim whitespace from the HTML file, so let's do that:
-        cleaned_html = list()
-        with open(getcwd() + sep + "html" + sep + filename, mode="r", encoding="UTF-8") as f:
-            for x in f:
-                cleaned_html.append(x.strip())
-
-        #Join the strings together, and then gzip the payload:
-        html_str  = "".join(cleaned_html).encode()
-        html_gzip = gzip_compress(html_str)
-
-        #Both of these will be stored in a dictionary for quick lookup on the web server.
-        return html_str, html_gzip
-
-
-
-
-
-#Runs once a second on a worker thread.
-
-    def mainloop(self):
-
-        #For forever:
-        while True:
-
-            #Crash handler safety: Wrap the whole thing on a try/except:
-            try:
-                self.run()
-            except Exception as e:
-                print("Database thread error: ", e)
-
-            #Wait 1 second before checking again:
-            sleep(1)
-
+#Asks the steam web API for the steam64 ID of a vanity URL. Returns None if the vanity URL doesn't belong to anyone.
+#The vanity URL cache calls this when a name isn't cached, so don't call it directly.
 
+    def fetch_vanity_url(self, vanity_url):
 
+        #Reference: https://lab.xpaw.me/steam_api_documentation.html#ISteamUser_ResolveVanityURL_v1
 
+        #Create the GET parameters and build the full API url:
+        params = urlencode({'key':self.steam_api_key, 'vanityurl': vanity_url})
+        url = self.steam_api_url + "/ISteamUser/ResolveVanityURL/v1/?" + params
 
-#Called once every second as a watchdog for the database:
+        #Open the response and read it in. (Don't wait forever on Steam: other threads may be waiting on this lookup.)
+        with urlopen(url, timeout=10) as f:
+            data = f.read().decode()
 
-    def run(self):
+        #Parse the resulting json:
+        json_parser = JSONDecoder()
+        root = json_parser.decode(data)
 
-        #If it's time to dump the rate limit IP addresses dictionary, do it.
-        #The rate limit resets once every minute.
-        if int(time()) % 60 == 0:
-            self.ip_requests_count.clear()
+        #Grab the response node:
+        response_node = root["response"]
 
-        #Check if the database file was modified. If not, then don't do anything:
-        mod_time = getmtime(self.db_path)
-        if mod_time == self.mod_time:
-            return None
+        #If the API call was a success, return the steam ID. Otherwise, nobody has this vanity URL:
+        if response_node["success"] == 1:
+            return int(response_node["steamid"])
+        return None
 
-        #Cache the new modification timestamp:
-        self.mod_time = mod_time
 
-        #Grab everything from the database, including the row ID, and cache it into the tour dictionary:
-        for x in self.db.execute("SELECT rowid, Steam64, TimeStamp, MissionIndex, WaveNumber FROM WaveCredits WHERE rowid > ?", (self.row_id,)):
 
-            #Break up the row's contents:
-            (rowid, steam64, timestamp, mission_index, wave_number) = x
 
-            #Cache the row ID:
-            self.row_id = rowid
 
-            #Insert this database row to the dictionary:
-            self.cache_player_wave_credit(int(steam64), timestamp, mission_index, wave_number)
+#Returns the local UDP port the medal server sends its new wave credit notifications to.
+#
+#That's the medal server's own "notifyport" setting, read from its settings file (Medal Server.csv), so the two always
+#agree. The -notifyport command line option overrides it. 0 means the medal server doesn't send notifications.
 
+    def load_notify_port(self):
 
-        #Then build the big csv data for the global statistics chart.
-        #
-        #The client does a GET request to this server asking for the data, so instead of generating the data while the client
-        #is making their request (which can potentially be expensive), let's generate it right here so that we can shove it
-        #to the client immediately when they ask for it. This means we can compile it once and serve it to infinite clients.
-        #
-        #The one downside is we compile this data even if nobody ever asks for it, but the generation is usually done at a
-        #moment that nobody is accessing the tour site so the performance hit should be unnoticeable.
-        self.build_global_chart_csv()
+        if "-notifyport" in argv:
+            return int(argv[argv.index("-notifyport") + 1])
 
+        #Same default as the medal server:
+        port = 27001
+        if isfile("../data/Medal Server.csv"):
+            with open("../data/Medal Server.csv", mode="r", encoding="UTF-8") as f:
+                for x in reader(f):
+                    if len(x) > 1 and x[0].strip().lower() == "notifyport":
+                        port = int(x[1].strip())
+        return port
 
 
 
 
-#Inserts a wave credit into the tour progress dictionary for the given player:
 
-    def cache_player_wave_credit(self, steam64, timestamp, mission_index, wave_number):
+#Given a HTML file name, load it, compress it down, and return it to the caller.
+#These HTML files are cached globally for a quick web server response time.
 
-        #Using the timestamp of this wave credit, increments the total wave credits awarded per day dictionary:
-        stamp = localtime(timestamp)
-        key = (stamp.tm_mon, stamp.tm_mday)
-        d = self.wave_credits_earned_per_day
-        d[key] = d.get(key, 0) + 1
+    def load_html_page(self, filename):
 
-        #If this steam ID doesn't have anything for it already, put the null tuple in it:
-        if steam64 not in self.tour_progress_dict:
-            self.tour_progress_dict[steam64] = self.null_tuple
+        #We can trim whitespace from the HTML file, so let's do that:
+        cleaned_html = list()
+        with open(getcwd() + sep + "html" + sep + filename, mode="r", encoding="UTF-8") as f:
+            for x in f:
+                cleaned_html.append(x.strip())
 
-        #Then grab the tour tuple out of there:
-        tour_tuple = self.tour_progress_dict[steam64]
+        #Join the strings together, point the asset links at our own copies, and then gzip the payload:
+        html_str  = self.assets.rewrite_links("".join(cleaned_html)).encode()
+        html_gzip = gzip_compress(html_str, 9, mtime=0)
 
-        #Grab this mission's tour tuple out:
-        mission_tuple = tour_tuple[mission_index]
+        #All of these will be stored in a dictionary for quick lookup on the web server, along with an ETag made from the page itself:
+        return html_str, html_gzip, sha1(html_str).hexdigest()[:16]
 
-        #If there's already a timestamp at the given tuple index, that means the player already has this wave credit.
-        #Leave it alone - don't modify it.
-        index = wave_number - 1                         #wave numbers are 1-based on Sourcemod and the medal server but 0-based here, so do wave_number - 1
-        if mission_tuple[index] is not None:
-            return None
 
-        #Insert the timestamp into it:
-        mission_tuple = self.modify_tuple(mission_tuple, index, timestamp)      
 
-        #Then insert the new tuple back into the tour tuple:
-        tour_tuple = self.modify_tuple(tour_tuple, mission_index, mission_tuple)
 
-        #And put it back into the dictionary:
-        self.tour_progress_dict[steam64] = tour_tuple
 
+#Pre-fork mode: starts publishing everything the workers serve to a snapshot, and collecting the tour server
+#reports the workers get. Call this before the database thread starts.
 
+    def start_publishing(self):
 
+        self.publisher = SnapshotPublisher(self.mission_slices, self.start_time)
+        self.server_reports = Queue()
+        Thread(target=self.collect_server_reports, daemon=True).start()
 
 
-#"Modifies" a tuple. This is faster than turning a tuple to a list, mutating it, and then reverting it back.
-#
-#We use tuples as storage since they have a smaller memory footprint than lists do. We rarely modify these
-#containers - they are primarily read-only, so using a list to store them is wasteful in RAM when a tuple
-#does what we want (for the most part) with a smaller memory footprint.
 
-    modify_tuple = lambda self, this, index, value: this[:index] + (value,) + this[index+1:]
 
 
+#Runs forever on the loader's server reports thread: puts the reports the workers send into the tour server
+#information dictionary, and publishes it.
 
+    def collect_server_reports(self):
 
+        while True:
+            try:
 
-#Builds the CSV data that the client uses to display global tour statistics:
+                #Wait for a report, then take any others that are waiting too:
+                (key, value) = self.server_reports.get()
+                self.server_info_dict[key] = value
+                try:
+                    while True:
+                        (key, value) = self.server_reports.get_nowait()
+                        self.server_info_dict[key] = value
+                except Empty:
+                    pass
 
-    def build_global_chart_csv(self):
+                self.publisher.publish_servers(self.server_info_dict.get_servers())
 
-        #Grab the null tuple and turn it into a bunch of lists. Replace the None with 0's as well.
-        #We will use this to count how many wave credits have been earned per mission across all players.
-        #This is used to generate the line graph in quadrant 2 (wave credits vs wave number for each map).
-        mission_counter = [[0]*len(x) for x in self.null_tuple]
+            except Exception as e:
+                print("Server reports thread error: ", e)
+                sleep(1)
 
-        #Use this list to count the number of players that have earned a set number of wave credits.
-        #This is used to generate the line graph in quadrant 1 (players vs wave credits count).
-        credits_counter = [0]*self.total_credits
 
-        #Use these two lists to count how many players have participated and completed each mission in the tour:
-        total_missions = len(self.null_tuple)
-        participants_counter = [0]*total_missions
-        completionists_counter = [0]*total_missions
 
-        #Keep track of how many players received a medal:
-        medal_recepients = 0
 
-        #In this dictionary, pair each date (Month & Day) with the number of new players who participated in the tour that day:
-        timestamp_participated_dict = dict()
 
-        #For this dictionary, similar as the previous one, but store the number of people who *finished* the tour on each day:
-        timestamp_completed_dict = dict()
+#Runs forever on a worker thread.
 
-        #Count the number of new players who have played at least 1 wave on each map, for each day.
-        #This is mostly for the map makers to see how many new players have played on their maps.
-        #
-        #The map index is used to index into this list. Init it with all empty dictionaries:
-        map_index_date_participant_counter = [dict() for x in range(total_missions)]
+    def mainloop(self):
 
-        #Similarly, count the number of players who have beaten each map, on each day:
-        map_index_date_completist_counter = [dict() for x in range(total_missions)]
+        #For forever:
+        while True:
 
-        #Count the number of UNIQUE wave credits awarded on each day.
-        unique_wave_credits_awarded_dict = dict()
+            #Crash handler safety: Wrap the whole thing on a try/except:
+            try:
+                self.run()
+            except Exception as e:
+                print("Database thread error: ", e)
 
-        #Per tour tuple: (Per player's tour progress)
-        for t in self.tour_progress_dict.values():
+            #Sleep until the medal server says it has new wave credits, or until it's time to check the database anyway:
+            self.wait_for_notification()
 
-            #Keep a count of how many wave credits this player has earned:
-            wave_credits_earned = 0
 
-            #In this list, store the timestamps of ALL the wave credits they have earned:
-            timestamp_all_list = list()
 
-            #Keep track of whether the player has completed the tour or not.
-            #Assume they haven't unless otherwise proven.
-            tour_completion_bool_list = [False]*total_missions
 
-            #Per mission in the tour tuple:
-            for (x,y) in enumerate(t):
 
-                #Did this player complete the mission in full?
-                #Assume yes unless otherwise told. (There needs to be a single None in the tuple for this to become false.)
-                completed_mission = True
+#Waits for a notification from the medal server, for up to the poll interval.
+#
+#The datagrams only hold the rowid of the last wave credit committed. Their contents don't matter much, since everything
+#after our own row ID gets loaded from the database either way. When a burst of them is waiting, take them all at once,
+#so that a burst of commits only costs a single refresh.
 
-                #Did this player participate in this mission by completing at least one wave in full?
-                #Assume no unless otherwise told. (There needs to be at least 1 entry that's not None for this to become true.)
-                participated_mission = False
+    def wait_for_notification(self):
 
-                #In this list, store the timestamps of all the wave credits they earned for this mission.
-                #We will use this to count the number of unique players who have played on each map, over time.
-                timestamp_mission_list = list()
+        if self.notify_socket is None:
+            sleep(self.poll_interval)
+            return None
 
-                #Per wave in the mission:
-                for (i,j) in enumerate(y):
+        try:
+            self.notify_socket.settimeout(self.poll_interval)
+            self.notify_socket.recv(64)
+            self.notify_socket.settimeout(0)
+            while True:
+                self.notify_socket.recv(64)
+        except OSError:
+            pass
 
-                    #If this value is set to None, that means they didn't earn a wave credit for this wave.
-                    #This also means they didn't complete the mission, so set that boolean to false:
-                    if j is None:
-                        completed_mission = False
-                        continue
 
-                    #Raise the mission counter: (the total wave credits earned per wave, per map)
-                    mission_counter[x][i] += 1
 
-                    #Raise the number of wave credits this player has earned:
-                    wave_credits_earned += 1
 
-                    #Put this timestamp in both timestamp lists:
-                    timestamp_all_list.append(j)
-                    timestamp_mission_list.append(j)
 
-                    #This player has completed at least one wave in this mission, so set the participation boolean to true:
-                    participated_mission = True
+#Called every time the medal server commits new wave credits, and every few seconds as a watchdog for the database:
 
-                    #Form a timestamp and increment the awarded wave credits dictionary.
-                    stamp = localtime(j)
-                    key = (stamp.tm_mon, stamp.tm_mday)
-                    unique_wave_credits_awarded_dict[key] = unique_wave_credits_awarded_dict.get(key, 0) + 1
-                    
+    def run(self):
 
-                #If the player participated in this mission, raise the participation counter for this mission:
-                if participated_mission:
-                    participants_counter[x] += 1
+        #Check if the database was modified. If not, then don't do anything:
+        data_version = self.db.execute("PRAGMA data_version").fetchone()[0]
+        if data_version == self.data_version:
+            return None
 
-                #Do the same for completionists:
-                if completed_mission:
-                    completionists_counter[x] += 1
+        #Cache the new data version:
+        self.data_version = data_version
 
-                #Put the mission completion boolean into the tour completion boolean list:
-                tour_completion_bool_list[x] = completed_mission
+        #On the very first load, start off with the deduplicated first wave credits table, if the medal server keeps one.
+        if self.row_id == 0:
+            self.load_first_wave_credits()
 
-                #If the mission timestamp list is empty, grind the next iteration:
-                if len(timestamp_mission_list) == 0:
-                    continue
+        #Grab everything from the database, including the row ID, and cache it into the tour dictionary:
+        row_id = self.row_id
+        d = self.wave_credits_earned_per_day
+        for x in self.db.execute("SELECT rowid, Steam64, TimeStamp, MissionIndex, WaveNumber FROM WaveCredits WHERE rowid > ?", (self.row_id,)):
 
-                #Get the smallest timestamp (the first time this player completed a wave on this map), and form a date tuple:
-                stamp = localtime(min(timestamp_mission_list))
-                key = (stamp.tm_mon, stamp.tm_mday)
+            #Break up the row's contents:
+            (rowid, steam64, timestamp, mission_index, wave_number) = x
 
-                #And increment the counter for the appropriate date, for the appropriate map:
-                date_counter_dict = map_index_date_participant_counter[x]
-                date_counter_dict[key] = date_counter_dict.get(key, 0) + 1
+            #Cache the row ID:
+            self.row_id = rowid
 
-                #If they beat the mission, then do the same for the biggest timestamp, but store it in the completist list dictionary:
-                if completed_mission:
-                    stamp = localtime(max(timestamp_mission_list))
-                    key = (stamp.tm_mon, stamp.tm_mday)
-                    date_counter_dict = map_index_date_completist_counter[x]
-                    date_counter_dict[key] = date_counter_dict.get(key, 0) + 1
+            #Using the timestamp of this wave credit, increments the total wave credits awarded per day.
+            #(Wave credits with a bogus timestamp are left out of everything, see cache_player_wave_credit.)
+            if not self.day_buckets.is_valid(timestamp):
+                continue
+            d.add(self.day_buckets.get_day(timestamp), 1)
 
+            #Insert this database row to the dictionary:
+            self.cache_player_wave_credit(int(steam64), timestamp, mission_index, wave_number)
 
-            #Increment the global credits counter based on the number of wave credits this player has:
-            if wave_credits_earned != 0:
-                credits_counter[wave_credits_earned-1] += 1
+        #If nothing new came in (the medal server wrote to some other table), the statistics are still up to date:
+        if self.row_id == row_id and self.global_data_csv[0]:
+            return None
 
-            #If this player has completed all the missions, raise the medal recepients counter:
-            if False not in tour_completion_bool_list:
-                medal_recepients += 1
 
-            #Find the smallest timestamp. That's the time they participated in the tour.
-            #Increment that date by 1, since that's when this player participated in the tour:
-            stamp = localtime(min(timestamp_all_list))
-            key = (stamp.tm_mon, stamp.tm_mday)
-            timestamp_participated_dict[key] = timestamp_participated_dict.get(key, 0) + 1
-            
-            #If the player beat the tour, do the same thing as above, but use the largest
-            #timestamp and increment the completed players dictionary instead.
-            if len(timestamp_all_list) >= self.total_credits:
-                stamp = localtime(max(timestamp_all_list))
-                key = (stamp.tm_mon, stamp.tm_mday)
-                timestamp_completed_dict[key] = timestamp_completed_dict.get(key, 0) + 1
+        #Then build the big csv data for the global statistics chart.
+        #
+        #The client does a GET request to this server asking for the data, so instead of generating the data while the client
+        #is making their request (which can potentially be expensive), let's generate it right here so that we can shove it
+        #to the client immediately when they ask for it. This means we can compile it once and serve it to infinite clients.
+        #
+        #The one downside is we compile this data even if nobody ever asks for it, but the generation is usually done at a
+        #moment that nobody is accessing the tour site so the performance hit should be unnoticeable.
+        self.build_global_chart_csv()
 
 
-        #The last thing to compile data for is the global statistics table.
 
-        #We can get total tour participants from the length of the dictionary:
-        tour_participants = len(self.tour_progress_dict)
 
-        #Total medals is given by the medal_recepients variable.
 
-        #Total wave credits awarded is given by the row ID.
+#Loads the tour progress dictionary from the medal server's deduplicated first wave credits table.
+#
+#That table only holds one row per player, mission and wave, so it doesn't grow with grind sessions.
+#This makes the first load a lot faster than replaying every single wave credit ever earned.
 
-        #Total unique wave credits can be obtained by summing the awarded wave credits by date dictionary:
-        global_credits_acquired = sum(unique_wave_credits_awarded_dict.values())
+    def load_first_wave_credits(self):
 
-        #Total missions participated and completed can be found by summing the participants and completionists arrays accordingly:
-        total_participated_missions = sum(participants_counter)
-        total_completed_missions = sum(completionists_counter)
+        #The table only exists once the medal server has migrated the database. If it's not there, load everything the slow way:
+        if self.db.execute("SELECT 1 FROM sqlite_master WHERE name = 'FirstWaveCredits'").fetchone() is None:
+            return None
 
-        ##########################################################
+        #Read everything in one transaction, so that the tables are consistent with each other:
+        self.db.execute("BEGIN")
+        try:
 
-        #Now we build the CSV data to transmit to clients.
-        csv_data = list()
+            #The medal server keeps track of the wave credit row ID the table is up to date with.
+            #Everything after it gets loaded from the wave credits table afterwards, like usual:
+            row_id = self.db.execute("SELECT Value FROM ServerState WHERE Name = 'FirstCreditsRowID'").fetchone()[0]
+
+            #Put all the first wave credits into the tour dictionary.
+            #The players' data versions are the row ID the table is up to date with, so they can't be mistaken for
+            #players with no data (version 0). If anything goes wrong, the next refresh starts the first load over.
+            self.row_id = row_id
+            for x in self.db.execute("SELECT Steam64, TimeStamp, MissionIndex, WaveNumber FROM FirstWaveCredits"):
+                self.cache_player_wave_credit(*x)
+
+            #The total wave credits awarded per day includes duplicates, so that still needs the raw wave credits table.
+            #Let SQLite count them up by (local) date, which is way faster than going through them here.
+            #Only timestamps the day buckets take are counted, just like when wave credits are loaded one by one.
+            #The counts are only added once they've all been read, so a failed load can't count any day twice when it's retried:
+            (first_timestamp, last_timestamp) = self.day_buckets.get_valid_range()
+            day_counts = list()
+            for (date_string, count) in self.db.execute("""SELECT date(TimeStamp, 'unixepoch', 'localtime'), COUNT(*) FROM WaveCredits
+                                                           WHERE rowid <= ? AND TimeStamp BETWEEN ? AND ? GROUP BY 1""", (row_id, first_timestamp, last_timestamp)):
+                day = self.day_buckets.get_day_from_string(date_string)
+                if day is not None:
+                    day_counts.append((day, count))
+
+            d = self.wave_credits_earned_per_day
+            for (day, count) in day_counts:
+                d.add(day, count)
 
-        #The mission counter list is transposed. Javascript expects the columns as maps and the wave numbers as rows,
-        #but the counter list has it backwards. We need to modify the counter list first.
-        #
-        #First, all the lists need to be the same length.
+        except:
+            self.row_id = 0
+            raise
 
-        #First, find what's the length of the longest list in there:
-        longest_list_len = len(max(mission_counter, key=len))
+        #Done reading:
+        finally:
+            self.db.commit()
 
-        #Then per list in the mission counter:
-        for x in mission_counter:
 
-            #Append enough -1's to the end of the list until it reaches the length of the longest list.
-            #This will make all the lists the same length in the counter list.
-            remaining_entries = longest_list_len - len(x)
-            x.extend((-1,)*remaining_entries)
 
 
-        #Put the mission counter first into the csv data list:
-        for x in zip(*mission_counter):
-            csv_data.append(create_csv_row(x))
 
-        #Add an = as a delimiter:
-        csv_data.append("=")
+#Inserts a wave credit into the tour progress store for the given player:
 
-        #Then put the player wave credits counter in next.
-        #
-        #Delete the last value from the list because that's the total medal recepients, which we don't want
-        #to include, or else it will skew the chart horribly.
-        del credits_counter[len(credits_counter) - 1]
-        csv_data.append(create_csv_row(credits_counter))
+    def cache_player_wave_credit(self, steam64, timestamp, mission_index, wave_number):
 
-        #Add an = as a delimiter:
-        csv_data.append("=")
+        #Leave out wave credits with a bogus timestamp: they can't be put on any day of the tour.
+        #(This also keeps them out of the store, which only takes timestamps that fit in 32 bits.)
+        if not self.day_buckets.is_valid(timestamp):
+            return None
 
-        #Participants and completionists counters go next:
-        csv_data.append(create_csv_row(participants_counter))
-        csv_data.append(create_csv_row(completionists_counter))
+        #Put the timestamp in, and set the wave's bit in the mission's bitflags. (Waves that aren't part of the tour are ignored.)
+        #If the player already has this wave credit, it's left alone, and there's nothing else to do.
+        #Otherwise, the store remembers what the player's progress was before, so the global statistics can swap it out.
+        if not self.tour_progress.add_wave_credit(steam64, mission_index, wave_number, timestamp, self.touched_players):
+            return None
 
-        #Add an = as a delimiter:
-        csv_data.append("=")
+        #Bump the player's data version to the row ID being loaded, and throw out their stale data from the response cache:
+        self.player_row_ids[steam64] = self.row_id
+        self.response_cache.invalidate(steam64)
 
-        #This section is the biggest grindfest in the global statistics computation.
-        #For each date, compute the local and cumulative sum of the relevant data sections.
 
-        #Because the keys to this dictionary are all dates, sort the wave credits awarded dictionary by date:
-        #Because everything ultimately is measured by wave credit and/or its timestamp, it is safe to use the keys of this dictionary.
-        date_keys = tuple(sorted(unique_wave_credits_awarded_dict))
 
-        #Using the participants counter dictionary for each map and each date, compute the cumulative sum of participants on each map on each date:
-        cumulative_map_date_participants_counts = [self.compute_successive_sum_dict(x, date_keys) for x in map_index_date_participant_counter]
 
-        #Do the same thing with the completists counter dictionary as well:
-        cumulative_map_date_completists_counts  = [self.compute_successive_sum_dict(x, date_keys) for x in map_index_date_completist_counter]
 
-        #Now, compute the *grand total* number of missions each player has completed and participated in on each day.
-        #These are NOT stacked dictionaries, but these are the sum of all missions participated/completed across all maps.
-        new_mission_completists = dict()            #Completed
-        new_mission_participants = dict()           #Participated
+#Builds the CSV data that the client uses to display global tour statistics.
+#
+#Only the players whose progress changed since the last time are run through the global statistics:
+#their old progress is taken out, and their new progress is put in.
 
-        #Loop across every date tuple:
-        for x in date_keys:
+    def build_global_chart_csv(self):
 
-            #Total missions played by all participants:
-            for y in map_index_date_participant_counter:
-                new_mission_participants[x] = new_mission_participants.get(x, 0) + y.get(x, 0)
+        #Grab the players that changed and start a fresh batch of them:
+        touched_players = self.touched_players
+        self.touched_players = dict()
 
-            #Total missions completed by all participants (completists):
-            for y in map_index_date_completist_counter:
-                new_mission_completists[x] = new_mission_completists.get(x, 0) + y.get(x, 0)
+        #In pre-fork mode, publish their new progress to the workers before anything else:
+        if self.publisher is not None:
+            self.publisher.publish_players(list(touched_players), self.tour_progress, self.player_row_ids)
 
+        #If a big chunk of the players changed (like on the very first load) and NumPy is around, rebuilding everything is faster:
+        if numpy is not None and len(touched_players) > len(self.tour_progress)//4:
+            self.global_statistics.rebuild(self.tour_progress.timestamps)
 
-        #Now we need to generate the CSV data with all this data in it.
-        #
-        #Put all the dictionaries we have created in a single list:
-        dictionary_list =   cumulative_map_date_participants_counts + cumulative_map_date_completists_counts + [timestamp_participated_dict, timestamp_completed_dict,
-                            new_mission_participants, new_mission_completists, unique_wave_credits_awarded_dict, self.wave_credits_earned_per_day]
-        
-        #Using that dictionary list, generate the CSV rows for each dictionary in it.
-        #Loop across each date key:
-        for x in date_keys:
+        #Otherwise, swap their progress in the statistics:
+        else:
+            for (x, y) in touched_players.items():
+                if y is not None:
+                    self.global_statistics.add_player(y, -1)
+                self.global_statistics.add_player(self.tour_progress.get(x))
 
-            #Put the key in the row first. Flatten it out into (as) a list, since this is a CSV file.
-            row_data = list(x)
+        #Then build the full CSV file and cache it.
+        #Total tour participants is the number of players in the store, and total wave credits awarded is given by the row ID.
+        #That way, we don't have to go through this whole grind every time someone requests global tour information.
+        csv_raw = self.global_statistics.build_csv(self.wave_credits_earned_per_day, len(self.tour_progress), self.row_id)
+        csv_gzip = gzip_compress(csv_raw)
+        self.global_data_generation += 1
+        self.global_data_csv = (csv_raw, csv_gzip, "{}-g{}".format(self.instance_tag, self.global_data_generation), time())
+        if self.publisher is not None:
+            self.publisher.publish_global_csv(self.global_data_csv)
 
-            #Then for each dictionary, grab the value for this date from it, and put the value into the row list. Default to 0 if not found.
-            for y in dictionary_list:
-                row_data.append(y.get(x, 0))
 
-            #Then build a CSV string and put it into the big CSV data list:
-            csv_data.append(create_csv_row(row_data))
 
 
-        #Add an = as a delimiter:
-        csv_data.append("=")
 
-        #The statistics table information go last:
-        global_str = create_csv_row((tour_participants, medal_recepients, self.row_id, global_credits_acquired, total_participated_missions, total_completed_missions))
-        csv_data.append(global_str)
+#####################################################
+#####################################################
+#####################################################
 
-        #Then build the full CSV file and cache it:
-        #That way, we don't have to go through this whole grind every time someone requests global tour information.
-        csv_raw = "\n".join(csv_data).encode()
-        csv_gzip = gzip_compress(csv_raw)
-        self.global_data_csv = (csv_raw, csv_gzip)
+#Given an iterable of numbers, return a comma-delimited string of all those numbers joined together:
+create_csv_row = lambda data: ",".join(str(x) for x in data)                        #Use a generator so that we don't have to construct a list, only to destroy it immediately after
 
+#Given an iterable of rows, return the CSV file of all of them:
+create_csv_rows = lambda rows: "\n".join(create_csv_row(x) for x in rows)
 
 
 
 
-#Given a dictionary containing data for each date, return a dictionary that contains
-#the successive sum of the data leading up to each date ("stack the dictionary").
 
-    def compute_successive_sum_dict(self, dates_dict, date_keys):
+#Serves the website forever: with asyncio, or with a thread per connection.
+#Pre-fork workers serve the listening socket the loader shares with them, instead of binding the port themselves.
 
-        #In this dictionary, store the cumulative sum of the data for each date:
-        stacked_dict = dict()
+def serve_website(port, listen_socket, use_asyncio):
 
-        #Per date key, from day 1 up to today:
-        for (x,y) in enumerate(date_keys):
+    if use_asyncio:
+        handler = AsyncHTTPServer(("", port), listen_socket)
+    elif listen_socket is not None:
+        handler = ThreadedHTTPServer(("", port), TourProgressWebsite, bind_and_activate=False)
+        handler.socket.close()
+        handler.socket = listen_socket
+    else:
+        handler = ThreadedHTTPServer(("", port), TourProgressWebsite)
+    handler.serve_forever()
 
-            #If the cumulative sum dictionary is empty, then init the sum at 0:
-            if not len(stacked_dict):
-                previous_sum = 0
 
-            #Otherwise, grab the sum of the PREVIOUS day:
-            else:
-                previous_key = date_keys[x-1]
-                previous_sum = stacked_dict.get(previous_key, 0)
 
-            #Add the previous sum to this sum and put it in the stacked dictionary:
-            stacked_dict[y] = previous_sum + dates_dict.get(y, 0)
 
-        #Done
-        return stacked_dict
 
+#Runs a pre-fork worker process: serves the website out of the loader's snapshot.
 
+def run_worker(listen_socket, snapshot_path, server_reports, port, use_asyncio):
 
+    #The request handlers go through the global master object, so this process needs its own:
+    global master
+    master = potato(snapshot_path, server_reports)
 
+    #Catch up with the loader, and then keep following it:
+    master.snapshot.update(master)
+    Thread(target=master.snapshot.follow, args=(master,), daemon=True).start()
 
-#####################################################
-#####################################################
-#####################################################
+    serve_website(port, listen_socket, use_asyncio)
 
-#Given an iterable of numbers, return a comma-delimited string of all those numbers joined together:
-create_csv_row = lambda data: ",".join(str(x) for x in data)                        #Use a generator so that we don't have to construct a list, only to destroy it immediately after
 
 
 
 
+#Run this program.
+if __name__ == "__main__":
 
-#Create the main class and run the database thread:
-master = potato()
-Thread(target=master.mainloop).start()
+    #Command line options:
+    #
+    #-asyncio     Serve the website with asyncio (HTTP/1.1, one thread) instead of with a thread per connection.
+    #-prefork N   Serve the website from N worker processes, which share the listening socket. This process only loads
+    #             the database and builds the global statistics, and publishes them to the workers (see SnapshotPublisher).
+    #-port N      Port to serve the website at. (Default 27000)
+    #-nolimit     Turn off the IP address rate limit. Only for benchmarks, where every request comes from the same IP.
+    #-notifyport N  Local UDP port to listen on for the medal server's new wave credit notifications. (Default: the
+    #             "notifyport" setting in Medal Server.csv, which is what the medal server sends them to, or 27001)
+    port = int(argv[argv.index("-port") + 1]) if "-port" in argv else 27000
+    workers = int(argv[argv.index("-prefork") + 1]) if "-prefork" in argv else 0
+    use_asyncio = "-asyncio" in argv
+    engine = " (asyncio)" if use_asyncio else ""
 
-#Run the HTTP server:
-handler = ThreadedHTTPServer(("", 27000), TourProgressWebsite)
-print("Serving tour progress website at port 27000")
-handler.serve_forever()
+    #Create the main class:
+    master = potato()
 
+    #Run the database thread and the HTTP server:
+    if workers == 0:
+        Thread(target=master.mainloop).start()
+        print("Serving tour progress website at port {}{}".format(port, engine))
+        serve_website(port, None, use_asyncio)
 
+    #Pre-fork mode: run the database thread, and start the workers.
+    #(Each worker's rate limiters only see the requests that worker gets, so the rate limits below are per worker:
+    #an IP address can get up to N times as many requests through. Bans are shared, see SnapshotReader.follow.)
+    else:
+        master.start_publishing()
+        Thread(target=master.mainloop, daemon=True).start()
 
+        listen_socket = create_server(("", port), backlog=1024)
+        processes = [Process(target=run_worker, args=(listen_socket, master.publisher.path, master.server_reports, port, use_asyncio)) for x in range(workers)]
+        for x in processes:
+            x.start()
 
+        print("Serving tour progress website at port {} with {} worker processes{}".format(port, workers, engine))
+        try:
+            for x in processes:
+                x.join()
+        finally:
+            master.publisher.close()
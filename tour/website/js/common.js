@@ -19,7 +19,7 @@
 
 
 // Stolen from https://stackoverflow.com/a/4033310
-// Executes a threaded HTTP GET request and passes the response data to a callback function.
+// Executes a threaded HTTP GET request and passes the response data (and the request itself) to a callback function.
 
 function http_get_async(theUrl, callback)
 {
@@ -27,7 +27,7 @@ function http_get_async(theUrl, callback)
     xmlHttp.onreadystatechange = function()
 	{ 
         if (xmlHttp.readyState == 4 && xmlHttp.status == 200)
-            callback(xmlHttp.responseText);
+            callback(xmlHttp.responseText, xmlHttp);
     }
     xmlHttp.open("GET", theUrl, true); // true for asynchronous
     xmlHttp.send(null);
@@ -37,6 +37,23 @@ function http_get_async(theUrl, callback)
 
 
 
+// Returns the server's current time (as a unix timestamp) from the Date header of a finished request.
+// The browser updates the Date header even when it revalidates a cached copy of the data, so this is always fresh.
+// Falls back to the browser's own time if the header is missing.
+
+function get_server_time(xmlHttp)
+{
+	var server_date = Date.parse(xmlHttp.getResponseHeader("Date"));
+	if (isNaN(server_date))
+		server_date = Date.now();
+	
+	return Math.floor(server_date/1000);
+}
+
+
+
+
+
 // Returns the IP address of the server website.
 // If the server ever changes location, the GET requests to the csv files will still work fine.
 
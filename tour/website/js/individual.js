@@ -57,14 +57,15 @@ function get_user_data()
 
 // Called after the tour progress server sends the player tour progress data:
 
-function build_progress_table(csv_data)
+function build_progress_table(csv_data, xmlHttp)
 {
 	// Split the data along newlines to get the rows first:
 	var rows = csv_data.split("\n");
 	
-	// The first row contains the server timestamp, the total wave credits available, and most waves a mission has:
+	// The first row contains the data version, the total wave credits available, and most waves a mission has.
+	// The server timestamp comes from the response's Date header:
 	var row1 = rows[0].split(",");
-	var server_time = Number(row1[0]);
+	var server_time = get_server_time(xmlHttp);
 	var total_credits = Number(row1[1]);
 	var max_waves = Number(row1[2]);
 	
@@ -27,43 +27,148 @@ const g_MapNames =  ["Dockyard", "Downtown", "Powerplant", "Steep", "Teien", "Wa
 
 
 
+// Every server's row of data, by server number:
+var g_Servers = {};
+
+// How many seconds to offset the server's timestamps by, to display them at the client's time zone:
+var g_TimeZoneDifference = 0;
+
+
+
+
+
 // Once the document fully finishes loading, call our main function.
-document.addEventListener('DOMContentLoaded', get_server_data);
+document.addEventListener('DOMContentLoaded', follow_server_data);
 
 
 
 
 
 // Called after the browser loads the page.
+// 
+// The website streams the server information to us as it changes (Server-Sent Events): the whole table first, and then
+// every change to it. Browsers that can't do that request the whole table every 10 seconds instead.
 
-function get_server_data()
+function follow_server_data()
 {
-	// Perform a GET request for the server data:
-	http_get_async("http://"  + get_server_ip_address() + "/TitaniumTank/servers.csv", build_server_table);
+	// Redraw the table every second, so the "sec ago" times keep counting up:
+	setInterval(build_server_table, 1000);
+	
+	if (typeof EventSource === "undefined")
+	{
+		poll_server_data();
+		return;
+	}
+	
+	var events = new EventSource("http://"  + get_server_ip_address() + "/TitaniumTank/events");
+	
+	// The whole table (same as servers.csv):
+	events.addEventListener("servers", function(e)
+	{
+		load_server_csv(e.data);
+	});
+	
+	// A server's data changed:
+	events.addEventListener("update", function(e)
+	{
+		var row = parse_server_row(e.data);
+		g_Servers[row[0]] = row;
+		server_data_changed();
+	});
+	
+	// A server reported in, but only its last updated time changed: (The data is "server number,last updated time".)
+	events.addEventListener("seen", function(e)
+	{
+		var data = e.data.split(",");
+		if (data[0] in g_Servers)
+			g_Servers[data[0]][10] = Number(data[1]);
+		server_data_changed();
+	});
+	
+	// A server stopped reporting, so it went offline:
+	events.addEventListener("remove", function(e)
+	{
+		delete g_Servers[e.data];
+		server_data_changed();
+	});
+	
+	// If the connection drops, the browser reconnects on its own. If the website turns us away (too many browsers
+	// following it), fall back to requesting the whole table:
+	events.onerror = function()
+	{
+		if (events.readyState === EventSource.CLOSED)
+			poll_server_data();
+	};
 }
 
 
 
 
 
-// Called after the tour progress server sends the player tour progress data:
+// Requests the whole table of server data every 10 seconds:
 
-function build_server_table(csv_data)
+function poll_server_data()
+{
+	http_get_async("http://"  + get_server_ip_address() + "/TitaniumTank/servers.csv", load_server_csv);
+	setTimeout(poll_server_data, 10000);
+}
+
+
+
+
+
+// Called when the tour progress server sends the whole table of server data.
+
+function load_server_csv(csv_data)
 {
 	// Split the data along newlines to get the rows first:
 	var rows = csv_data.trim().split("\n");
 	
 	// The first row is the time stamp of the current time on the server.
+	// From that, determine by how many seconds we have to offset the server's timestamps by:
 	var server_time = Number(rows[0]);
+	g_TimeZoneDifference = Math.floor(Date.now()/1000) - server_time;
 	
-	// Take the rest of the rows and *sort* them by player count and map name.
+	// Then put in every server's row:
+	g_Servers = {};
+	for (var i = 1; i < rows.length; i++)
+	{
+		var row = parse_server_row(rows[i]);
+		g_Servers[row[0]] = row;
+	}
+	
+	server_data_changed();
+}
+
+
+
+
+
+// Called every time the server data changes: redraw the table, and show when that happened.
+
+function server_data_changed()
+{
+	build_server_table();
+	
+	// Insert the current timestamp as the last-updated time into the page:
+	var d = new Date();
+	document.getElementById('server_last_update_time').innerHTML = '<p style="text-align:center;"><i>Server info last updated on</i><br/><b>' + d.toLocaleDateString() + ' ' +  d.toLocaleTimeString() + '</b></p>'
+}
+
+
+
+
+
+// Builds the table of server data and puts it into the page:
+
+function build_server_table()
+{
+	// Take the servers' rows and *sort* them by player count and map name.
 	// This will display the servers list in a format that is beneficial to all players.
-	var sorted_server_data = sort_server_data(rows);
+	var sorted_server_data = sort_server_data(Object.keys(g_Servers).map(function(x) { return g_Servers[x]; }));
 	
-	// From the server's timestamp, get the current timestamp and determine by how many seconds we have to offset
-	// the server's timestamps by to display the time stamps at the client's time zone:
 	var current_time = Math.floor(Date.now()/1000);
-	var time_zone_difference = current_time - server_time;
+	var time_zone_difference = g_TimeZoneDifference;
 	
 	// Init the table:
 	var table = ['<table class="server_main_table">\
@@ -169,10 +274,27 @@ function build_server_table(csv_data)
 	
 	// Insert it into the page:
 	document.getElementById('server_table').innerHTML = table.join("");
+}
+
+
+
+
+
+// Splits up a CSV row of server data, and converts the relevant values into integers:
+
+function parse_server_row(csv_row)
+{
+	// Split the data up:
+	var split_data = csv_row.split(",");
 	
-	// Insert the current timestamp as the last-queried time into the page:
-	var d = new Date();
-	document.getElementById('server_last_update_time').innerHTML = '<p style="text-align:center;"><i>Server info last queried on</i><br/><b>' + d.toLocaleDateString() + ' ' +  d.toLocaleTimeString() + '</b></p>'
+	// Convert relevant values into integers:
+	split_data[1] = Number(split_data[1]);		// Is passworded
+	split_data[2] = Number(split_data[2]);		// Map number
+	split_data[3] = Number(split_data[3]);		// ConnectED players
+	split_data[4] = Number(split_data[4]);		// ConnectING players
+	split_data[5] = Number(split_data[5]);		// Wave number
+	split_data[10] = Number(split_data[10]);	// Last updated timestamp
+	return split_data;
 }
 
 
@@ -190,18 +312,9 @@ function sort_server_data(rows)
 	var locked_servers = [];	// Locked servers
 	
 	// Per row in the data set:
-	for (var i = 1; i < rows.length; i++)
+	for (var i = 0; i < rows.length; i++)
 	{
-		// Split the data up:
-		var split_data = rows[i].split(",");
-		
-		// Convert relevant values into integers:
-		split_data[1] = Number(split_data[1]);		// Is passworded
-		split_data[2] = Number(split_data[2]);		// Map number
-		split_data[3] = Number(split_data[3]);		// ConnectED players
-		split_data[4] = Number(split_data[4]);		// ConnectING players
-		split_data[5] = Number(split_data[5]);		// Wave number
-		split_data[10] = Number(split_data[10]);	// Last updated timestamp
+		var split_data = rows[i];
 		
 		// If the server is locked, then put the server information in the locked array and move on.
 		if (split_data[1] === 1)